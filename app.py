@@ -1,30 +1,167 @@
 import traceback  # para mostrar stack trace em DEV
-from flask import Flask, render_template, request, redirect, url_for, session, flash, send_from_directory
+import sys
+from contextlib import contextmanager
+import click
+from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file, abort, g, jsonify, Response, stream_with_context, has_request_context, before_render_template, template_rendered
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
+import json
+import base64
+import time
+import sqlite3
+import functools
+import csv
+import io
+import queue
+import threading
+import hashlib
+import tempfile
+import shutil
+import subprocess
+import uuid
+import re
+import mimetypes
+import zipfile
+import tracemalloc
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from werkzeug.utils import secure_filename
-from sqlalchemy import func, or_
+from werkzeug.exceptions import HTTPException
+from markupsafe import Markup
+from sqlalchemy import func, or_, and_, event, text, insert, update, select, case, delete, union, exists
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+from sqlalchemy.orm import make_transient_to_detached, aliased
+from sqlalchemy import inspect as sa_inspect
+try:
+    from PIL import Image, ImageOps  # opcional: miniaturas dos anexos
+except ImportError:
+    Image = None
+try:
+    import openpyxl  # opcional: importação de planilhas XLSX
+except ImportError:
+    openpyxl = None
+try:
+    import numpy as np  # opcional: análise de vida útil vetorizada
+except ImportError:
+    np = None
 
 # === App / Paths / DB (usa caminho absoluto) ===
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
-DB_PATH = os.path.join(BASE_DIR, "pneutrack.db")
+DB_PATH = os.environ.get("PNEUTRACK_DB") or os.path.join(BASE_DIR, "pneutrack.db")
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = "dev-secret-pneutrack"
-app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{DB_PATH}"
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+
+# Perfil do banco: "dev" (padrão) ou "prod" (WAL, pragmas ajustados e pool dimensionado).
+# DATABASE_URL (ex.: postgresql://...) troca o SQLite por outro banco com os mesmos modelos.
+DB_PROFILE = os.environ.get("PNEUTRACK_DB_PROFILE", "dev")
+DATABASE_URL = os.environ.get("DATABASE_URL", "")
+if DATABASE_URL.startswith("postgres://"):
+    DATABASE_URL = "postgresql://" + DATABASE_URL[len("postgres://"):]
+app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URL or f"sqlite:///{DB_PATH}"
+app.config["DB_BUSY_TIMEOUT_MS"] = int(os.environ.get("PNEUTRACK_BUSY_TIMEOUT_MS", 5000))
+app.config["DB_WRITE_RETRIES"] = int(os.environ.get("PNEUTRACK_WRITE_RETRIES", 3))
+SQLITE_PRAGMAS = {
+    "dev": {"busy_timeout": app.config["DB_BUSY_TIMEOUT_MS"]},
+    "prod": {
+        "journal_mode": "WAL",  # leitores não bloqueiam o escritor
+        "synchronous": "NORMAL",  # seguro com WAL, fsync só no checkpoint
+        "busy_timeout": app.config["DB_BUSY_TIMEOUT_MS"],
+        "mmap_size": int(os.environ.get("PNEUTRACK_MMAP_BYTES", 256 * 1024 * 1024)),
+        "cache_size": -int(os.environ.get("PNEUTRACK_CACHE_KB", 64000)),  # negativo = KiB
+        "temp_store": "MEMORY",
+    },
+}
+if DB_PROFILE == "prod" and DB_PATH != ":memory:":
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_size": int(os.environ.get("PNEUTRACK_POOL_SIZE", 10)),
+        "max_overflow": int(os.environ.get("PNEUTRACK_POOL_OVERFLOW", 5)),
+        "pool_timeout": 30,
+        "pool_recycle": 1800,
+        "pool_pre_ping": bool(DATABASE_URL),
+    }
+
+@event.listens_for(Engine, "connect")
+def _sqlite_pragmas(dbapi_conn, record):
+    if not isinstance(dbapi_conn, sqlite3.Connection):
+        return
+    cur = dbapi_conn.cursor()
+    for k, v in SQLITE_PRAGMAS.get(DB_PROFILE, SQLITE_PRAGMAS["dev"]).items():
+        cur.execute(f"PRAGMA {k}={v}")
+    cur.close()
+
+app.config["USER_CACHE_TTL"] = int(os.environ.get("PNEUTRACK_USER_CACHE_TTL", 60))  # 0 desliga o cache
+# Cache de fragmentos HTML (fila, veículos): "memory" (LRU por processo), "file" (compartilhado
+# entre workers da mesma máquina) ou "off"
+app.config["PAGE_CACHE"] = os.environ.get("PNEUTRACK_PAGE_CACHE", "memory")
+app.config["PAGE_CACHE_TTL"] = int(os.environ.get("PNEUTRACK_PAGE_CACHE_TTL", 300))
+app.config["PAGE_CACHE_ITEMS"] = int(os.environ.get("PNEUTRACK_PAGE_CACHE_ITEMS", 1000))
+# Leitores RFID/código de barras (portais do pátio): PNEUTRACK_SCAN_TOKENS="portao1=tok1,portao2=tok2";
+# leituras repetidas do mesmo código pelo mesmo leitor dentro da janela viram uma só.
+app.config["SCAN_TOKENS"] = {tok: nome for nome, _, tok in (
+    par.partition("=") for par in os.environ.get("PNEUTRACK_SCAN_TOKENS", "").split(",") if "=" in par)}
+app.config["SCAN_WINDOW_S"] = int(os.environ.get("PNEUTRACK_SCAN_WINDOW_S", 30))
+app.config["SCAN_MAX_EVENTS"] = int(os.environ.get("PNEUTRACK_SCAN_MAX_EVENTS", 5000))
+app.config["BARCODE_MAP_TTL"] = int(os.environ.get("PNEUTRACK_BARCODE_MAP_TTL", 300))
+# Instrumentação: requisições acima de SLOW_REQUEST_MS vão para o log "pneutrack.lento" com o SQL
+# mais demorado; TRACE_MEMORY liga o tracemalloc (pico de alocação por rota, custa ~2x de CPU).
+# /metrics exige "Authorization: Bearer <METRICS_TOKEN>"; sem token só atende 127.0.0.1.
+app.config["SLOW_REQUEST_MS"] = int(os.environ.get("PNEUTRACK_SLOW_REQUEST_MS", 500))
+app.config["TRACE_MEMORY"] = os.environ.get("PNEUTRACK_TRACE_MEMORY") == "1"
+app.config["METRICS_TOKEN"] = os.environ.get("PNEUTRACK_METRICS_TOKEN", "")
+app.config["PAGE_CACHE_DIR"] = os.environ.get("PNEUTRACK_PAGE_CACHE_DIR", os.path.join(BASE_DIR, "page_cache"))
 db = SQLAlchemy(app)
 
 # Uploads
 app.config["UPLOAD_FOLDER"] = os.path.join(BASE_DIR, "uploads")
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 app.config["ALLOWED_EXT"] = {"png", "jpg", "jpeg", "pdf"}
+# Limites: por requisição (o Werkzeug recusa com 413 antes de ler o corpo) e por anexo
+# (conferido enquanto os chunks são gravados, inclusive no upload retomável).
+app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("PNEUTRACK_MAX_REQUEST_MB", 32)) * 1024 * 1024
+app.config["ANEXO_MAX_BYTES"] = int(os.environ.get("PNEUTRACK_ANEXO_MAX_MB", 200)) * 1024 * 1024
+app.config["UPLOAD_PARTIAL_DIR"] = os.path.join(app.config["UPLOAD_FOLDER"], ".parciais")
+os.makedirs(app.config["UPLOAD_PARTIAL_DIR"], exist_ok=True)
+# Miniaturas (JPEG, lado máximo THUMB_SIZE) geradas em segundo plano se o Pillow estiver instalado
+app.config["THUMB_DIR"] = os.path.join(app.config["UPLOAD_FOLDER"], ".miniaturas")
+app.config["THUMB_SIZE"] = int(os.environ.get("PNEUTRACK_THUMB_SIZE", 320))
+# Entrega dos anexos pelo servidor web: "" (o Flask envia), "x-sendfile" (Apache/lighttpd)
+# ou "x-accel" (nginx, com location internal apontando ANEXO_ACCEL_PREFIX para UPLOAD_FOLDER)
+app.config["ANEXO_OFFLOAD"] = os.environ.get("PNEUTRACK_ANEXO_OFFLOAD", "")
+app.config["ANEXO_ACCEL_PREFIX"] = os.environ.get("PNEUTRACK_ANEXO_ACCEL_PREFIX", "/_anexos")
+app.config["USE_X_SENDFILE"] = app.config["ANEXO_OFFLOAD"] == "x-sendfile"
+
+# Arquivo morto da auditoria: um SQLite por ano (audit_AAAA.db)
+app.config["AUDIT_ARCHIVE_DIR"] = os.path.join(BASE_DIR, "audit_archive")
+# Tarefas em segundo plano (fila na tabela "tarefa"): JOB_WORKERS threads por processo (0 = só o
+# "flask run-jobs" executa); falhas voltam à fila após JOB_RETRY_S * 2^n s e tarefas sem sinal de
+# vida há JOB_STALE_S (processo que morreu no meio) são reenfileiradas.
+app.config["JOB_WORKERS"] = int(os.environ.get("PNEUTRACK_JOB_WORKERS", 2))
+app.config["JOB_POLL_S"] = float(os.environ.get("PNEUTRACK_JOB_POLL_S", 2))
+app.config["JOB_RETRY_S"] = int(os.environ.get("PNEUTRACK_JOB_RETRY_S", 30))
+app.config["JOB_STALE_S"] = int(os.environ.get("PNEUTRACK_JOB_STALE_S", 600))
+app.config["IMPORT_DIR"] = os.path.join(app.config["UPLOAD_FOLDER"], ".importacoes")
+# Alertas de pneus montados: sulco mínimo (mm), faixa de pressão (psi), troca prevista quando a
+# projeção de desgaste dá menos de ALERTA_PROJECAO_KM até o sulco mínimo. A varredura roda como
+# tarefa a cada ALERTA_INTERVALO_S (0 = só manual/CLI) e reavalia só o que mudou desde a anterior.
+app.config["ALERTA_SULCO_MM"] = float(os.environ.get("PNEUTRACK_ALERTA_SULCO_MM", 3.0))
+app.config["ALERTA_PRESSAO_MIN"] = float(os.environ.get("PNEUTRACK_ALERTA_PRESSAO_MIN", 85))
+app.config["ALERTA_PRESSAO_MAX"] = float(os.environ.get("PNEUTRACK_ALERTA_PRESSAO_MAX", 130))
+app.config["ALERTA_PROJECAO_KM"] = int(os.environ.get("PNEUTRACK_ALERTA_PROJECAO_KM", 5000))
+app.config["ALERTA_INTERVALO_S"] = int(os.environ.get("PNEUTRACK_ALERTA_INTERVALO_S", 300))
+
+IMAGE_EXT = {"png", "jpg", "jpeg"}
 
 def allowed_file(fn):
     return "." in fn and fn.rsplit(".", 1)[1].lower() in app.config["ALLOWED_EXT"]
 
 # ============== MODELS ==============
+# Estratégia de carga: relações N:1 exibidas nas listagens (veiculo da OS/serviço,
+# pneu da posição) usam lazy="joined" para vir no mesmo SELECT da lista e evitar N+1.
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
@@ -38,60 +175,132 @@ class Veiculo(db.Model):
     placa = db.Column(db.String(10), unique=True, nullable=False)
     motorista = db.Column(db.String(80), nullable=False)
     alerta_km_max = db.Column(db.Integer, default=50000)
+    hodometro = db.Column(db.Integer, default=0)  # km atual, atualizado nas movimentações de pneus
+    alterado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)  # marca d'água dos alertas
     eixos = db.relationship("Eixo", backref="veiculo", cascade="all, delete-orphan")
     posicoes = db.relationship("PosicaoPneu", backref="veiculo", cascade="all, delete-orphan")
     historicos = db.relationship("Historico", backref="veiculo", cascade="all, delete-orphan")
-    servicos = db.relationship("ServicoAutorizado", backref="veiculo", cascade="all, delete-orphan")
+    servicos = db.relationship("ServicoAutorizado", backref=db.backref("veiculo", lazy="joined", innerjoin=True), cascade="all, delete-orphan")
 
 class Eixo(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    veiculo_id = db.Column(db.Integer, db.ForeignKey("veiculo.id"), nullable=False)
+    veiculo_id = db.Column(db.Integer, db.ForeignKey("veiculo.id"), nullable=False, index=True)
     nome = db.Column(db.String(60), nullable=False)
     ordem = db.Column(db.Integer, default=0)
 
 class Pneu(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    codigo_barras = db.Column(db.String(64))
+    codigo_barras = db.Column(db.String(64), unique=True, index=True)  # NULL permitido em vários pneus
     numero_fogo = db.Column(db.String(20))
-    numero_serie = db.Column(db.String(40))
+    numero_serie = db.Column(db.String(40), index=True)  # chave da importação em massa
     marca = db.Column(db.String(40))
     modelo = db.Column(db.String(40))
     medida = db.Column(db.String(40))
-    status = db.Column(db.String(20), default="estoque")  # estoque, ativo, conserto, recapagem, vendido, sucateado, rodizio
+    status = db.Column(db.String(20), default="estoque", index=True)  # estoque, ativo, conserto, recapagem, vendido, sucateado, rodizio
     pressao = db.Column(db.Float, default=0)
     sulco = db.Column(db.Float, default=0)
+    alterado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)  # marca d'água dos alertas
 
 class PosicaoPneu(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    veiculo_id = db.Column(db.Integer, db.ForeignKey("veiculo.id"), nullable=False)
+    veiculo_id = db.Column(db.Integer, db.ForeignKey("veiculo.id"), nullable=False, index=True)
     eixo_id = db.Column(db.Integer, db.ForeignKey("eixo.id"))
     pos_label = db.Column(db.String(60), nullable=False)
-    pneu_id = db.Column(db.Integer, db.ForeignKey("pneu.id"))
-    pneu = db.relationship("Pneu")
+    pneu_id = db.Column(db.Integer, db.ForeignKey("pneu.id"), index=True)
+    pneu = db.relationship("Pneu", lazy="joined")
+
+class Medicao(db.Model):
+    # Série temporal append-only; PK (pneu_id, created_at) numa tabela WITHOUT ROWID
+    # deixa as amostras de um pneu contíguas e em ordem (o índice já cobre as leituras).
+    __table_args__ = {"sqlite_with_rowid": False}
+    pneu_id = db.Column(db.Integer, db.ForeignKey("pneu.id"), primary_key=True)
+    created_at = db.Column(db.DateTime, primary_key=True, default=datetime.utcnow)
+    pressao = db.Column(db.Float)
+    sulco = db.Column(db.Float)
+
+class MedicaoResumo(db.Model):
+    # Agregados por dia/semana/mês mantidos incrementalmente (upsert somando);
+    # pneu_id = 0 (FROTA) guarda o agregado da frota inteira.
+    __table_args__ = {"sqlite_with_rowid": False}
+    periodo = db.Column(db.String(10), primary_key=True)  # dia, semana, mes
+    inicio = db.Column(db.Date, primary_key=True)
+    pneu_id = db.Column(db.Integer, primary_key=True)
+    n_sulco = db.Column(db.Integer, default=0)
+    soma_sulco = db.Column(db.Float, default=0)
+    n_pressao = db.Column(db.Integer, default=0)
+    soma_pressao = db.Column(db.Float, default=0)
+
+# Relatórios materializados (mantidos por triggers no SQLite, ver ensure_report_tables)
+class RelCustoVeiculo(db.Model):
+    veiculo_id = db.Column(db.Integer, primary_key=True)
+    total = db.Column(db.Float, default=0)
+
+class RelPneuStatus(db.Model):
+    status = db.Column(db.String(20), primary_key=True)
+    qtd = db.Column(db.Integer, default=0)
+
+class RelSulcoModelo(db.Model):
+    marca = db.Column(db.String(40), primary_key=True)  # '' quando vazio
+    modelo = db.Column(db.String(40), primary_key=True)
+    n = db.Column(db.Integer, default=0)
+    soma = db.Column(db.Float, default=0)
+
+class RelVidaPneu(db.Model):
+    # Vida útil por pneu calculada em lote a partir de EventoPneu (ver rebuild_tire_life)
+    pneu_id = db.Column(db.Integer, primary_key=True)
+    instalacoes = db.Column(db.Integer, default=0)
+    km = db.Column(db.Float, default=0)
+    dias = db.Column(db.Float, default=0)
+    km_sulco = db.Column(db.Float, default=0)  # km dos períodos com sulco medido na entrada e na saída
+    sulco_gasto = db.Column(db.Float, default=0)
+    custo = db.Column(db.Float, default=0)
+    calculado_em = db.Column(db.DateTime)
+
+class RelDesgasteModelo(db.Model):
+    # Desgaste médio (mm/km) por marca/modelo, gravado junto com rel_vida_pneu (projeção dos alertas)
+    __table_args__ = (db.Index("ix_rel_desgaste_modelo", "marca", "modelo"),)
+    id = db.Column(db.Integer, primary_key=True)
+    marca = db.Column(db.String(40))
+    modelo = db.Column(db.String(40))
+    taxa = db.Column(db.Float)
 
 class Historico(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     veiculo_id = db.Column(db.Integer, db.ForeignKey("veiculo.id"))
-    pneu_id = db.Column(db.Integer, db.ForeignKey("pneu.id"))
+    pneu_id = db.Column(db.Integer, db.ForeignKey("pneu.id"), index=True)
     acao = db.Column(db.String(40))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     detalhes = db.Column(db.String(200))
 
+class EventoPneu(db.Model):
+    # Ciclo de vida: instalar/retirar/rodizio com hodômetro e sulco do momento (base da análise de vida)
+    id = db.Column(db.Integer, primary_key=True)
+    pneu_id = db.Column(db.Integer, db.ForeignKey("pneu.id"), nullable=False)
+    veiculo_id = db.Column(db.Integer)  # sem FK: o histórico sobrevive à exclusão do veículo
+    pos_label = db.Column(db.String(60))
+    tipo = db.Column(db.String(10), nullable=False)  # instalar, retirar, rodizio
+    destino = db.Column(db.String(20))  # status do pneu após retirar
+    km = db.Column(db.Integer)
+    sulco = db.Column(db.Float)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (db.Index("ix_evento_pneu_pneu", "pneu_id", "created_at"),)
+
 class ServicoAutorizado(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     veiculo_id = db.Column(db.Integer, db.ForeignKey("veiculo.id"), nullable=False)
     descricao = db.Column(db.String(200), nullable=False)
     status = db.Column(db.String(20), default="autorizado")  # autorizado, concluido, cancelado
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
 class OrdemServico(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     anexos = db.relationship("Anexo", backref="ordem", cascade="all, delete-orphan")
-    veiculo_id = db.Column(db.Integer, db.ForeignKey("veiculo.id"), nullable=False)
+    veiculo_id = db.Column(db.Integer, db.ForeignKey("veiculo.id"), nullable=False, index=True)
+    veiculo = db.relationship("Veiculo", lazy="joined", innerjoin=True)
     descricao = db.Column(db.String(200), nullable=False)
     status = db.Column(db.String(20), default="aberta")  # aberta, aprovada, concluida, cancelada
     custo_total = db.Column(db.Float, default=0)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     itens = db.relationship("ItemOS", backref="os", cascade="all, delete-orphan")
 
 class ItemOS(db.Model):
@@ -100,11 +309,17 @@ class ItemOS(db.Model):
     descricao = db.Column(db.String(120), nullable=False)
     quantidade = db.Column(db.Float, default=1)
     valor_unit = db.Column(db.Float, default=0)
+    pneu_id = db.Column(db.Integer, db.ForeignKey("pneu.id"), index=True)  # custo atribuído a um pneu (opcional)
     @property
     def subtotal(self):
         return round((self.quantidade or 0) * (self.valor_unit or 0), 2)
 
 class AuditLog(db.Model):
+    __table_args__ = (
+        db.Index("ix_audit_log_created", "created_at"),
+        db.Index("ix_audit_log_user_created", "user_email", "created_at"),
+        db.Index("ix_audit_log_entity_created", "entity", "entity_id", "created_at"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_email = db.Column(db.String(120))
     action = db.Column(db.String(50))
@@ -114,6 +329,7 @@ class AuditLog(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class Notificacao(db.Model):
+    __table_args__ = (db.Index("ix_notificacao_role_created", "destino_role", "created_at"),)
     id = db.Column(db.Integer, primary_key=True)
     destino_role = db.Column(db.String(20))  # gestor ou borracheiro
     mensagem = db.Column(db.String(200))
@@ -121,7 +337,30 @@ class Notificacao(db.Model):
     lida = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+class AlertaPneu(db.Model):
+    # Alerta aberto por (pneu, regra): notifica uma vez ao abrir e é apagado quando a condição deixa de valer
+    __table_args__ = (db.UniqueConstraint("pneu_id", "regra", name="uq_alerta_pneu_regra"),
+                      db.Index("ix_alerta_pneu_regra_id", "regra", "id"))
+    id = db.Column(db.Integer, primary_key=True)
+    pneu_id = db.Column(db.Integer, db.ForeignKey("pneu.id"), nullable=False)
+    veiculo_id = db.Column(db.Integer)
+    regra = db.Column(db.String(10), nullable=False)  # sulco, pressao, km, troca
+    mensagem = db.Column(db.String(200))
+    desde = db.Column(db.DateTime, default=datetime.utcnow)
+
+class VarreduraAlerta(db.Model):
+    # Uma linha por varredura; o início da última é a marca d'água da próxima
+    id = db.Column(db.Integer, primary_key=True)
+    inicio = db.Column(db.DateTime, nullable=False)
+    fim = db.Column(db.DateTime)
+    completa = db.Column(db.Boolean, default=False)
+    limites = db.Column(db.String(200))  # limites usados; se mudarem, a próxima varredura é completa
+    avaliados = db.Column(db.Integer, default=0)
+    abertos = db.Column(db.Integer, default=0)
+    encerrados = db.Column(db.Integer, default=0)
+
 class Inspecao(db.Model):
+    __table_args__ = (db.Index("ix_inspecao_veiculo_status", "veiculo_id", "status"),)
     id = db.Column(db.Integer, primary_key=True)
     veiculo_id = db.Column(db.Integer, db.ForeignKey("veiculo.id"), nullable=False)
     status = db.Column(db.String(20), default="aberta")  # aberta, enviada, aprovada, reprovada
@@ -129,41 +368,154 @@ class Inspecao(db.Model):
 
 class InspecaoItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    inspecao_id = db.Column(db.Integer, db.ForeignKey("inspecao.id"), nullable=False)
+    inspecao_id = db.Column(db.Integer, db.ForeignKey("inspecao.id"), nullable=False, index=True)
     titulo = db.Column(db.String(100), nullable=False)
     ok = db.Column(db.Boolean, default=False)
     obs = db.Column(db.String(200))
 
+class ChecklistModelo(db.Model):
+    # Modelo de checklist configurável pelo gestor; itens = lista JSON de títulos
+    id = db.Column(db.Integer, primary_key=True)
+    nome = db.Column(db.String(80), unique=True, nullable=False)
+    itens = db.Column(db.Text, nullable=False, default="[]")
+    padrao = db.Column(db.Boolean, default=False)
+    @property
+    def titulos(self):
+        return json.loads(self.itens or "[]")
+
 class Anexo(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     os_id = db.Column(db.Integer, db.ForeignKey("ordem_servico.id"))
     veiculo_id = db.Column(db.Integer, db.ForeignKey("veiculo.id"))
-    filename = db.Column(db.String(200))
+    filename = db.Column(db.String(200))  # caminho relativo ao UPLOAD_FOLDER (xx/<sha256>.<ext>)
     original = db.Column(db.String(200))
+    sha256 = db.Column(db.String(64), index=True)
+    tamanho = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    @property
+    def imagem(self):
+        return (self.filename or "").rsplit(".", 1)[-1].lower() in IMAGE_EXT
+
+class UploadParcial(db.Model):
+    # Upload retomável em andamento: os bytes ficam em UPLOAD_PARTIAL_DIR/<id>.part
+    id = db.Column(db.String(32), primary_key=True)
+    nome = db.Column(db.String(200), nullable=False)
+    tamanho = db.Column(db.Integer, nullable=False)
+    recebido = db.Column(db.Integer, default=0)
+    os_id = db.Column(db.Integer, db.ForeignKey("ordem_servico.id"))
+    veiculo_id = db.Column(db.Integer, db.ForeignKey("veiculo.id"))
+    user_email = db.Column(db.String(120))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Tarefa(db.Model):
+    # Fila das tarefas em segundo plano (ver JobRunner)
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(40), nullable=False)
+    params = db.Column(db.Text, default="{}")  # JSON
+    status = db.Column(db.String(20), default="pendente")  # pendente, executando, concluida, falhou, cancelada
+    tentativas = db.Column(db.Integer, default=0)
+    max_tentativas = db.Column(db.Integer, default=3)
+    feito = db.Column(db.Integer, default=0)
+    total = db.Column(db.Integer)
+    mensagem = db.Column(db.String(200))
+    resultado = db.Column(db.Text)  # JSON
+    erro = db.Column(db.Text)
+    criado_por = db.Column(db.String(120))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    executar_apos = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    __table_args__ = (db.Index("ix_tarefa_fila", "status", "executar_apos"),)
 
 # ============== HELPERS ==============
+# Cache de usuários por processo: email -> (expira_em, User destacado da sessão).
+# Invalidado pelos eventos de update/delete de User; o TTL limita a defasagem entre processos.
+_user_cache = {}
+
+def _load_user(email):
+    ttl = app.config["USER_CACHE_TTL"]
+    if ttl > 0:
+        hit = _user_cache.get(email)
+        if hit and hit[0] > time.monotonic():
+            return db.session.merge(hit[1], load=False)  # reanexa sem SELECT
+    u = User.query.filter_by(email=email).first()
+    if u and ttl > 0:
+        copia = User(id=u.id, email=u.email, name=u.name, role=u.role)
+        make_transient_to_detached(copia)
+        _user_cache[email] = (time.monotonic() + ttl, copia)
+    return u
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_user_cache(mapper, connection, target):
+    _user_cache.pop(target.email, None)
+    for old in db.inspect(target).attrs.email.history.deleted:
+        _user_cache.pop(old, None)
+
 def current_user():
+    # Resolvido uma vez por request (memoizado em g junto com o email da sessão).
     email = session.get("email")
     if not email:
         return None
-    return User.query.filter_by(email=email).first()
+    memo = g.get("current_user")
+    if memo is None or memo[0] != email:
+        memo = g.current_user = (email, _load_user(email))
+    return memo[1]
 
+# audit()/notify() só adicionam à sessão: entram na mesma transação (e no mesmo commit)
+# da alteração de negócio da rota, então o registro nunca se perde quando ela é gravada.
 def audit(action, entity, entity_id=None, details=""):
-    u = current_user()
+    u = current_user() if has_request_context() else None
     db.session.add(
         AuditLog(
-            user_email=(u.email if u else None),
+            user_email=(u.email if u else g.get("usuario_tarefa")),  # em tarefa: quem enfileirou
             action=action,
             entity=entity,
             entity_id=entity_id,
             details=details,
         )
     )
-    db.session.commit()
 
-def login_required(role=None):
+def _is_busy(e):
+    msg = str(e.orig).lower() if getattr(e, "orig", None) else str(e).lower()
+    return "database is locked" in msg or "database is busy" in msg
+
+def retry_on_busy(fn):
+    # Reexecuta a view de escrita (após rollback) quando o SQLite responde "database is locked".
+    # Só para views cujo efeito fica todo no banco e que podem reler a requisição (form/JSON em
+    # cache, arquivo relido do início): nada de arquivos gravados/movidos nem corpo lido em stream.
+    @functools.wraps(fn)
+    def inner(*args, **kwargs):
+        return _repetir_se_ocupado(lambda: fn(*args, **kwargs))
+    return inner
+
+def write_with_retry(aplicar):
+    # Executa aplicar() (só operações no banco) e faz o commit, repetindo os dois em banco ocupado.
+    # Para views que não podem ser reexecutadas inteiras: o arquivo é lido/gravado uma vez, fora daqui.
+    def gravar():
+        r = aplicar()
+        db.session.commit()
+        return r
+    return _repetir_se_ocupado(gravar)
+
+def _repetir_se_ocupado(fn):
+    tentativas = app.config["DB_WRITE_RETRIES"]
+    for n in range(tentativas + 1):
+        try:
+            return fn()
+        except OperationalError as e:
+            db.session.rollback()
+            if not _is_busy(e) or n == tentativas:
+                raise
+            app.logger.warning("Banco ocupado em %s, tentativa %d/%d",
+                               request.endpoint if has_request_context() else "-", n + 1, tentativas)
+            time.sleep(0.05 * 2 ** n)
+
+def login_required(role=None, retry=False):
+    # retry=True: o POST da view é reexecutado em banco ocupado (ver retry_on_busy)
     def decorator(fn):
+        write_fn = retry_on_busy(fn) if retry else fn
         def inner(*args, **kwargs):
             user = current_user()
             if not user:
@@ -171,6 +523,8 @@ def login_required(role=None):
             if role and user.role != role:
                 flash("Acesso negado para este perfil.", "error")
                 return redirect(url_for("home"))
+            if request.method == "POST":
+                return write_fn(*args, **kwargs)
             return fn(*args, **kwargs)
         inner.__name__ = fn.__name__
         return inner
@@ -178,11 +532,1196 @@ def login_required(role=None):
 
 def notify(destino_role, mensagem, link="#"):
     db.session.add(Notificacao(destino_role=destino_role, mensagem=mensagem, link=link))
+
+def notify_many(destino_role, itens):
+    # itens: [(mensagem, link)] num INSERT em lote; o contador do SSE recebe o total no commit
+    if not itens:
+        return
+    agora = datetime.utcnow()
+    db.session.execute(insert(Notificacao), [{"destino_role": destino_role, "mensagem": m[:200], "link": link,
+                                              "lida": False, "created_at": agora} for m, link in itens])
+    db.session.info.setdefault("notif_eventos", []).append((destino_role, len(itens), None))
+
+# ---------- PUB/SUB DE NOTIFICAÇÕES ----------
+class NotificationHub:
+    # Pub/sub em processo por perfil (alimenta o SSE) + contador de não lidas por perfil.
+    # O contador é semeado com COUNT(*) e depois só recebe deltas; o TTL ressemeia para
+    # absorver escritas feitas por outros processos.
+    def __init__(self, ttl=60, maxsize=100):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._subs = {}
+        self._unread = {}
+
+    def subscribe(self, role):
+        q = queue.Queue(maxsize=self.maxsize)
+        with self._lock:
+            self._subs.setdefault(role, set()).add(q)
+        return q
+
+    def unsubscribe(self, role, q):
+        with self._lock:
+            self._subs.get(role, set()).discard(q)
+
+    def publish(self, role, evento, dados):
+        with self._lock:
+            subs = list(self._subs.get(role, ()))
+        for q in subs:
+            try:
+                q.put_nowait((evento, dados))
+            except queue.Full:
+                pass  # cliente lento: perde o evento, o contador segue correto no próximo
+
+    def unread(self, role):
+        with self._lock:
+            hit = self._unread.get(role)
+            if hit and hit[0] > time.monotonic():
+                return hit[1]
+        n = Notificacao.query.filter_by(destino_role=role, lida=False).count()
+        with self._lock:
+            self._unread[role] = (time.monotonic() + self.ttl, n)
+        return n
+
+    def adjust(self, role, delta):
+        with self._lock:
+            hit = self._unread.get(role)
+            if hit:
+                self._unread[role] = (hit[0], max(0, hit[1] + delta))
+                return self._unread[role][1]
+        return None
+
+notification_hub = NotificationHub()
+
+def notify_read(role, n):
+    # registra n notificações marcadas como lidas; aplicado ao contador após o commit
+    if n:
+        db.session.info.setdefault("notif_eventos", []).append((role, -n, None))
+
+@event.listens_for(db.session, "after_flush")
+def _collect_notifications(sess, flush_context):
+    novas = [o for o in sess.new if isinstance(o, Notificacao)]
+    for n in novas:
+        sess.info.setdefault("notif_eventos", []).append((n.destino_role, 1, {
+            "id": n.id, "mensagem": n.mensagem, "link": n.link,
+            "created_at": (n.created_at or datetime.utcnow()).isoformat(),
+        }))
+
+@event.listens_for(db.session, "after_commit")
+def _publish_notifications(sess):
+    for role, delta, dados in sess.info.pop("notif_eventos", []):
+        n = notification_hub.adjust(role, delta)
+        if dados:
+            notification_hub.publish(role, "notificacao", dict(dados, nao_lidas=n))
+        else:
+            notification_hub.publish(role, "contador", {"nao_lidas": n})
+
+@event.listens_for(db.session, "after_rollback")
+def _discard_notifications(sess):
+    sess.info.pop("notif_eventos", None)
+
+@app.context_processor
+def inject_unread():
+    u = current_user()
+    return {"unread_count": notification_hub.unread(u.role) if u else 0}
+
+# ---------- CACHE DE FRAGMENTOS ----------
+# Guarda o HTML já renderizado de trechos que mudam pouco (fila, lista e detalhe de veículo).
+# Cada fragmento leva tags ("Veiculo", "veiculo:3", "pneu:7"...); ao commitar uma alteração
+# nesses modelos as tags tocadas recebem um carimbo de tempo e fragmentos renderizados antes
+# dele deixam de valer. O carimbo do fragmento é tirado antes das queries, então uma escrita
+# que commita durante a renderização também invalida o resultado.
+class MemoryCache:
+    # LRU com TTL, por processo
+    def __init__(self, ttl, max_itens):
+        self.ttl = ttl
+        self.max_itens = max_itens
+        self._dados = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def get(self, chave):
+        with self._lock:
+            item = self._dados.get(chave)
+            if item is None:
+                return None
+            if item[0] + self.ttl < time.time():
+                del self._dados[chave]
+                return None
+            self._dados.move_to_end(chave)
+            return item
+
+    def set(self, chave, item):
+        with self._lock:
+            self._dados[chave] = item
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.max_itens:
+                self._dados.popitem(last=False)
+
+    def marcar(self, tags):
+        agora = time.time()
+        with self._lock:
+            self._tags.update((t, agora) for t in tags)
+            if len(self._tags) > 10 * self.max_itens:
+                # carimbos mais velhos que o TTL não invalidam mais nada
+                self._tags = {t: ts for t, ts in self._tags.items() if ts + self.ttl >= agora}
+
+    def marca(self, tags):
+        with self._lock:
+            return max((self._tags.get(t, 0) for t in tags), default=0)
+
+    def clear(self):
+        with self._lock:
+            self._dados.clear()
+            self._tags.clear()
+
+class FileCache:
+    # Um arquivo JSON por fragmento ([ts, tags, html]; nada executável, ao contrário de pickle);
+    # o carimbo de cada tag é o mtime de um arquivo vazio.
+    def __init__(self, ttl, pasta):
+        self.ttl = ttl
+        self.pasta = pasta
+        self._gravacoes = 0
+        os.makedirs(os.path.join(pasta, "tags"), exist_ok=True)
+
+    def _arquivo(self, chave, sub=""):
+        return os.path.join(self.pasta, sub, hashlib.sha1(chave.encode()).hexdigest())
+
+    def get(self, chave):
+        try:
+            with open(self._arquivo(chave), encoding="utf-8") as f:
+                ts, tags, html = json.load(f)
+        except (OSError, ValueError, TypeError):  # ausente, corrompido ou de outro formato
+            return None
+        return (ts, tags, html) if ts + self.ttl >= time.time() else None
+
+    def set(self, chave, item):
+        destino = self._arquivo(chave)
+        tmp = f"{destino}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(item, f)
+        os.replace(tmp, destino)
+        self._gravacoes += 1
+        if self._gravacoes % 500 == 0:
+            self._limpar()
+
+    def marcar(self, tags):
+        for t in tags:
+            path = self._arquivo(t, "tags")
+            with open(path, "a"):
+                os.utime(path)
+
+    def marca(self, tags):
+        ts = 0
+        for t in tags:
+            try:
+                ts = max(ts, os.stat(self._arquivo(t, "tags")).st_mtime)
+            except FileNotFoundError:
+                pass
+        return ts
+
+    def _limpar(self):
+        corte = time.time() - self.ttl
+        for sub in ("", "tags"):
+            with os.scandir(os.path.join(self.pasta, sub)) as it:
+                for e in it:
+                    if e.is_file() and e.stat().st_mtime < corte:
+                        try:
+                            os.remove(e.path)
+                        except FileNotFoundError:
+                            pass
+
+    def clear(self):
+        for sub in ("", "tags"):
+            with os.scandir(os.path.join(self.pasta, sub)) as it:
+                for e in it:
+                    if e.is_file():
+                        os.remove(e.path)
+
+class FragmentCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.stats = {}  # nome -> {"hits", "misses"}
+        self.invalidacoes = 0
+        self._lock = threading.Lock()
+
+    def _conta(self, nome, campo):
+        with self._lock:
+            d = self.stats.setdefault(nome, {"hits": 0, "misses": 0})
+            d[campo] += 1
+
+    def render(self, nome, chave, gerar):
+        # gerar() -> (html, tags). Devolve o HTML do cache se nenhuma tag mudou desde a renderização.
+        if self.backend is None:
+            return Markup(gerar()[0])
+        chave = f"{nome}|{chave}"
+        item = self.backend.get(chave)
+        if item and self.backend.marca(item[1]) < item[0]:
+            self._conta(nome, "hits")
+            return Markup(item[2])
+        self._conta(nome, "misses")
+        inicio = time.time()
+        html, tags = gerar()
+        self.backend.set(chave, (inicio, tuple(tags), str(html)))
+        return Markup(html)
+
+    def invalidate(self, tags):
+        if self.backend is not None and tags:
+            self.backend.marcar(tags)
+            with self._lock:
+                self.invalidacoes += len(tags)
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+def _page_cache_backend():
+    tipo = app.config["PAGE_CACHE"]
+    if tipo == "file":
+        return FileCache(app.config["PAGE_CACHE_TTL"], app.config["PAGE_CACHE_DIR"])
+    if tipo == "memory":
+        return MemoryCache(app.config["PAGE_CACHE_TTL"], app.config["PAGE_CACHE_ITEMS"])
+    return None
+
+page_cache = FragmentCache(_page_cache_backend())
+
+def cached_fragment(nome, gerar, *vary):
+    # Chave = fragmento + perfil + URL (página/filtros) + valores extras.
+    u = current_user()
+    return page_cache.render(nome, "|".join([u.role if u else "", request.full_path, *map(str, vary)]), gerar)
+
+def _cache_tags(o):
+    if isinstance(o, Veiculo):
+        return {"Veiculo", f"veiculo:{o.id}"}
+    if isinstance(o, Pneu):
+        return {f"pneu:{o.id}"}
+    if isinstance(o, (Eixo, PosicaoPneu, Anexo)) and o.veiculo_id:
+        return {f"veiculo:{o.veiculo_id}"}
+    return set()
+
+@event.listens_for(db.session, "after_flush")
+def _collect_cache_tags(sess, flush_context):
+    tags = set()
+    for o in (*sess.new, *sess.dirty, *sess.deleted):
+        tags |= _cache_tags(o)
+    if tags:
+        sess.info.setdefault("cache_tags", set()).update(tags)
+
+@event.listens_for(db.session, "do_orm_execute")
+def _collect_bulk_cache_tags(state):
+    # INSERT/UPDATE/DELETE em lote não passam pelo flush: por id quando os parâmetros
+    # trazem a chave, senão a tag "<Modelo>*", que todo fragmento dependente carrega.
+    if not (state.is_insert or state.is_update or state.is_delete) or state.bind_mapper is None:
+        return
+    cls = state.bind_mapper.class_
+    if cls not in (Veiculo, Pneu, Eixo, PosicaoPneu, Anexo):
+        return
+    params = state.parameters if isinstance(state.parameters, list) else None
+    if cls is Pneu and params and all("id" in p for p in params):
+        tags = {f"pneu:{p['id']}" for p in params}
+    else:
+        tags = {f"{cls.__name__}*"} | ({"Veiculo"} if cls is Veiculo else set())
+    state.session.info.setdefault("cache_tags", set()).update(tags)
+
+@event.listens_for(db.session, "after_commit")
+def _invalidate_cache_tags(sess):
+    page_cache.invalidate(sess.info.pop("cache_tags", None))
+
+@event.listens_for(db.session, "after_rollback")
+def _discard_cache_tags(sess):
+    sess.info.pop("cache_tags", None)
+
+# ---------- MAPA CÓDIGO DE BARRAS -> PNEU ----------
+# Carregado com um SELECT na primeira leitura e mantido pelos eventos de sessão: edições de
+# codigo_barras entram no mapa no commit; escritas em lote em pneu forçam recarga. O TTL
+# recarrega para absorver edições de outros processos e códigos ausentes caem num SELECT IN.
+class BarcodeIndex:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._mapa = None
+        self._carregado = 0
+        self._geracao = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._mapa = None
+            self._geracao += 1
+
+    def apply(self, mudancas):
+        # mudancas: [(codigo_antigo, codigo_novo, pneu_id)]
+        with self._lock:
+            self._geracao += 1
+            if self._mapa is None:
+                return
+            for antigo, novo, pid in mudancas:
+                if antigo and self._mapa.get(antigo) == pid:
+                    del self._mapa[antigo]
+                if novo:
+                    self._mapa[novo] = pid
+
+    def _carregar(self):
+        with self._lock:
+            if self._mapa is not None and self._carregado + self.ttl > time.monotonic():
+                return self._mapa
+            geracao = self._geracao
+        mapa = dict(db.session.execute(select(Pneu.codigo_barras, Pneu.id).where(Pneu.codigo_barras.is_not(None))).all())
+        with self._lock:
+            if self._geracao == geracao:  # nenhum commit mudou códigos durante o SELECT
+                self._mapa, self._carregado = mapa, time.monotonic()
+        return mapa
+
+    def resolve(self, codigos):
+        mapa = self._carregar()
+        achados = {c: mapa[c] for c in codigos if c in mapa}
+        faltam = [c for c in codigos if c not in achados]
+        novos = {}
+        for lote in chunks(faltam):
+            novos.update(db.session.execute(select(Pneu.codigo_barras, Pneu.id).where(Pneu.codigo_barras.in_(lote))).all())
+        if novos:
+            with self._lock:
+                if self._mapa is mapa:
+                    mapa.update(novos)
+            achados.update(novos)
+        return achados
+
+barcode_index = BarcodeIndex(app.config["BARCODE_MAP_TTL"])
+
+@event.listens_for(db.session, "after_flush")
+def _collect_barcode_changes(sess, flush_context):
+    mudancas = []
+    for o in sess.new:
+        if isinstance(o, Pneu) and o.codigo_barras:
+            mudancas.append((None, o.codigo_barras, o.id))
+    for o in sess.deleted:
+        if isinstance(o, Pneu) and o.codigo_barras:
+            mudancas.append((o.codigo_barras, None, o.id))
+    for o in sess.dirty:
+        if isinstance(o, Pneu):
+            hist = sa_inspect(o).attrs.codigo_barras.history
+            if hist.has_changes():
+                mudancas.append((hist.deleted[0] if hist.deleted else None, hist.added[0] if hist.added else None, o.id))
+    if mudancas:
+        sess.info.setdefault("barcode_mudancas", []).extend(mudancas)
+
+@event.listens_for(db.session, "do_orm_execute")
+def _collect_bulk_barcode_changes(state):
+    if state.bind_mapper is None or state.bind_mapper.class_ is not Pneu:
+        return
+    if state.is_update and isinstance(state.parameters, list) and not any("codigo_barras" in p for p in state.parameters):
+        return  # UPDATE em lote por id que não mexe no código (ex.: medições)
+    if state.is_insert or state.is_update or state.is_delete:
+        state.session.info["barcode_recarregar"] = True
+
+@event.listens_for(db.session, "after_commit")
+def _apply_barcode_changes(sess):
+    mudancas = sess.info.pop("barcode_mudancas", None)
+    if sess.info.pop("barcode_recarregar", False):
+        barcode_index.invalidate()
+    elif mudancas:
+        barcode_index.apply(mudancas)
+
+@event.listens_for(db.session, "after_rollback")
+def _discard_barcode_changes(sess):
+    sess.info.pop("barcode_mudancas", None)
+    sess.info.pop("barcode_recarregar", None)
+
+@contextmanager
+def count_queries():
+    # Conta os statements SQL executados no bloco (usado pelo check-queries).
+    stmts = []
+    def _on_execute(conn, cursor, statement, params, context, executemany):
+        stmts.append(statement)
+    event.listen(db.engine, "before_cursor_execute", _on_execute)
+    try:
+        yield stmts
+    finally:
+        event.remove(db.engine, "before_cursor_execute", _on_execute)
+
+def chunks(seq, n=500):
+    # fatias para IN (...) sem estourar o limite de parâmetros do SQLite
+    seq = list(seq)
+    for i in range(0, len(seq), n):
+        yield seq[i:i + n]
+
+def _inserir(model, linhas, ids=False):
+    # INSERT em lote; com ids=True devolve as chaves na ordem das linhas (RETURNING)
+    novos = []
+    for lote in chunks(linhas, 2000):
+        if ids:
+            stmt = insert(model).returning(model.id, sort_by_parameter_order=True)
+            novos += db.session.execute(stmt, lote).scalars().all()
+        else:
+            db.session.execute(insert(model), lote)
+    return novos
+
+def read_payload_rows(list_key):
+    # Lê linhas de JSON (lista ou {list_key: [...]}) ou CSV (corpo text/csv ou arquivo "arquivo").
+    # Retorna (linhas, campos_do_topo) ou lança ValueError.
+    f = request.files.get("arquivo")
+    if f:
+        f.stream.seek(0)  # upload já em disco/memória: uma nova tentativa da view relê do início
+        texto = io.TextIOWrapper(f.stream, encoding="utf-8-sig")
+        try:
+            return list(csv.DictReader(texto)), dict(request.form)
+        finally:
+            texto.detach()  # sem fechar o arquivo do upload junto com o wrapper
+    if request.mimetype == "text/csv":
+        return list(csv.DictReader(io.StringIO(request.get_data(as_text=True)))), dict(request.args)
+    data = request.get_json(silent=True)
+    if isinstance(data, list):
+        linhas, topo = data, {}
+    elif isinstance(data, dict) and isinstance(data.get(list_key), list):
+        linhas, topo = data[list_key], data
+    else:
+        raise ValueError(f"Envie JSON (lista ou {{'{list_key}': [...]}}) ou CSV.")
+    ruins = [i for i, ln in enumerate(linhas) if not isinstance(ln, dict)]
+    if ruins:
+        raise ValueError(f"Cada item de '{list_key}' deve ser um objeto JSON (itens inválidos: {ruins[:10]}).")
+    return linhas, topo
+
+def dialect_insert(model):
+    # INSERT com on_conflict_do_update (upsert) do dialeto em uso
+    if db.engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        return pg_insert(model)
+    from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+    return sqlite_insert(model)
+
+# ---------- SÉRIE DE MEDIÇÕES ----------
+PERIODOS = ("dia", "semana", "mes")
+FROTA = 0
+RESUMO_SOMAS = ["n_sulco", "soma_sulco", "n_pressao", "soma_pressao"]
+
+def inicio_periodo(ts, periodo):
+    d = ts.date()
+    if periodo == "semana":
+        return d - timedelta(days=d.weekday())
+    if periodo == "mes":
+        return d.replace(day=1)
+    return d
+
+def record_measurements(amostras):
+    # amostras: [{"pneu_id", "created_at", "pressao", "sulco"}]. Grava a série e soma nos
+    # resumos (por pneu e da frota) com um upsert em lote, na transação corrente.
+    amostras = [a for a in amostras if a.get("pressao") is not None or a.get("sulco") is not None]
+    if not amostras:
+        return
+    db.session.execute(insert(Medicao), [
+        {"pneu_id": a["pneu_id"], "created_at": a["created_at"], "pressao": a.get("pressao"), "sulco": a.get("sulco")}
+        for a in amostras
+    ])
+    acc = {}
+    for a in amostras:
+        for periodo in PERIODOS:
+            inicio = inicio_periodo(a["created_at"], periodo)
+            for pid in (a["pneu_id"], FROTA):
+                r = acc.setdefault((periodo, inicio, pid), {"periodo": periodo, "inicio": inicio, "pneu_id": pid,
+                                                            **{c: 0 for c in RESUMO_SOMAS}})
+                if a.get("sulco") is not None:
+                    r["n_sulco"] += 1; r["soma_sulco"] += a["sulco"]
+                if a.get("pressao") is not None:
+                    r["n_pressao"] += 1; r["soma_pressao"] += a["pressao"]
+    _somar_resumos(list(acc.values()))
+
+def _somar_resumos(linhas):
+    t = MedicaoResumo.__table__
+    stmt = dialect_insert(t)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[t.c.periodo, t.c.inicio, t.c.pneu_id],
+        set_={c: t.c[c] + stmt.excluded[c] for c in RESUMO_SOMAS},
+    )
+    db.session.execute(stmt, linhas)
+
+def forget_measurements(pneu_id):
+    # Remove a série de um pneu e desconta seus resumos do agregado da frota.
+    proprios = MedicaoResumo.query.filter_by(pneu_id=pneu_id).all()
+    if proprios:
+        _somar_resumos([{"periodo": r.periodo, "inicio": r.inicio, "pneu_id": FROTA,
+                         **{c: -getattr(r, c) for c in RESUMO_SOMAS}} for r in proprios])
+    MedicaoResumo.query.filter_by(pneu_id=pneu_id).delete()
+    Medicao.query.filter_by(pneu_id=pneu_id).delete()
+
+def resumo_medicoes(pneu_id, periodo, desde=None):
+    q = MedicaoResumo.query.filter_by(periodo=periodo, pneu_id=pneu_id)
+    if desde:
+        q = q.filter(MedicaoResumo.inicio >= desde)
+    return [{
+        "inicio": r.inicio.isoformat(),
+        "sulco_medio": round(r.soma_sulco / r.n_sulco, 2) if r.n_sulco else None,
+        "pressao_media": round(r.soma_pressao / r.n_pressao, 1) if r.n_pressao else None,
+        "amostras": max(r.n_sulco, r.n_pressao),
+    } for r in q.order_by(MedicaoResumo.inicio)]
+
+# ---------- CICLO DE VIDA E VIDA ÚTIL ----------
+# Cada instalação/retirada vira um EventoPneu com o hodômetro e o sulco do momento. A análise
+# lê os eventos em colunas (arrays NumPy quando disponível), casa cada instalação com a retirada
+# seguinte do mesmo pneu e grava km, dias, desgaste e custo por pneu em rel_vida_pneu; os
+# comparativos por marca/modelo/medida são um GROUP BY sobre essa tabela.
+VIDA_FIM = ("sucateado", "vendido")  # vida encerrada
+VIDA_BLOCO = 100000  # linhas por bloco na extração
+VIDA_GRUPOS = {"marca": ("marca",), "modelo": ("marca", "modelo"), "medida": ("medida",),
+               "completo": ("marca", "modelo", "medida")}
+
+def record_lifecycle(eventos, agora=None):
+    # eventos: [{"pneu_id", "veiculo_id", "tipo", "pos_label"?, "destino"?, "km"?, "sulco"?}]. km e sulco
+    # ausentes vêm do hodômetro do veículo e do sulco atual do pneu. INSERT em lote na transação corrente.
+    if not eventos:
+        return
+    km, sulco = {}, {}
+    for parte in chunks({e["veiculo_id"] for e in eventos if e.get("km") is None and e.get("veiculo_id")}):
+        km.update(db.session.execute(select(Veiculo.id, Veiculo.hodometro).where(Veiculo.id.in_(parte))).all())
+    for parte in chunks({e["pneu_id"] for e in eventos if e.get("sulco") is None}):
+        sulco.update(db.session.execute(select(Pneu.id, Pneu.sulco).where(Pneu.id.in_(parte))).all())
+    agora = agora or datetime.utcnow()
+    db.session.execute(insert(EventoPneu), [
+        {"pneu_id": e["pneu_id"], "veiculo_id": e.get("veiculo_id"), "pos_label": e.get("pos_label"),
+         "tipo": e["tipo"], "destino": e.get("destino"), "created_at": agora,
+         "km": e["km"] if e.get("km") is not None else km.get(e.get("veiculo_id")),
+         "sulco": e["sulco"] if e.get("sulco") is not None else sulco.get(e["pneu_id"])}
+        for e in eventos])
+
+def read_odometer(v, bruto):
+    # km informado na movimentação: avança o hodômetro do veículo (nunca volta). ValueError se inválido.
+    if bruto in (None, ""):
+        return v.hodometro
+    try:
+        km = int(str(bruto).replace(".", "").replace(" ", ""))  # aceita "120.500"
+    except ValueError:
+        raise ValueError(f"Hodômetro inválido: {bruto}")
+    if km < (v.hodometro or 0):
+        raise ValueError(f"Hodômetro menor que o atual do veículo ({v.hodometro} km).")
+    v.hodometro = km
+    return km
+
+def _dias(col):
+    # data como nº de dias (float) calculado no banco: não cria um datetime por evento
+    if db.engine.dialect.name == "sqlite":
+        return func.julianday(col)
+    return func.extract("epoch", col) / 86400.0
+
+def _extrair(stmt, tipos):
+    # Lê o resultado em blocos de VIDA_BLOCO linhas direto em colunas (arrays NumPy ou listas).
+    partes = [[] for _ in tipos]
+    for bloco in db.session.execute(stmt.execution_options(yield_per=VIDA_BLOCO)).partitions():
+        for parte, tipo, vals in zip(partes, tipos, zip(*bloco)):
+            parte.append(np.array(vals, dtype=tipo) if np is not None else list(vals))
+    if np is not None:
+        return [np.concatenate(p) if p else np.array([], dtype=t) for p, t in zip(partes, tipos)]
+    return [[v for bloco in p for v in bloco] for p in partes]
+
+VIDA_COLUNAS = ("instalacoes", "km", "dias", "km_sulco", "sulco_gasto")
+
+def _periodos_np(pid, inst, km, sulco, dia, montados, hoje):
+    # Eventos ordenados por (pneu, data). Uma instalação fecha na retirada seguinte do mesmo pneu ou,
+    # se é o último evento e o pneu segue montado, no hodômetro/sulco atuais.
+    n = len(pid)
+    mesmo = np.zeros(n, dtype=bool)
+    mesmo[:-1] = pid[1:] == pid[:-1]
+    ini = np.flatnonzero(inst)
+    prox = np.minimum(ini + 1, max(n - 1, 0))
+    fechado = mesmo[ini] & ~inst[prox]
+    fim_km, fim_sulco, fim_dia = (np.where(fechado, col[prox], np.nan) for col in (km, sulco, dia))
+    ids_m, km_m, sulco_m = montados
+    aberto = np.zeros(len(ini), dtype=bool)
+    if len(ids_m):
+        j = np.minimum(np.searchsorted(ids_m, pid[ini]), len(ids_m) - 1)
+        aberto = ~mesmo[ini] & (ids_m[j] == pid[ini])
+        fim_km[aberto], fim_sulco[aberto], fim_dia[aberto] = km_m[j[aberto]], sulco_m[j[aberto]], hoje
+    ok = fechado | aberto
+    with np.errstate(invalid="ignore"):
+        km_p = np.clip(fim_km - km[ini], 0, None)
+        gasto = np.clip(sulco[ini] - fim_sulco, 0, None)
+    com_sulco = np.isfinite(km_p) & np.isfinite(gasto)
+    pneus, inv = np.unique(pid[ini][ok], return_inverse=True)
+    soma = lambda w: np.bincount(inv, weights=w[ok], minlength=len(pneus))
+    return pneus.tolist(), [np.bincount(inv, minlength=len(pneus)).tolist()] + [soma(w).tolist() for w in (
+        np.nan_to_num(km_p), np.nan_to_num(fim_dia - dia[ini]), np.where(com_sulco, km_p, 0), np.where(com_sulco, gasto, 0))]
+
+def _periodos_py(pid, inst, km, sulco, dia, montados, hoje):
+    # Mesmo cálculo de _periodos_np, em Python puro (sem NumPy instalado).
+    atual = {p: (k, s) for p, k, s in zip(*montados)}
+    acc = {}
+    for i in range(len(pid)):
+        if not inst[i]:
+            continue
+        if i + 1 < len(pid) and pid[i + 1] == pid[i]:
+            if inst[i + 1]:
+                continue
+            fk, fs, fd = km[i + 1], sulco[i + 1], dia[i + 1]
+        elif pid[i] in atual:
+            (fk, fs), fd = atual[pid[i]], hoje
+        else:
+            continue
+        a = acc.setdefault(pid[i], [0, 0.0, 0.0, 0.0, 0.0])
+        km_p = max(fk - km[i], 0) if fk is not None and km[i] is not None else None
+        a[0] += 1; a[1] += km_p or 0; a[2] += fd - dia[i]
+        if km_p is not None and sulco[i] is not None and fs is not None:
+            a[3] += km_p; a[4] += max(sulco[i] - fs, 0)
+    pneus = sorted(acc)
+    return pneus, [[acc[p][k] for p in pneus] for k in range(len(VIDA_COLUNAS))]
+
+def rebuild_tire_life():
+    # Recalcula rel_vida_pneu inteira numa transação. Retorna contagens e tempo.
+    inicio = time.perf_counter()
+    ev = EventoPneu
+    pid, inst, km, sulco, dia = _extrair(
+        select(ev.pneu_id, ev.tipo == "instalar", ev.km, ev.sulco, _dias(ev.created_at))
+        .where(ev.tipo.in_(("instalar", "retirar"))).order_by(ev.pneu_id, ev.created_at, ev.id),
+        ("i8", "?", "f8", "f8", "f8"))
+    montados = _extrair(
+        select(PosicaoPneu.pneu_id, Veiculo.hodometro, Pneu.sulco)
+        .join(Veiculo, Veiculo.id == PosicaoPneu.veiculo_id).join(Pneu, Pneu.id == PosicaoPneu.pneu_id)
+        .order_by(PosicaoPneu.pneu_id), ("i8", "f8", "f8"))
+    hoje = db.session.execute(select(_dias(func.current_timestamp()))).scalar()
+    pneus, colunas = (_periodos_np if np is not None else _periodos_py)(pid, inst, km, sulco, dia, montados, hoje)
+    custos = dict(db.session.execute(
+        select(ItemOS.pneu_id, func.sum(ItemOS.quantidade * ItemOS.valor_unit))
+        .join(OrdemServico, OrdemServico.id == ItemOS.os_id)
+        .where(ItemOS.pneu_id.is_not(None), OrdemServico.status != "cancelada").group_by(ItemOS.pneu_id)).all())
+    agora = datetime.utcnow()
+    linhas = {p: dict(zip(VIDA_COLUNAS, vals), pneu_id=p, custo=0.0, calculado_em=agora)
+              for p, *vals in zip(pneus, *colunas)}
+    for p, custo in custos.items():
+        linhas.setdefault(p, {"pneu_id": p, "calculado_em": agora, **{c: 0 for c in VIDA_COLUNAS}})["custo"] = round(custo or 0, 2)
+    RelVidaPneu.query.delete()
+    _inserir(RelVidaPneu, list(linhas.values()))
+    RelDesgasteModelo.query.delete()
+    r = RelVidaPneu
+    db.session.execute(insert(RelDesgasteModelo).from_select(["marca", "modelo", "taxa"], (
+        select(Pneu.marca, Pneu.modelo, func.sum(r.sulco_gasto) / func.sum(r.km_sulco))
+        .join(Pneu, Pneu.id == r.pneu_id).group_by(Pneu.marca, Pneu.modelo).having(func.sum(r.km_sulco) > 0))))
     db.session.commit()
+    return {"eventos": len(pid), "pneus": len(linhas), "numpy": np is not None,
+            "segundos": round(time.perf_counter() - inicio, 2)}
+
+def tire_life_report(por="modelo"):
+    # Comparativo por grupo sobre rel_vida_pneu: km e dias médios, vida (km) dos pneus já encerrados,
+    # desgaste em mm/1000 km e custo por km.
+    r = RelVidaPneu
+    cols = [getattr(Pneu, c) for c in VIDA_GRUPOS[por]]
+    fim = Pneu.status.in_(VIDA_FIM)
+    stmt = (select(*cols, func.count(r.pneu_id).label("pneus"), func.sum(r.km).label("km"),
+                   func.avg(r.km).label("km_medio"), func.avg(r.dias).label("dias_medio"),
+                   func.count(case((fim, 1))).label("encerrados"), func.avg(case((fim, r.km))).label("vida_km"),
+                   (func.sum(r.sulco_gasto) * 1000 / func.nullif(func.sum(r.km_sulco), 0)).label("desgaste"),
+                   func.sum(r.custo).label("custo"),
+                   (func.sum(r.custo) / func.nullif(func.sum(r.km), 0)).label("custo_km"))
+            .join(Pneu, Pneu.id == r.pneu_id).group_by(*cols).order_by(*cols))
+    calculado = db.session.execute(select(func.max(r.calculado_em))).scalar()
+    return calculado, [dict(row._mapping) for row in db.session.execute(stmt)]
+
+# ---------- ALERTAS DA FROTA ----------
+# Regras avaliadas em SQL sobre os pneus montados: sulco mínimo, pressão fora da faixa, km rodado
+# desde a instalação acima do alerta_km_max do veículo e troca prevista pela projeção de desgaste
+# (taxa do próprio pneu na montagem atual ou, com pouco km rodado, a do modelo em rel_desgaste_modelo).
+# Cada varredura só reavalia pneus cujo pneu ou veículo mudou (alterado_em) desde o início da
+# anterior; AlertaPneu guarda o que está aberto, então cada alerta notifica uma única vez.
+ALERTA_REGRAS = {"sulco": ("Sulco baixo", ("gestor", "borracheiro")),
+                 "pressao": ("Pressão fora da faixa", ("gestor", "borracheiro")),
+                 "km": ("Km máximo atingido", ("gestor",)),
+                 "troca": ("Troca prevista", ("gestor",))}
+ALERTA_TAXA_MIN_KM = 2000  # km rodado mínimo na montagem para usar a taxa de desgaste do próprio pneu
+ALERTA_SOBREPOSICAO_S = 60  # recua a marca d'água: cobre transações que terminaram durante a varredura
+ALERTA_NOTIF_MAX = 20  # acima disso, uma notificação-resumo por regra em vez de uma por pneu
+ALERTA_HISTORICO_DIAS = 30  # varreduras mais antigas são apagadas
+
+def _alerta_limites():
+    c = app.config
+    return (f"0<sulco<={c['ALERTA_SULCO_MM']} pressao={c['ALERTA_PRESSAO_MIN']}-{c['ALERTA_PRESSAO_MAX']} "
+            f"troca<{c['ALERTA_PROJECAO_KM']} taxa>={ALERTA_TAXA_MIN_KM}")
+
+def _alerta_candidatos(marca):
+    # pneus montados cujo pneu ou veículo mudou desde a marca (None: todos); cada ramo usa o índice de alterado_em
+    base = select(PosicaoPneu.pneu_id).where(PosicaoPneu.pneu_id.is_not(None))
+    if marca is None:
+        return base
+    return union(base.join(Pneu, Pneu.id == PosicaoPneu.pneu_id).where(Pneu.alterado_em >= marca),
+                 base.join(Veiculo, Veiculo.id == PosicaoPneu.veiculo_id).where(Veiculo.alterado_em >= marca))
+
+def _alerta_avaliacao(cand):
+    # Uma linha por pneu candidato com ao menos uma regra violada; a_<regra> indica quais.
+    c = app.config
+    ult = (select(EventoPneu.pneu_id, func.max(EventoPneu.id).label("eid"))
+           .where(EventoPneu.tipo == "instalar", EventoPneu.pneu_id.in_(cand))
+           .group_by(EventoPneu.pneu_id).subquery())
+    inst = aliased(EventoPneu)
+    modelo = RelDesgasteModelo
+    rodado = Veiculo.hodometro - inst.km
+    gasto = inst.sulco - Pneu.sulco
+    taxa = func.coalesce(case((and_(rodado >= ALERTA_TAXA_MIN_KM, gasto > 0), gasto / rodado)),
+                         func.nullif(modelo.taxa, 0))  # mm por km
+    restante = (Pneu.sulco - c["ALERTA_SULCO_MM"]) / taxa
+    # sulco/pressão 0 = ainda sem leitura (padrão do cadastro): não alertam
+    regras = {"sulco": and_(Pneu.sulco > 0, Pneu.sulco <= c["ALERTA_SULCO_MM"]),
+              "pressao": and_(Pneu.pressao > 0, or_(Pneu.pressao < c["ALERTA_PRESSAO_MIN"],
+                                                    Pneu.pressao > c["ALERTA_PRESSAO_MAX"])),
+              "km": rodado >= Veiculo.alerta_km_max,
+              "troca": and_(Pneu.sulco > 0, Pneu.sulco > c["ALERTA_SULCO_MM"],
+                            restante < c["ALERTA_PROJECAO_KM"])}
+    return (select(PosicaoPneu.pneu_id, PosicaoPneu.veiculo_id, PosicaoPneu.pos_label, Veiculo.placa,
+                   Veiculo.alerta_km_max, Pneu.numero_serie, Pneu.sulco, Pneu.pressao,
+                   rodado.label("rodado"), restante.label("restante"),
+                   *[cond.label(f"a_{r}") for r, cond in regras.items()])
+            .join(Pneu, Pneu.id == PosicaoPneu.pneu_id).join(Veiculo, Veiculo.id == PosicaoPneu.veiculo_id)
+            .outerjoin(ult, ult.c.pneu_id == Pneu.id).outerjoin(inst, inst.id == ult.c.eid)
+            .outerjoin(modelo, and_(modelo.marca == Pneu.marca, modelo.modelo == Pneu.modelo))
+            .where(PosicaoPneu.pneu_id.in_(cand), or_(*regras.values())))
+
+def _alerta_mensagem(regra, r):
+    onde = f"pneu {r.numero_serie or r.pneu_id} ({r.placa} · {r.pos_label})"
+    if regra == "sulco":
+        return f"Sulco {r.sulco:.1f} mm no {onde}"
+    if regra == "pressao":
+        return f"Pressão {r.pressao:.0f} psi no {onde}"
+    if regra == "km":
+        return f"Km máximo: {onde} rodou {r.rodado} km (limite {r.alerta_km_max})"
+    return f"Troca prevista: {onde} chega ao sulco mínimo em ~{max(r.restante, 0):.0f} km"
+
+def scan_alerts(completa=False):
+    # Varredura incremental (completa na primeira vez, se os limites mudaram ou após um rebuild-vida).
+    # Abre e encerra AlertaPneu e grava as notificações dos alertas novos em lote, numa transação.
+    inicio, t0 = datetime.utcnow(), time.perf_counter()
+    limites = _alerta_limites()
+    ultima = db.session.execute(select(VarreduraAlerta).order_by(VarreduraAlerta.id.desc()).limit(1)).scalar()
+    vida = db.session.execute(select(RelVidaPneu.calculado_em).limit(1)).scalar()  # taxas por modelo mudaram?
+    completa = completa or ultima is None or ultima.limites != limites or bool(vida and vida > ultima.inicio)
+    cand = _alerta_candidatos(None if completa else ultima.inicio - timedelta(seconds=ALERTA_SOBREPOSICAO_S))
+    avaliados = db.session.execute(select(func.count()).select_from(cand.subquery())).scalar()
+    atuais = {}
+    for r in db.session.execute(_alerta_avaliacao(cand)):
+        for regra in ALERTA_REGRAS:
+            if r._mapping[f"a_{regra}"]:
+                atuais[(r.pneu_id, regra)] = (r.veiculo_id, _alerta_mensagem(regra, r))
+    a = AlertaPneu
+    # abertos dos candidatos e dos pneus que deixaram de estar montados
+    existentes = {(p, regra): aid for aid, p, regra in db.session.execute(
+        select(a.id, a.pneu_id, a.regra).where(or_(a.pneu_id.in_(cand),
+                                                   ~exists().where(PosicaoPneu.pneu_id == a.pneu_id))))}
+    encerrados = [aid for k, aid in existentes.items() if k not in atuais]
+    novos = [(k, v) for k, v in atuais.items() if k not in existentes]
+    for lote in chunks(encerrados, 500):
+        db.session.execute(delete(a).where(a.id.in_(lote)))
+    _inserir(a, [{"pneu_id": p, "regra": regra, "veiculo_id": vid, "mensagem": msg[:200], "desde": inicio}
+                 for (p, regra), (vid, msg) in novos])
+    por_role = {}
+    for regra, (titulo, roles) in ALERTA_REGRAS.items():
+        itens = [(msg, f"/veiculo/{vid}") for (_p, r), (vid, msg) in novos if r == regra]
+        if len(itens) > ALERTA_NOTIF_MAX:
+            itens = [(f"{titulo}: {len(itens)} novos alertas", f"/alertas?regra={regra}")]
+        for role in roles:
+            por_role.setdefault(role, []).extend(itens)
+    for role, itens in por_role.items():
+        notify_many(role, itens)
+    db.session.add(VarreduraAlerta(inicio=inicio, fim=datetime.utcnow(), completa=completa, limites=limites,
+                                   avaliados=avaliados, abertos=len(novos), encerrados=len(encerrados)))
+    db.session.execute(delete(VarreduraAlerta).where(
+        VarreduraAlerta.inicio < inicio - timedelta(days=ALERTA_HISTORICO_DIAS)))
+    db.session.commit()
+    return {"completa": completa, "avaliados": avaliados, "abertos": len(novos), "encerrados": len(encerrados),
+            "ativos": db.session.execute(select(func.count(a.id))).scalar(),
+            "segundos": round(time.perf_counter() - t0, 3)}
+
+# ---------- PAGINAÇÃO (keyset) ----------
+PAGE_SIZE = 50
+PAGE_SIZE_MAX = 200
+
+class Page:
+    def __init__(self, items, next_cursor, size, param):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.size = size
+        self.param = param
+        self.is_first = not request.args.get(param)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+def _encode_cursor(values):
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor, order):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except ValueError:
+        return None
+    if not isinstance(values, list) or len(values) != len(order):
+        return None
+    out = []
+    for (col, _desc), v in zip(order, values):
+        if isinstance(col.type, db.DateTime) and isinstance(v, str):
+            v = datetime.fromisoformat(v)
+        out.append(v)
+    return out
+
+def _keyset_filter(order, values):
+    # (a, b) > (va, vb) expandido em OR/AND para respeitar a direção de cada coluna
+    conds = []
+    for i, (col, desc) in enumerate(order):
+        eqs = [c == v for (c, _), v in zip(order[:i], values[:i])]
+        conds.append(and_(*eqs, col < values[i] if desc else col > values[i]))
+    return or_(*conds)
+
+def keyset_page(query, order, param="cursor", size=None):
+    # order: lista de (coluna, desc); a última coluna deve ser única (id) para a ordem ser estável.
+    # Lê ?<param>=cursor e ?size=N (limitado a PAGE_SIZE_MAX) da query string.
+    if size is None:
+        size = request.args.get("size", type=int) or PAGE_SIZE
+    size = max(1, min(size, PAGE_SIZE_MAX))
+    cursor = request.args.get(param)
+    values = _decode_cursor(cursor, order) if cursor else None
+    if values is not None:
+        query = query.filter(_keyset_filter(order, values))
+    rows = query.order_by(*[c.desc() if d else c.asc() for c, d in order]).limit(size + 1).all()
+    next_cursor = None
+    if len(rows) > size:
+        rows = rows[:size]
+        last = rows[-1]
+        next_cursor = _encode_cursor([getattr(last, c.key) for c, _ in order])
+    return Page(rows, next_cursor, size, param)
+
+# ---------- BUSCA (FTS5) ----------
+# Índices full-text externos sobre a tabela pneu, mantidos por triggers (insert/update/delete),
+# com tokens que preservam "-", "/" e "." (ex.: S-0001, 295/80, R22.5) e índice de prefixo.
+# pneu_fts_id cobre só nº fogo/série: filtrar "{numero_fogo numero_serie}" no índice geral
+# percorreria o doclist inteiro de termos comuns como "michelin" ou "295/80".
+SEARCH_COLUMNS = ["numero_fogo", "numero_serie", "marca", "modelo", "medida"]
+SEARCH_ID_COLUMNS = ["numero_fogo", "numero_serie"]
+SEARCH_INDEXES = {"pneu_fts": SEARCH_COLUMNS, "pneu_fts_id": SEARCH_ID_COLUMNS}
+SEARCH_LIMIT = 100
+SEARCH_PREFIX_MAX = 500  # candidatos por prefixo de nº fogo/série ranqueados por bm25
+search_state = {"fts": False}
+
+def ensure_search_index(rebuild=False):
+    if db.engine.dialect.name != "sqlite":
+        return False
+    with db.engine.begin() as conn:
+        for tabela, colunas in SEARCH_INDEXES.items():
+            cols = ", ".join(colunas)
+            new_cols = ", ".join(f"new.{c}" for c in colunas)
+            old_cols = ", ".join(f"old.{c}" for c in colunas)
+            existed = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = :t"), {"t": tabela}).first() is not None
+            try:
+                conn.execute(text(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {tabela} USING fts5({cols}, content='pneu', content_rowid='id', "
+                    "tokenize=\"unicode61 remove_diacritics 2 tokenchars '-/.'\", prefix='2 3 4')"
+                ))
+            except Exception as e:
+                app.logger.warning("FTS5 indisponível, busca de pneus usa LIKE: %s", e)
+                return False
+            conn.execute(text(f"""CREATE TRIGGER IF NOT EXISTS {tabela}_ai AFTER INSERT ON pneu BEGIN
+                INSERT INTO {tabela}(rowid, {cols}) VALUES (new.id, {new_cols}); END"""))
+            conn.execute(text(f"""CREATE TRIGGER IF NOT EXISTS {tabela}_ad AFTER DELETE ON pneu BEGIN
+                INSERT INTO {tabela}({tabela}, rowid, {cols}) VALUES ('delete', old.id, {old_cols}); END"""))
+            conn.execute(text(f"""CREATE TRIGGER IF NOT EXISTS {tabela}_au AFTER UPDATE OF {cols} ON pneu BEGIN
+                INSERT INTO {tabela}({tabela}, rowid, {cols}) VALUES ('delete', old.id, {old_cols});
+                INSERT INTO {tabela}(rowid, {cols}) VALUES (new.id, {new_cols}); END"""))
+            if rebuild or not existed:
+                conn.execute(text(f"INSERT INTO {tabela}({tabela}) VALUES ('rebuild')"))
+    search_state["fts"] = True
+    return True
+
+def _fts_query(q, prefix=True):
+    # cada termo vira frase entre aspas ("s-00"*); termos são combinados com AND.
+    # prefix="ultimo": só o último termo (o que ainda está sendo digitado) vira prefixo.
+    # Termos de 1 caractere não viram prefixo: fora do índice prefix='2 3 4', "s"* juntaria
+    # o doclist de todo nº de série.
+    terms = [t.replace('"', '""') for t in q.split()]
+    match = " ".join(f'"{t}"' + ("*" if len(t) > 1 and (prefix is True or (prefix == "ultimo" and i == len(terms) - 1))
+                                 else "") for i, t in enumerate(terms))
+    return match
+
+def search_pneus(q, status=None, limit=SEARCH_LIMIT):
+    # Retorna pneus por relevância: nº fogo/série exatos, depois prefixos de nº fogo/série
+    # (ambos por bm25), depois marca/modelo/medida na ordem do índice.
+    if not search_state["fts"]:
+        like = f"%{q}%"
+        base = Pneu.query.filter(or_(*[getattr(Pneu, c).like(like) for c in SEARCH_COLUMNS]))
+        if status:
+            base = base.filter_by(status=status)
+        return base.order_by(Pneu.id.desc()).limit(limit).all()
+    if not _fts_query(q):
+        return []
+    # CROSS JOIN fixa o FTS como laço externo: com o filtro de status o SQLite preferia varrer
+    # ix_pneu_status e consultar o FTS pneu a pneu
+    def base(tabela, cols="pneu.id"):
+        sql = f"SELECT {cols} FROM {tabela} CROSS JOIN pneu ON pneu.id = {tabela}.rowid WHERE {tabela} MATCH :m"
+        return sql + (" AND pneu.status = :s" if status else "")
+    ids, vistos = [], set()
+
+    def juntar(consulta, match):
+        if len(ids) >= limit:
+            return
+        for (pid,) in db.session.execute(text(consulta), {"m": match, "s": status, "n": limit + len(ids)}):
+            if pid not in vistos and len(ids) < limit:
+                ids.append(pid); vistos.add(pid)
+
+    # 1) nº fogo/série exatos, por bm25
+    juntar(base("pneu_fts_id") + " ORDER BY bm25(pneu_fts_id) LIMIT :n", _fts_query(q, prefix=False))
+    # 2) prefixos de nº fogo/série: ranqueia por bm25 só os SEARCH_PREFIX_MAX primeiros do índice
+    #    (ordenar tudo que casa com "F1*" leria o doclist inteiro a cada tecla)
+    juntar(f"SELECT id FROM ({base('pneu_fts_id', 'pneu.id AS id, bm25(pneu_fts_id) AS r')} "
+           f"LIMIT {SEARCH_PREFIX_MAX}) ORDER BY r, id LIMIT :n", _fts_query(q))
+    # 3) todas as colunas: termos completos primeiro (o FTS itera o token e para no LIMIT),
+    #    depois o último termo como prefixo, depois todos
+    geral = base("pneu_fts") + " LIMIT :n"
+    juntar(geral, _fts_query(q, prefix=False))
+    juntar(geral, _fts_query(q, prefix="ultimo"))
+    if len(q.split()) > 1:
+        juntar(geral, _fts_query(q))
+    por_id = {p.id: p for p in Pneu.query.filter(Pneu.id.in_(ids))} if ids else {}
+    return [por_id[i] for i in ids if i in por_id]
+
+# ---------- RELATÓRIOS MATERIALIZADOS ----------
+# Triggers somam deltas nas tabelas rel_* na mesma transação de cada INSERT/UPDATE/DELETE
+# em pneu e ordem_servico (inclusive UPDATEs em lote), então o relatório lê só os grupos.
+def _rel_status(linha, sinal):
+    return (f"INSERT INTO rel_pneu_status(status, qtd) VALUES (coalesce({linha}.status, ''), {sinal}1) "
+            "ON CONFLICT(status) DO UPDATE SET qtd = qtd + excluded.qtd;")
+
+def _rel_sulco(linha, sinal):
+    return (f"INSERT INTO rel_sulco_modelo(marca, modelo, n, soma) VALUES (coalesce({linha}.marca, ''), "
+            f"coalesce({linha}.modelo, ''), {sinal}({linha}.sulco IS NOT NULL), {sinal}coalesce({linha}.sulco, 0)) "
+            "ON CONFLICT(marca, modelo) DO UPDATE SET n = n + excluded.n, soma = soma + excluded.soma;")
+
+def _rel_custo(linha, sinal):
+    return (f"INSERT INTO rel_custo_veiculo(veiculo_id, total) VALUES ({linha}.veiculo_id, {sinal}coalesce({linha}.custo_total, 0)) "
+            "ON CONFLICT(veiculo_id) DO UPDATE SET total = total + excluded.total;")
+
+REPORT_TRIGGERS = {
+    "rel_pneu_ai": f"AFTER INSERT ON pneu BEGIN {_rel_status('new', '+')} {_rel_sulco('new', '+')} END",
+    "rel_pneu_ad": f"AFTER DELETE ON pneu BEGIN {_rel_status('old', '-')} {_rel_sulco('old', '-')} END",
+    "rel_pneu_au_status": f"AFTER UPDATE OF status ON pneu WHEN old.status IS NOT new.status BEGIN "
+                          f"{_rel_status('old', '-')} {_rel_status('new', '+')} END",
+    "rel_pneu_au_sulco": f"AFTER UPDATE OF sulco, marca, modelo ON pneu BEGIN {_rel_sulco('old', '-')} {_rel_sulco('new', '+')} END",
+    "rel_os_ai": f"AFTER INSERT ON ordem_servico BEGIN {_rel_custo('new', '+')} END",
+    "rel_os_ad": f"AFTER DELETE ON ordem_servico BEGIN {_rel_custo('old', '-')} END",
+    "rel_os_au": f"AFTER UPDATE OF custo_total, veiculo_id ON ordem_servico BEGIN {_rel_custo('old', '-')} {_rel_custo('new', '+')} END",
+}
+
+REPORT_REBUILD_SQL = [
+    "DELETE FROM rel_pneu_status",
+    "INSERT INTO rel_pneu_status(status, qtd) SELECT coalesce(status, ''), count(*) FROM pneu GROUP BY 1",
+    "DELETE FROM rel_sulco_modelo",
+    "INSERT INTO rel_sulco_modelo(marca, modelo, n, soma) SELECT coalesce(marca, ''), coalesce(modelo, ''), "
+    "count(sulco), coalesce(sum(sulco), 0) FROM pneu GROUP BY 1, 2",
+    "DELETE FROM rel_custo_veiculo",
+    "INSERT INTO rel_custo_veiculo(veiculo_id, total) SELECT veiculo_id, coalesce(sum(custo_total), 0) "
+    "FROM ordem_servico GROUP BY veiculo_id",
+]
+report_state = {"materialized": False}
+
+def ensure_report_tables(rebuild=False):
+    if db.engine.dialect.name != "sqlite":
+        return False
+    with db.engine.begin() as conn:
+        existentes = {r[0] for r in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'trigger'"))}
+        for nome, corpo in REPORT_TRIGGERS.items():
+            conn.execute(text(f"CREATE TRIGGER IF NOT EXISTS {nome} {corpo}"))
+        if rebuild or not set(REPORT_TRIGGERS) <= existentes:
+            for sql in REPORT_REBUILD_SQL:
+                conn.execute(text(sql))
+    report_state["materialized"] = True
+    return True
+
+def fleet_report():
+    # (custos, por_status, avg_sulco) no formato esperado por relatorios.html
+    if report_state["materialized"]:
+        custos = (db.session.query(Veiculo.placa, RelCustoVeiculo.total)
+                  .join(RelCustoVeiculo, RelCustoVeiculo.veiculo_id == Veiculo.id)
+                  .order_by(RelCustoVeiculo.total.desc()).all())
+        por_status = (db.session.query(RelPneuStatus.status, RelPneuStatus.qtd)
+                      .filter(RelPneuStatus.qtd > 0).order_by(RelPneuStatus.status).all())
+        avg_sulco = (db.session.query(RelSulcoModelo.marca, RelSulcoModelo.modelo, RelSulcoModelo.soma / RelSulcoModelo.n)
+                     .filter(RelSulcoModelo.n > 0).order_by(RelSulcoModelo.marca, RelSulcoModelo.modelo).all())
+        return custos, por_status, avg_sulco
+    # outros bancos: agrega na hora
+    custos = (db.session.query(Veiculo.placa, func.sum(OrdemServico.custo_total))
+              .join(OrdemServico, OrdemServico.veiculo_id == Veiculo.id)
+              .group_by(Veiculo.placa).order_by(func.sum(OrdemServico.custo_total).desc()).all())
+    por_status = db.session.query(Pneu.status, func.count(Pneu.id)).group_by(Pneu.status).order_by(Pneu.status).all()
+    avg_sulco = (db.session.query(Pneu.marca, Pneu.modelo, func.avg(Pneu.sulco))
+                 .group_by(Pneu.marca, Pneu.modelo).order_by(Pneu.marca, Pneu.modelo).all())
+    return custos, por_status, avg_sulco
+
+@app.template_global()
+def page_url(**changes):
+    args = request.args.to_dict()
+    args.update(changes)
+    args = {k: v for k, v in args.items() if v not in (None, "")}
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+# ---------- MÉTRICAS ----------
+# Por requisição: tempo total, nº e tempo dos SQL (eventos da engine), objetos ORM carregados,
+# tempo de template e pico de alocação; agregados por endpoint em histogramas no formato
+# texto do Prometheus (GET /metrics).
+TEMPO_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CONTAGEM_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+LINHAS_BUCKETS = (1, 10, 50, 100, 500, 1000, 5000, 10000)
+BYTES_BUCKETS = tuple(2 ** n * 1024 for n in range(6, 19, 2))  # 64 KB .. 256 MB
+SQL_LENTO_TOP = 5
+slow_log = logging.getLogger("pneutrack.lento")
+
+def _rotulo(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Histogram:
+    def __init__(self, nome, ajuda, buckets):
+        self.nome, self.ajuda, self.buckets = nome, ajuda, buckets
+        self._series = {}  # endpoint -> [contagens por bucket..., soma, total]
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, valor):
+        with self._lock:
+            serie = self._series.get(endpoint)
+            if serie is None:
+                serie = self._series[endpoint] = [0] * (len(self.buckets) + 2)
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie[i] += 1
+            serie[-2] += valor
+            serie[-1] += 1
+
+    def render(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} histogram"]
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for endpoint, serie in sorted(series.items()):
+            ep = _rotulo(endpoint)
+            for limite, n in zip(self.buckets, serie):
+                linhas.append(f'{self.nome}_bucket{{endpoint="{ep}",le="{limite}"}} {n}')
+            linhas.append(f'{self.nome}_bucket{{endpoint="{ep}",le="+Inf"}} {serie[-1]}')
+            linhas.append(f'{self.nome}_sum{{endpoint="{ep}"}} {serie[-2]:.6f}')
+            linhas.append(f'{self.nome}_count{{endpoint="{ep}"}} {serie[-1]}')
+        return linhas
+
+HISTOGRAMAS = {
+    "tempo": Histogram("pneutrack_request_seconds", "Tempo total da requisição.", TEMPO_BUCKETS),
+    "sql_n": Histogram("pneutrack_request_sql_statements", "Statements SQL por requisição.", CONTAGEM_BUCKETS),
+    "sql_t": Histogram("pneutrack_request_sql_seconds", "Tempo em SQL por requisição.", TEMPO_BUCKETS),
+    "linhas": Histogram("pneutrack_request_orm_objects", "Objetos ORM carregados por requisição.", LINHAS_BUCKETS),
+    "template": Histogram("pneutrack_request_template_seconds", "Tempo de renderização de templates.", TEMPO_BUCKETS),
+    "memoria": Histogram("pneutrack_request_peak_alloc_bytes", "Pico de alocação Python (tracemalloc).", BYTES_BUCKETS),
+}
+_respostas = {}  # (endpoint, status) -> contagem
+_respostas_lock = threading.Lock()
+
+if app.config["TRACE_MEMORY"]:
+    tracemalloc.start()
+
+def _metricas():
+    return g.get("metricas") if has_request_context() else None
+
+@app.before_request
+def _metricas_inicio():
+    g.metricas = {"inicio": time.perf_counter(), "sql_n": 0, "sql_t": 0.0, "sql": [],
+                  "linhas": 0, "template": 0.0, "tpl_inicio": []}
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+        g.metricas["mem_base"] = tracemalloc.get_traced_memory()[0]
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _sql_inicio(conn, cursor, statement, params, context, executemany):
+    if _metricas() is not None:
+        conn.info.setdefault("sql_inicio", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _sql_fim(conn, cursor, statement, params, context, executemany):
+    m = _metricas()
+    if m is None or not conn.info.get("sql_inicio"):
+        return
+    dur = time.perf_counter() - conn.info["sql_inicio"].pop()
+    m["sql_n"] += 1
+    m["sql_t"] += dur
+    # guarda só os mais lentos para o log
+    m["sql"].append((dur, statement))
+    if len(m["sql"]) > 4 * SQL_LENTO_TOP:
+        m["sql"] = sorted(m["sql"], reverse=True)[:SQL_LENTO_TOP]
+
+@event.listens_for(db.Model, "load", propagate=True)
+def _orm_carregado(target, context):
+    m = _metricas()
+    if m is not None:
+        m["linhas"] += 1
+
+@before_render_template.connect_via(app)
+def _template_inicio(sender, template, context, **extra):
+    m = _metricas()
+    if m is not None:
+        m["tpl_inicio"].append(time.perf_counter())
+
+@template_rendered.connect_via(app)
+def _template_fim(sender, template, context, **extra):
+    m = _metricas()
+    if m is not None and m["tpl_inicio"]:
+        inicio = m["tpl_inicio"].pop()
+        if not m["tpl_inicio"]:  # fragmento dentro de outra renderização já conta no externo
+            m["template"] += time.perf_counter() - inicio
+
+@app.after_request
+def _metricas_fim(resp):
+    m = g.pop("metricas", None)
+    if m is None:
+        return resp
+    endpoint = request.endpoint or "desconhecido"
+    tempo = time.perf_counter() - m["inicio"]
+    HISTOGRAMAS["tempo"].observe(endpoint, tempo)
+    HISTOGRAMAS["sql_n"].observe(endpoint, m["sql_n"])
+    HISTOGRAMAS["sql_t"].observe(endpoint, m["sql_t"])
+    HISTOGRAMAS["linhas"].observe(endpoint, m["linhas"])
+    HISTOGRAMAS["template"].observe(endpoint, m["template"])
+    if "mem_base" in m:
+        HISTOGRAMAS["memoria"].observe(endpoint, max(0, tracemalloc.get_traced_memory()[1] - m["mem_base"]))
+    with _respostas_lock:
+        chave = (endpoint, resp.status_code)
+        _respostas[chave] = _respostas.get(chave, 0) + 1
+    if tempo * 1000 >= app.config["SLOW_REQUEST_MS"]:
+        piores = sorted(m["sql"], reverse=True)[:SQL_LENTO_TOP]
+        slow_log.warning("%s %s %d em %.0f ms (sql: %d em %.0f ms, objetos: %d, template: %.0f ms)%s",
+                         request.method, request.full_path.rstrip("?"), resp.status_code, tempo * 1000,
+                         m["sql_n"], m["sql_t"] * 1000, m["linhas"], m["template"] * 1000,
+                         "".join(f"\n  {d * 1000:.1f} ms: {' '.join(sql.split())}" for d, sql in piores))
+    return resp
+
+@app.route("/metrics")
+def metrics():
+    token = app.config["METRICS_TOKEN"]
+    if token:
+        if request.headers.get("Authorization") != f"Bearer {token}":
+            abort(401)
+    elif request.remote_addr not in ("127.0.0.1", "::1"):
+        abort(403)
+    linhas = []
+    for h in HISTOGRAMAS.values():
+        if h is not HISTOGRAMAS["memoria"] or tracemalloc.is_tracing():
+            linhas += h.render()
+    linhas += ["# HELP pneutrack_responses_total Respostas por endpoint e status.",
+               "# TYPE pneutrack_responses_total counter"]
+    with _respostas_lock:
+        for (endpoint, status), n in sorted(_respostas.items()):
+            linhas.append(f'pneutrack_responses_total{{endpoint="{_rotulo(endpoint)}",status="{status}"}} {n}')
+    with page_cache._lock:
+        stats = {nome: dict(d) for nome, d in page_cache.stats.items()}
+        invalidacoes = page_cache.invalidacoes
+    for campo in ("hits", "misses"):
+        linhas += [f"# HELP pneutrack_page_cache_{campo}_total Cache de fragmentos: {campo}.",
+                   f"# TYPE pneutrack_page_cache_{campo}_total counter"]
+        linhas += [f'pneutrack_page_cache_{campo}_total{{fragmento="{_rotulo(n)}"}} {d[campo]}' for n, d in sorted(stats.items())]
+    linhas += ["# HELP pneutrack_page_cache_invalidations_total Tags invalidadas no cache de fragmentos.",
+               "# TYPE pneutrack_page_cache_invalidations_total counter",
+               f"pneutrack_page_cache_invalidations_total {invalidacoes}"]
+    return Response("\n".join(linhas) + "\n", mimetype="text/plain; version=0.0.4")
 
 # ---------- ERROR HANDLER (DEV) ----------
 @app.errorhandler(Exception)
 def handle_any_exception(e):
+    if isinstance(e, HTTPException):
+        return e  # 404, 413 etc. seguem com o próprio status
     # Mostra o stack trace no navegador para diagnosticar rápido em DEV.
     return f"<h2>Erro Interno</h2><pre>{traceback.format_exc()}</pre>", 500
 
@@ -226,11 +1765,17 @@ def seed_demo():
         PosicaoPneu(veiculo_id=v2.id, eixo_id=ex2_d.id, pos_label="Dianteiro Esquerdo"),
         PosicaoPneu(veiculo_id=v2.id, eixo_id=ex2_d.id, pos_label="Dianteiro Direito"),
     ])
+    db.session.flush()
+    agora = datetime.utcnow()
+    record_measurements([{"pneu_id": p.id, "created_at": agora, "pressao": p.pressao, "sulco": p.sulco}
+                         for p in [p1, p2, p3, p4, p5, p6]])
     db.session.commit()
 
 def init_db():
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
     db.create_all()
+    ensure_search_index()
+    ensure_report_tables()
     seed_demo()
 
 # garante o banco ao importar
@@ -271,32 +1816,43 @@ def logout():
 @app.route("/gestor")
 @login_required(role="gestor")
 def gestor_dashboard():
-    veiculos = Veiculo.query.order_by(Veiculo.placa).all()
-    estoque = Pneu.query.filter_by(status="estoque").all()
-    servicos = ServicoAutorizado.query.order_by(ServicoAutorizado.created_at.desc()).all()
-    return render_template("gestor_dashboard.html", veiculos=veiculos, estoque=estoque, servicos=servicos)
+    # select do formulário só precisa de id/placa/motorista
+    opcoes = db.session.query(Veiculo.id, Veiculo.placa, Veiculo.motorista).order_by(Veiculo.placa).all()
+    veiculos = keyset_page(Veiculo.query, [(Veiculo.placa, False), (Veiculo.id, False)], param="cur_v", size=20)
+    estoque = keyset_page(Pneu.query.filter_by(status="estoque"), [(Pneu.id, True)], param="cur_e", size=20)
+    servicos = keyset_page(ServicoAutorizado.query, [(ServicoAutorizado.created_at, True), (ServicoAutorizado.id, True)], param="cur_s", size=20)
+    return render_template("gestor_dashboard.html", opcoes=opcoes, veiculos=veiculos, estoque=estoque, servicos=servicos)
 
 @app.route("/gestor/autorizar", methods=["POST"])
-@login_required(role="gestor")
+@login_required(role="gestor", retry=True)
 def gestor_autorizar():
     veiculo_id = int(request.form["veiculo_id"])
     descricao = request.form["descricao"]
     s = ServicoAutorizado(veiculo_id=veiculo_id, descricao=descricao, status="autorizado")
-    db.session.add(s); db.session.commit()
+    db.session.add(s); db.session.flush()
     v = Veiculo.query.get(veiculo_id)
+    audit("criar","ServicoAutorizado", s.id, f"vid={veiculo_id}")
     notify("borracheiro", f"Serviço autorizado para o veículo {v.placa}", url_for("servicos_autorizados"))
+    db.session.commit()
     flash("Serviço autorizado e enviado ao borracheiro.", "ok")
     return redirect(url_for("gestor_dashboard"))
 
 @app.route("/servicos-autorizados")
 @login_required()
 def servicos_autorizados():
-    itens = ServicoAutorizado.query.order_by(ServicoAutorizado.created_at.desc()).all()
-    return render_template("servicos_autorizados.html", servicos=itens)
+    status = request.args.get("status", "").strip()
+    base = ServicoAutorizado.query
+    if status:
+        base = base.filter_by(status=status)
+    vid = request.args.get("veiculo_id", type=int)
+    if vid:
+        base = base.filter_by(veiculo_id=vid)
+    itens = keyset_page(base, [(ServicoAutorizado.created_at, True), (ServicoAutorizado.id, True)])
+    return render_template("servicos_autorizados.html", servicos=itens, status=status)
 
 # ---- RFID/Código de barras ----
 @app.route("/barcode", methods=["GET","POST"])
-@login_required(role="gestor")
+@login_required(role="gestor", retry=True)
 def barcode_tool():
     result = None
     if request.method == "POST":
@@ -307,34 +1863,133 @@ def barcode_tool():
     return render_template("barcode.html", result=result)
 
 @app.route("/pneus/<int:pid>/definir-barcode", methods=["POST"])
-@login_required(role="gestor")
+@login_required(role="gestor", retry=True)
 def pneus_set_barcode(pid):
     p = Pneu.query.get_or_404(pid)
-    p.codigo_barras = request.form.get("codigo_barras","").strip() or None
-    db.session.commit()
+    codigo = request.form.get("codigo_barras","").strip() or None
+    if codigo and Pneu.query.filter(Pneu.codigo_barras == codigo, Pneu.id != p.id).first():
+        flash("Código de barras já vinculado a outro pneu.", "error")
+        return redirect(url_for("pneus_editar", pid=p.id))
+    p.codigo_barras = codigo
     audit("editar","Pneu", p.id, "definir codigo_barras")
+    db.session.commit()
     flash("Código de barras definido.", "ok")
     return redirect(url_for("pneus_editar", pid=p.id))
 
+# Ingestão em lote para leitores RFID/código de barras (máquina a máquina):
+#   POST /api/leituras  Authorization: Bearer <token do leitor>
+#   {"veiculo_id": opcional, "eventos": [{"codigo": "...", "ts": ISO-8601 ou epoch, "antena": opcional}]}
+# Leituras repetidas do mesmo código pelo leitor dentro de SCAN_WINDOW_S são descartadas; as
+# restantes viram linhas de Historico (acao="leitura") num único INSERT em lote e um commit.
+_ultimas_leituras = {}  # (leitor, codigo) -> datetime da última leitura gravada
+_leituras_lock = threading.Lock()
+
+def scanner_required(fn):
+    # Token de leitor (PNEUTRACK_SCAN_TOKENS) ou sessão de gestor; POST com retry em banco ocupado.
+    write_fn = retry_on_busy(fn)
+    @functools.wraps(fn)
+    def inner(*args, **kwargs):
+        auth = request.headers.get("Authorization", "")
+        leitor = app.config["SCAN_TOKENS"].get(auth[7:]) if auth.startswith("Bearer ") else None
+        if leitor is None:
+            u = current_user()
+            if not u or u.role != "gestor":
+                return jsonify({"erro": "token de leitor inválido"}), 401
+            leitor = f"manual:{u.email}"
+        g.leitor = leitor
+        return write_fn(*args, **kwargs)
+    return inner
+
+def _scan_ts(v):
+    if v in (None, ""):
+        return datetime.utcnow()
+    try:
+        return datetime.utcfromtimestamp(float(v))  # epoch (JSON número ou CSV)
+    except ValueError:
+        pass
+    ts = datetime.fromisoformat(str(v).replace("Z", "+00:00"))
+    return ts.replace(tzinfo=None) - (ts.utcoffset() or timedelta(0))
+
+@app.route("/api/leituras", methods=["POST"])
+@scanner_required
+def ingest_scans():
+    try:
+        linhas, topo = read_payload_rows("eventos")
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
+    if len(linhas) > app.config["SCAN_MAX_EVENTS"]:
+        return jsonify({"erro": f"máximo de {app.config['SCAN_MAX_EVENTS']} eventos por lote"}), 413
+    try:
+        veiculo_id = int(topo["veiculo_id"]) if topo.get("veiculo_id") else None
+    except (TypeError, ValueError):
+        return jsonify({"erro": "veiculo_id inválido"}), 400
+    leitor = g.leitor
+    erros, eventos = [], []
+    for i, ev in enumerate(linhas):
+        codigo = str((ev.get("codigo") or ev.get("codigo_barras") or "") if isinstance(ev, dict) else "").strip()
+        if not codigo:
+            erros.append({"linha": i, "erro": "codigo ausente"})
+            continue
+        try:
+            eventos.append((_scan_ts(ev.get("ts")), codigo, ev.get("antena")))
+        except (TypeError, ValueError, OverflowError, OSError):
+            erros.append({"linha": i, "erro": "ts inválido"})
+    eventos.sort()
+
+    janela = timedelta(seconds=app.config["SCAN_WINDOW_S"])
+    with _leituras_lock:
+        ultimas = {c: _ultimas_leituras.get((leitor, c)) for c in {c for _ts, c, _a in eventos}}
+    aceitos = []
+    for ts, codigo, antena in eventos:
+        ultima = ultimas.get(codigo)
+        if ultima and abs(ts - ultima) < janela:
+            continue
+        ultimas[codigo] = ts
+        aceitos.append((ts, codigo, antena))
+
+    pneus = barcode_index.resolve({c for _ts, c, _a in aceitos})
+    instalado = {}
+    if not veiculo_id:
+        for lote in chunks(set(pneus.values())):
+            instalado.update(db.session.execute(
+                select(PosicaoPneu.pneu_id, PosicaoPneu.veiculo_id).where(PosicaoPneu.pneu_id.in_(lote))).all())
+    hist = [{"pneu_id": pneus[c], "veiculo_id": veiculo_id or instalado.get(pneus[c]), "acao": "leitura",
+             "created_at": ts, "detalhes": f"leitor={leitor}" + (f" antena={antena}" if antena not in (None, "") else "")}
+            for ts, c, antena in aceitos if c in pneus]
+    if hist:
+        db.session.execute(insert(Historico), hist)
+    db.session.commit()
+    # a janela só avança depois do commit (um retry por banco ocupado não vira "duplicada") e só
+    # para códigos cadastrados: a etiqueta lida antes do cadastro é gravada ao ser relida logo após
+    with _leituras_lock:
+        _ultimas_leituras.update(((leitor, c), ts) for ts, c, _a in aceitos if c in pneus)
+        if len(_ultimas_leituras) > 100000:
+            corte = datetime.utcnow() - janela
+            for k in [k for k, ts in _ultimas_leituras.items() if ts < corte]:
+                del _ultimas_leituras[k]
+    desconhecidos = sorted({c for _ts, c, _a in aceitos if c not in pneus})
+    return jsonify({"recebidos": len(linhas), "duplicados": len(eventos) - len(aceitos), "gravados": len(hist),
+                    "desconhecidos": desconhecidos, "erros": erros})
+
 # ---- CRUD Pneus ----
 @app.route("/pneus")
 @login_required()
 def pneus_list():
     q = request.args.get("q","").strip()
-    base = Pneu.query
+    status = request.args.get("status","").strip()
     if q:
-        like = f"%{q}%"
-        base = base.filter(or_(
-            Pneu.numero_serie.like(like),
-            Pneu.marca.like(like),
-            Pneu.modelo.like(like),
-            Pneu.medida.like(like)
-        ))
-    pneus = base.order_by(Pneu.id.desc()).all()
-    return render_template("pneus_list.html", pneus=pneus, q=q)
+        size = min(request.args.get("size", type=int) or PAGE_SIZE, PAGE_SIZE_MAX)
+        pneus = Page(search_pneus(q, status or None, limit=size), None, size, "cursor")
+        return render_template("pneus_list.html", pneus=pneus, q=q, status=status)
+    base = Pneu.query
+    if status:
+        base = base.filter_by(status=status)
+    ordem = [(Pneu.id, request.args.get("ordem") != "antigos")]
+    pneus = keyset_page(base, ordem)
+    return render_template("pneus_list.html", pneus=pneus, q=q, status=status)
 
 @app.route("/pneus/novo", methods=["GET","POST"])
-@login_required(role="gestor")
+@login_required(role="gestor", retry=True)
 def pneus_novo():
     if request.method == "POST":
         p = Pneu(
@@ -347,104 +2002,258 @@ def pneus_novo():
             pressao=float(request.form.get("pressao") or 0),
             sulco=float(request.form.get("sulco") or 0),
         )
-        db.session.add(p); db.session.commit()
-        audit("criar","Pneu"); flash("Pneu cadastrado.", "ok")
+        db.session.add(p); db.session.flush()
+        if p.pressao or p.sulco:
+            record_measurements([{"pneu_id": p.id, "created_at": datetime.utcnow(), "pressao": p.pressao, "sulco": p.sulco}])
+        audit("criar","Pneu", p.id); db.session.commit()
+        flash("Pneu cadastrado.", "ok")
         return redirect(url_for("pneus_list"))
     return render_template("pneus_form.html", pneu=None)
 
 @app.route("/pneus/<int:pid>/editar", methods=["GET","POST"])
-@login_required(role="gestor")
+@login_required(role="gestor", retry=True)
 def pneus_editar(pid):
     p = Pneu.query.get_or_404(pid)
     if request.method == "POST":
         for f in ["numero_fogo","numero_serie","marca","modelo","medida","status"]:
             setattr(p, f, request.form.get(f) or getattr(p,f))
-        p.pressao = float(request.form.get("pressao") or 0)
-        p.sulco = float(request.form.get("sulco") or 0)
-        db.session.commit()
-        audit("editar","Pneu", p.id); flash("Pneu atualizado.", "ok")
+        pressao = float(request.form.get("pressao") or 0)
+        sulco = float(request.form.get("sulco") or 0)
+        if (pressao, sulco) != (p.pressao, p.sulco):
+            record_measurements([{"pneu_id": p.id, "created_at": datetime.utcnow(), "pressao": pressao, "sulco": sulco}])
+        p.pressao, p.sulco = pressao, sulco
+        audit("editar","Pneu", p.id); db.session.commit()
+        flash("Pneu atualizado.", "ok")
         return redirect(url_for("pneus_list"))
     return render_template("pneus_form.html", pneu=p)
 
 @app.route("/pneus/<int:pid>/excluir", methods=["POST"])
-@login_required(role="gestor")
+@login_required(role="gestor", retry=True)
 def pneus_excluir(pid):
     p = Pneu.query.get_or_404(pid)
-    db.session.delete(p); db.session.commit()
-    audit("excluir","Pneu", p.id); flash("Pneu excluído.", "ok")
+    forget_measurements(p.id)
+    EventoPneu.query.filter_by(pneu_id=p.id).delete()
+    RelVidaPneu.query.filter_by(pneu_id=p.id).delete()
+    AlertaPneu.query.filter_by(pneu_id=p.id).delete()
+    ItemOS.query.filter_by(pneu_id=p.id).update({"pneu_id": None})  # o custo continua na OS
+    db.session.delete(p)
+    audit("excluir","Pneu", p.id); db.session.commit()
+    flash("Pneu excluído.", "ok")
     return redirect(url_for("pneus_list"))
 
+# ---- Medições em lote (pressão/sulco) ----
+MEDICAO_LIMITES = {"pressao": (0, 200), "sulco": (0, 30)}  # psi, mm
+MEDICAO_CHAVES = ["pneu_id", "codigo_barras", "numero_fogo", "numero_serie", "posicao_id", "pos_label"]
+
+def _resolve_pneus(linhas, veiculo_id):
+    # Resolve os identificadores de cada linha para (pneu_id, veiculo_id) com um IN por tipo de chave.
+    pedidos = {k: set() for k in MEDICAO_CHAVES}
+    for ln in linhas:
+        for k in MEDICAO_CHAVES:
+            if ln.get(k) not in (None, ""):
+                pedidos[k].add(str(ln[k]).strip())
+                break
+    mapa = {k: {} for k in MEDICAO_CHAVES}
+    colunas = {"pneu_id": Pneu.id, "codigo_barras": Pneu.codigo_barras,
+               "numero_fogo": Pneu.numero_fogo, "numero_serie": Pneu.numero_serie}
+    for k, col in colunas.items():
+        for parte in chunks(pedidos[k]):
+            vals = [int(v) for v in parte if v.isdigit()] if k == "pneu_id" else parte
+            for chave, pid in db.session.query(col, Pneu.id).filter(col.in_(vals)):
+                mapa[k][str(chave)] = (pid, None)
+    pos = PosicaoPneu.query.with_entities(PosicaoPneu.id, PosicaoPneu.pos_label, PosicaoPneu.pneu_id, PosicaoPneu.veiculo_id)
+    for parte in chunks(pedidos["posicao_id"]):
+        for pid_pos, _label, pid, vid in pos.filter(PosicaoPneu.id.in_([int(v) for v in parte if v.isdigit()])):
+            mapa["posicao_id"][str(pid_pos)] = (pid, vid)
+    if pedidos["pos_label"] and veiculo_id:
+        for _id, label, pid, vid in pos.filter(PosicaoPneu.veiculo_id == veiculo_id, PosicaoPneu.pos_label.in_(pedidos["pos_label"])):
+            mapa["pos_label"][label] = (pid, vid)
+    return mapa
+
+def apply_measurements(linhas, veiculo_id=None, origem="lote"):
+    # Valida e grava um lote de medições numa única transação (UPDATE/INSERT em executemany).
+    # Retorna (gravadas, erros) com erros no formato {"linha": n, "erro": "..."} (linha 1 = primeira).
+    mapa = _resolve_pneus(linhas, veiculo_id)
+    erros, medidas, vistos = [], {}, set()
+    for n, ln in enumerate(linhas, start=1):
+        chave = next((k for k in MEDICAO_CHAVES if ln.get(k) not in (None, "")), None)
+        if not chave:
+            erros.append({"linha": n, "erro": f"informe um identificador ({', '.join(MEDICAO_CHAVES)})"}); continue
+        if chave == "pos_label" and not veiculo_id:
+            erros.append({"linha": n, "erro": "pos_label exige veiculo_id"}); continue
+        achado = mapa[chave].get(str(ln[chave]).strip())
+        if not achado or not achado[0]:
+            erros.append({"linha": n, "erro": f"pneu não encontrado ({chave}={ln[chave]})"}); continue
+        pid, vid = achado
+        if pid in vistos:
+            erros.append({"linha": n, "erro": f"pneu {pid} repetido no lote"}); continue
+        valores, erro = {}, None
+        for campo, (lo, hi) in MEDICAO_LIMITES.items():
+            bruto = ln.get(campo)
+            if bruto in (None, ""):
+                continue
+            try:
+                v = float(str(bruto).replace(",", "."))
+            except ValueError:
+                erro = f"{campo} inválido: {bruto}"; break
+            if not lo <= v <= hi:
+                erro = f"{campo} fora da faixa {lo}-{hi}: {v}"; break
+            valores[campo] = v
+        if not erro and not valores:
+            erro = "nenhuma medição (pressao/sulco)"
+        if erro:
+            erros.append({"linha": n, "erro": erro}); continue
+        vistos.add(pid)
+        medidas[pid] = (vid or veiculo_id, valores)
+    if medidas:
+        # agrupa por conjunto de colunas: o UPDATE em lote por PK exige as mesmas chaves em cada dict
+        grupos = {}
+        for pid, (_vid, valores) in medidas.items():
+            grupos.setdefault(tuple(sorted(valores)), []).append({"id": pid, **valores})
+        for params in grupos.values():
+            db.session.execute(update(Pneu), params)
+        agora = datetime.utcnow()
+        record_measurements([{"pneu_id": pid, "created_at": agora, **valores} for pid, (_vid, valores) in medidas.items()])
+        db.session.execute(insert(Historico), [
+            {"veiculo_id": vid, "pneu_id": pid, "acao": "medicao", "created_at": agora,
+             "detalhes": " ".join(f"{k}={v:g}" for k, v in sorted(valores.items()))}
+            for pid, (vid, valores) in medidas.items()
+        ])
+        audit("medicao_lote", "Pneu", None, f"{origem}: {len(medidas)} pneus" + (f" vid={veiculo_id}" if veiculo_id else ""))
+    return len(medidas), erros
+
+@app.route("/api/medicoes", methods=["POST"])
+@login_required(retry=True)
+def api_medicoes():
+    # Aceita medições de todas as posições de um veículo (veiculo_id + pos_label/posicao_id)
+    # ou de uma ronda no pátio (pneu_id/codigo_barras/numero_fogo/numero_serie).
+    try:
+        linhas, topo = read_payload_rows("medicoes")
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
+    veiculo_id = topo.get("veiculo_id") or request.args.get("veiculo_id")
+    try:
+        veiculo_id = int(veiculo_id) if veiculo_id not in (None, "") else None
+    except (TypeError, ValueError):
+        return jsonify({"erro": "veiculo_id inválido"}), 400
+    gravadas, erros = apply_measurements(linhas, veiculo_id, origem="api")
+    db.session.commit()
+    return jsonify({"recebidas": len(linhas), "gravadas": gravadas, "erros": erros})
+
+@app.route("/api/pneus/<int:pid>/curva")
+@login_required()
+def api_curva_pneu(pid):
+    # Curva de desgaste do pneu a partir dos resumos (?periodo=dia|semana|mes)
+    periodo = request.args.get("periodo", "semana")
+    if periodo not in PERIODOS:
+        return jsonify({"erro": f"periodo deve ser um de {', '.join(PERIODOS)}"}), 400
+    Pneu.query.get_or_404(pid)
+    return jsonify({"pneu_id": pid, "periodo": periodo, "pontos": resumo_medicoes(pid, periodo)})
+
+@app.route("/api/frota/sulco")
+@login_required()
+def api_frota_sulco():
+    periodo = request.args.get("periodo", "semana")
+    if periodo not in PERIODOS:
+        return jsonify({"erro": f"periodo deve ser um de {', '.join(PERIODOS)}"}), 400
+    desde = request.args.get("desde")
+    try:
+        desde = datetime.fromisoformat(desde).date() if desde else None
+    except ValueError:
+        return jsonify({"erro": "desde deve ser uma data ISO (AAAA-MM-DD)"}), 400
+    return jsonify({"periodo": periodo, "pontos": resumo_medicoes(FROTA, periodo, desde)})
+
 # ---- CRUD Veículos + Eixos ----
 @app.route("/veiculos")
 @login_required()
 def veiculos_list():
-    vs = Veiculo.query.order_by(Veiculo.placa).all()
-    return render_template("veiculos_list.html", veiculos=vs)
+    q = request.args.get("q","").strip().upper()
+    base = Veiculo.query
+    if q:
+        base = base.filter(Veiculo.placa.like(f"{q}%"))  # prefixo: usa o índice único de placa
+    def gerar():
+        vs = keyset_page(base, [(Veiculo.placa, False), (Veiculo.id, False)])
+        return render_template("_veiculos_grade.html", veiculos=vs), {"Veiculo"}
+    return render_template("veiculos_list.html", grade=cached_fragment("veiculos_list", gerar), q=q)
 
 @app.route("/veiculos/novo", methods=["GET","POST"])
-@login_required(role="gestor")
+@login_required(role="gestor", retry=True)
 def veiculos_novo():
     if request.method == "POST":
-        v = Veiculo(placa=request.form["placa"], motorista=request.form["motorista"], alerta_km_max=int(request.form.get("alerta_km_max") or 50000))
-        db.session.add(v); db.session.commit()
-        audit("criar","Veiculo"); flash("Veículo cadastrado.", "ok")
+        v = Veiculo(placa=request.form["placa"], motorista=request.form["motorista"], alerta_km_max=int(request.form.get("alerta_km_max") or 50000),
+                    hodometro=int(request.form.get("hodometro") or 0))
+        db.session.add(v); db.session.flush()
+        audit("criar","Veiculo", v.id); db.session.commit()
+        flash("Veículo cadastrado.", "ok")
         return redirect(url_for("veiculos_list"))
     return render_template("veiculos_form.html", v=None)
 
 @app.route("/veiculos/<int:vid>/editar", methods=["GET","POST"])
-@login_required(role="gestor")
+@login_required(role="gestor", retry=True)
 def veiculos_editar(vid):
     v = Veiculo.query.get_or_404(vid)
     if request.method == "POST":
         v.placa = request.form["placa"]
         v.motorista = request.form["motorista"]
         v.alerta_km_max = int(request.form.get("alerta_km_max") or v.alerta_km_max)
-        db.session.commit()
-        audit("editar","Veiculo", v.id); flash("Veículo atualizado.", "ok")
+        try:
+            read_odometer(v, request.form.get("hodometro"))
+        except ValueError as e:
+            flash(str(e), "error")
+            return redirect(url_for("veiculos_editar", vid=v.id))
+        audit("editar","Veiculo", v.id); db.session.commit()
+        flash("Veículo atualizado.", "ok")
         return redirect(url_for("veiculos_list"))
     return render_template("veiculos_form.html", v=v)
 
 @app.route("/veiculos/<int:vid>/excluir", methods=["POST"])
-@login_required(role="gestor")
+@login_required(role="gestor", retry=True)
 def veiculos_excluir(vid):
     v = Veiculo.query.get_or_404(vid)
-    db.session.delete(v); db.session.commit()
-    audit("excluir","Veiculo", v.id); flash("Veículo excluído.", "ok")
+    db.session.delete(v)
+    audit("excluir","Veiculo", v.id); db.session.commit()
+    flash("Veículo excluído.", "ok")
     return redirect(url_for("veiculos_list"))
 
 @app.route("/veiculo/<int:vid>")
 @login_required()
 def veiculo_detail(vid):
-    v = Veiculo.query.get_or_404(vid)
-    eixos = Eixo.query.filter_by(veiculo_id=v.id).order_by(Eixo.ordem).all()
-    posicoes = PosicaoPneu.query.filter_by(veiculo_id=v.id).all()
-    grouped = {}
-    for p in posicoes:
-        grouped.setdefault(p.eixo_id, []).append(p)
-    return render_template("veiculo_detail.html", v=v, eixos=eixos, grouped=grouped)
+    def gerar():
+        v = Veiculo.query.get_or_404(vid)
+        eixos = Eixo.query.filter_by(veiculo_id=v.id).order_by(Eixo.ordem).all()
+        posicoes = PosicaoPneu.query.filter_by(veiculo_id=v.id).all()
+        grouped = {}
+        for p in posicoes:
+            grouped.setdefault(p.eixo_id, []).append(p)
+        tags = {f"veiculo:{v.id}", "Veiculo*", "Eixo*", "PosicaoPneu*", "Anexo*", "Pneu*"}
+        tags.update(f"pneu:{p.pneu_id}" for p in posicoes if p.pneu_id)
+        return render_template("_veiculo_detail.html", v=v, eixos=eixos, grouped=grouped), tags
+    return render_template("veiculo_detail.html", conteudo=cached_fragment("veiculo_detail", gerar))
 
 # Eixos
 @app.route("/veiculos/<int:vid>/eixos/novo", methods=["POST"])
-@login_required(role="gestor")
+@login_required(role="gestor", retry=True)
 def eixo_novo(vid):
     v = Veiculo.query.get_or_404(vid)
     e = Eixo(veiculo_id=v.id, nome=request.form["nome"], ordem=int(request.form.get("ordem") or 0))
-    db.session.add(e); db.session.commit()
-    audit("criar","Eixo", e.id, f"vid={v.id}"); flash("Eixo adicionado.", "ok")
+    db.session.add(e); db.session.flush()
+    audit("criar","Eixo", e.id, f"vid={v.id}"); db.session.commit()
+    flash("Eixo adicionado.", "ok")
     return redirect(url_for("veiculo_detail", vid=v.id))
 
 @app.route("/eixos/<int:eid>/excluir", methods=["POST"])
-@login_required(role="gestor")
+@login_required(role="gestor", retry=True)
 def eixo_excluir(eid):
     e = Eixo.query.get_or_404(eid)
     vid = e.veiculo_id
-    db.session.delete(e); db.session.commit()
-    audit("excluir","Eixo", e.id); flash("Eixo removido.", "ok")
+    db.session.delete(e)
+    audit("excluir","Eixo", e.id); db.session.commit()
+    flash("Eixo removido.", "ok")
     return redirect(url_for("veiculo_detail", vid=vid))
 
 # Instalar/Desinstalar Pneu
 @app.route("/veiculo/<int:vid>/posicao/<int:pid>/instalar", methods=["GET","POST"])
-@login_required(role="gestor")
+@login_required(role="gestor", retry=True)
 def instalar_pneu(vid, pid):
     v = Veiculo.query.get_or_404(vid)
     pos = PosicaoPneu.query.get_or_404(pid)
@@ -452,45 +2261,624 @@ def instalar_pneu(vid, pid):
     if request.method == "POST":
         pneu_id = int(request.form["pneu_id"])
         pneu = Pneu.query.get_or_404(pneu_id)
+        try:
+            km = read_odometer(v, request.form.get("km"))
+        except ValueError as e:
+            flash(str(e), "error")
+            return redirect(url_for("instalar_pneu", vid=v.id, pid=pos.id))
         pos.pneu_id = pneu.id
         pneu.status = "ativo"
-        db.session.commit()
+        record_lifecycle([{"pneu_id": pneu.id, "veiculo_id": v.id, "pos_label": pos.pos_label, "tipo": "instalar",
+                           "km": km, "sulco": pneu.sulco}])
         audit("instalar","Pneu", pneu.id, f"vid={v.id} pos={pos.pos_label}")
+        db.session.commit()
         flash("Pneu instalado na posição.", "ok")
         return redirect(url_for("veiculo_detail", vid=v.id))
     return render_template("instalar_pneu.html", v=v, pos=pos, estoque=estoque)
 
 @app.route("/veiculo/<int:vid>/posicao/<int:pid>/desinstalar", methods=["POST"])
-@login_required(role="gestor")
+@login_required(role="gestor", retry=True)
 def desinstalar_pneu(vid, pid):
     v = Veiculo.query.get_or_404(vid)
     pos = PosicaoPneu.query.get_or_404(pid)
     if pos.pneu:
+        try:
+            km = read_odometer(v, request.form.get("km"))
+        except ValueError as e:
+            flash(str(e), "error")
+            return redirect(url_for("veiculo_detail", vid=v.id))
         pneu_id = pos.pneu.id
+        record_lifecycle([{"pneu_id": pneu_id, "veiculo_id": v.id, "pos_label": pos.pos_label, "tipo": "retirar",
+                           "destino": "estoque", "km": km, "sulco": pos.pneu.sulco}])
         pos.pneu.status = "estoque"
         pos.pneu_id = None
-        db.session.commit()
         audit("desinstalar","Pneu", pneu_id, f"vid={v.id} pos={pos.pos_label}")
+        db.session.commit()
         flash("Pneu desinstalado e enviado ao estoque.", "ok")
     return redirect(url_for("veiculo_detail", vid=v.id))
 
+# ---- Rodízio / troca em lote ----
+# Um mapa {posição: pneu|None} aplicado numa transação: as posições e os pneus envolvidos são
+# lidos com FOR UPDATE (no SQLite o próprio lock de escrita serializa e o retry cobre conflitos),
+# o estado esperado da prévia é conferido linha a linha e Historico/AuditLog saem em lote.
+DESTINOS_RETIRADA = ("estoque", "conserto", "recapagem", "sucateado")
+
+def _pneu_label(p):
+    return (p.numero_fogo or p.numero_serie or f"#{p.id}") if p else "vazio"
+
+def plan_rotation(vid, mapa, esperado=None, bloquear=False):
+    # Calcula o plano sem gravar. Retorna dict com posicoes, pneus, final, plano, erros e conflitos.
+    q = PosicaoPneu.query.filter_by(veiculo_id=vid).order_by(PosicaoPneu.eixo_id, PosicaoPneu.id)
+    if bloquear:
+        q = q.with_for_update(of=PosicaoPneu)
+    posicoes = {p.id: p for p in q}
+    erros = [f"Posição {pid} não pertence ao veículo." for pid in mapa if pid not in posicoes]
+    conflitos = [f"{posicoes[pid].pos_label} mudou desde a prévia."
+                 for pid, pneu in (esperado or {}).items() if pid in posicoes and posicoes[pid].pneu_id != pneu]
+    atual = {pid: p.pneu_id for pid, p in posicoes.items()}
+    final = dict(atual)
+    final.update((pid, pneu) for pid, pneu in mapa.items() if pid in posicoes)
+
+    vistos = {}
+    for pid, pneu in final.items():
+        if pneu and pneu in vistos:
+            erros.append(f"Pneu {pneu} em duas posições ({posicoes[vistos[pneu]].pos_label} e {posicoes[pid].pos_label}).")
+        vistos.setdefault(pneu, pid)
+    ids = {p for p in (*atual.values(), *final.values()) if p}
+    entrando = {p for p in final.values() if p} - {p for p in atual.values() if p}
+    q = Pneu.query.filter(Pneu.id.in_(ids))
+    if bloquear:
+        q = q.with_for_update()
+    pneus = {p.id: p for p in q} if ids else {}
+    for pneu in sorted(entrando):
+        if pneu not in pneus:
+            erros.append(f"Pneu {pneu} não existe.")
+        elif pneus[pneu].status != "estoque":
+            erros.append(f"Pneu {_pneu_label(pneus[pneu])} não está em estoque ({pneus[pneu].status}).")
+    if entrando:
+        for pneu, outro in db.session.execute(select(PosicaoPneu.pneu_id, PosicaoPneu.veiculo_id)
+                                              .where(PosicaoPneu.pneu_id.in_(entrando), PosicaoPneu.veiculo_id != vid)):
+            erros.append(f"Pneu {_pneu_label(pneus.get(pneu))} está instalado no veículo {outro}.")
+
+    antes = {pneu: pid for pid, pneu in atual.items() if pneu}
+    depois = {pneu: pid for pid, pneu in final.items() if pneu}
+    plano = []
+    for pneu in sorted(set(antes) | set(depois)):
+        de, para = antes.get(pneu), depois.get(pneu)
+        if de == para:
+            continue
+        plano.append({"pneu_id": pneu, "pneu": _pneu_label(pneus.get(pneu)),
+                      "acao": "rodizio" if de and para else ("instalar" if para else "desinstalar"),
+                      "de": de, "para": para,
+                      "de_label": posicoes[de].pos_label if de else None,
+                      "para_label": posicoes[para].pos_label if para else None})
+    return {"posicoes": posicoes, "pneus": pneus, "atual": atual, "final": final,
+            "plano": plano, "erros": erros, "conflitos": conflitos}
+
+def apply_rotation(vid, r, destino="estoque"):
+    # Aplica um plano já validado (plan_rotation com bloquear=True) na transação corrente.
+    for pid, pneu in r["final"].items():
+        if r["posicoes"][pid].pneu_id != pneu:
+            r["posicoes"][pid].pneu_id = pneu
+    agora = datetime.utcnow()
+    for item in r["plano"]:
+        if item["acao"] == "instalar":
+            r["pneus"][item["pneu_id"]].status = "ativo"
+        elif item["acao"] == "desinstalar":
+            r["pneus"][item["pneu_id"]].status = destino
+    if r["plano"]:
+        detalhes = [f"{it['de_label'] or '-'} -> {it['para_label'] or destino}" for it in r["plano"]]
+        db.session.execute(insert(Historico), [
+            {"veiculo_id": vid, "pneu_id": it["pneu_id"], "acao": it["acao"], "created_at": agora, "detalhes": d}
+            for it, d in zip(r["plano"], detalhes)])
+        tipos = {"instalar": "instalar", "desinstalar": "retirar", "rodizio": "rodizio"}
+        record_lifecycle([{"pneu_id": it["pneu_id"], "veiculo_id": vid, "tipo": tipos[it["acao"]],
+                           "pos_label": it["para_label"] or it["de_label"],
+                           "destino": destino if it["acao"] == "desinstalar" else None} for it in r["plano"]], agora)
+        u = current_user()
+        db.session.execute(insert(AuditLog), [
+            {"user_email": u.email if u else None, "action": it["acao"], "entity": "Pneu", "entity_id": it["pneu_id"],
+             "details": f"vid={vid} {d}", "created_at": agora} for it, d in zip(r["plano"], detalhes)])
+
+def _rotation_from_form(posicoes):
+    # pos_<id> = pneu escolhido ("" = vazio); novo_<id> = código de barras/nº de fogo de um pneu do estoque
+    mapa, erros = {}, []
+    codigos = {pid: request.form.get(f"novo_{pid}", "").strip() for pid in posicoes}
+    codigos = {pid: c for pid, c in codigos.items() if c}
+    por_codigo = barcode_index.resolve(set(codigos.values()))
+    faltam = set(codigos.values()) - set(por_codigo)
+    if faltam:
+        por_codigo.update(db.session.execute(select(Pneu.numero_fogo, Pneu.id).where(Pneu.numero_fogo.in_(faltam))).all())
+    for pid in posicoes:
+        if pid in codigos:
+            if codigos[pid] not in por_codigo:
+                erros.append(f"Código {codigos[pid]} não encontrado.")
+                continue
+            mapa[pid] = por_codigo[codigos[pid]]
+        elif f"pos_{pid}" in request.form:
+            mapa[pid] = request.form.get(f"pos_{pid}", type=int) or None
+    esperado = {pid: request.form.get(f"esperado_{pid}", type=int) for pid in posicoes if f"esperado_{pid}" in request.form}
+    return mapa, esperado, erros
+
+@app.route("/veiculo/<int:vid>/rodizio", methods=["GET", "POST"])
+@login_required(role="gestor", retry=True)
+def rodizio(vid):
+    v = Veiculo.query.get_or_404(vid)
+    destino = request.form.get("destino", "estoque")
+    if destino not in DESTINOS_RETIRADA:
+        destino = "estoque"
+    aplicar = request.method == "POST" and request.form.get("acao") == "aplicar"
+    mapa, esperado, erros = {}, None, []
+    if request.method == "POST":
+        mapa, esperado, erros = _rotation_from_form(db.session.scalars(select(PosicaoPneu.id).where(PosicaoPneu.veiculo_id == v.id)).all())
+    r = plan_rotation(v.id, mapa, esperado, bloquear=aplicar)
+    if request.method == "POST":
+        erros += r["erros"] + r["conflitos"]
+        if aplicar and not erros:
+            apply_rotation(v.id, r, destino)
+            db.session.commit()
+            flash(f"Rodízio aplicado ({len(r['plano'])} movimentações).", "ok")
+            return redirect(url_for("veiculo_detail", vid=v.id))
+        db.session.rollback()
+    eixos = Eixo.query.filter_by(veiculo_id=v.id).order_by(Eixo.ordem).all()
+    return render_template("rodizio.html", v=v, eixos=eixos, r=r, erros=erros, destino=destino,
+                           previa=request.method == "POST", destinos=DESTINOS_RETIRADA)
+
+@app.route("/api/veiculos/<int:vid>/rodizio", methods=["POST"])
+@login_required(role="gestor", retry=True)
+def rodizio_api(vid):
+    # {"mapa": {"<posicao_id>": pneu_id|null}, "esperado": {...opcional}, "destino": "estoque", "aplicar": false}
+    Veiculo.query.get_or_404(vid)
+    data = request.get_json(silent=True) or {}
+    try:
+        mapa = {int(k): (int(p) if p else None) for k, p in (data.get("mapa") or {}).items()}
+        esperado = {int(k): (int(p) if p else None) for k, p in (data.get("esperado") or {}).items()}
+    except (TypeError, ValueError, AttributeError):
+        return jsonify({"erro": "mapa/esperado devem ser {posicao_id: pneu_id|null}"}), 400
+    destino = data.get("destino") or "estoque"
+    if destino not in DESTINOS_RETIRADA:
+        return jsonify({"erro": f"destino deve ser um de {', '.join(DESTINOS_RETIRADA)}"}), 400
+    aplicar = bool(data.get("aplicar"))
+    r = plan_rotation(vid, mapa, esperado, bloquear=aplicar)
+    corpo = {"plano": r["plano"], "atual": r["atual"], "final": r["final"], "erros": r["erros"],
+             "conflitos": r["conflitos"], "aplicado": False}
+    if r["erros"] or r["conflitos"]:
+        db.session.rollback()
+        return jsonify(corpo), 409 if r["conflitos"] and not r["erros"] else 400
+    if aplicar:
+        apply_rotation(vid, r, destino)
+        db.session.commit()
+        corpo["aplicado"] = True
+    return jsonify(corpo)
+
+# ---- Importação / exportação em massa ----
+# Cadastro inicial de um contrato de frota: o arquivo (CSV ou XLSX) é lido linha a linha, validado
+# em lotes de IMPORT_CHUNK linhas e cada lote vira uma transação (upsert por numero_serie/placa).
+# O progresso sai em NDJSON, uma linha por lote gravado; a exportação usa o mesmo layout.
+IMPORT_CHUNK = 1000
+IMPORT_MAX_ERROS = 500  # erros detalhados no resumo final
+IMPORT_LAYOUTS = {
+    "pneus": ["numero_serie", "numero_fogo", "codigo_barras", "marca", "modelo", "medida", "status", "pressao", "sulco"],
+    "veiculos": ["placa", "motorista", "alerta_km_max", "hodometro"],
+    "eixos": ["placa", "nome", "ordem"],
+    "posicoes": ["placa", "pos_label", "eixo", "numero_serie"],
+}
+STATUS_PNEU = ("estoque", "ativo", "conserto", "recapagem", "vendido", "sucateado", "rodizio")
+
+def _celula(v):
+    if v is None:
+        return ""
+    if isinstance(v, float) and v.is_integer():
+        v = int(v)  # XLSX devolve 22.0 para o número de fogo "22"
+    return str(v).strip()
+
+def _import_rows(stream, nome):
+    # Devolve (cabeçalho, gerador de (nº da linha, dict)) sem carregar o arquivo inteiro:
+    # csv.reader sobre o stream (vírgula ou ponto e vírgula) ou openpyxl em modo read_only.
+    if (nome or "").lower().endswith(".xlsx"):
+        if openpyxl is None:
+            raise ValueError("instale o openpyxl para importar XLSX (ou envie CSV)")
+        wb = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+        linhas = wb.active.iter_rows(values_only=True)
+        cab = [_celula(c).lower() for c in next(linhas, ())]
+        def gerar():
+            try:
+                for n, vals in enumerate(linhas, start=2):
+                    vals = [_celula(v) for v in vals]
+                    if any(vals):
+                        yield n, {k: v for k, v in zip(cab, vals) if k}
+            finally:
+                wb.close()
+        return cab, gerar()
+    texto = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    primeira = texto.readline()
+    delim = ";" if primeira.count(";") > primeira.count(",") else ","
+    cab = [c.strip().lower() for c in next(csv.reader([primeira], delimiter=delim), [])]
+    leitor = csv.reader(texto, delimiter=delim)
+    def gerar():
+        for vals in leitor:
+            if any(v.strip() for v in vals):
+                yield leitor.line_num + 1, {k: v.strip() for k, v in zip(cab, vals) if k}
+    return cab, gerar()
+
+def _lotes(linhas, n):
+    lote = []
+    for item in linhas:
+        lote.append(item)
+        if len(lote) == n:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+def _campo_num(r, k, tipo=float, faixa=None):
+    # None quando vazio (mantém o valor atual); ValueError com mensagem para o relatório
+    v = r.get(k, "")
+    if v == "":
+        return None
+    try:
+        v = tipo(v.replace(",", "."))
+    except ValueError:
+        raise ValueError(f"{k} inválido: {r[k]!r}")
+    if faixa and not faixa[0] <= v <= faixa[1]:
+        raise ValueError(f"{k} fora da faixa {faixa[0]}-{faixa[1]}")
+    return v
+
+def _por_chave(col, chaves, *extras):
+    # {chave: [(id, *extras), ...]} com um IN por fatia; lista para detectar chave repetida
+    out = {}
+    for parte in chunks(chaves):
+        for chave, *resto in db.session.execute(select(col, *extras).where(col.in_(parte))):
+            out.setdefault(chave, []).append(tuple(resto))
+    return out
+
+def _veiculos_por_placa(placas):
+    return {p: ids[0][0] for p, ids in _por_chave(Veiculo.placa, placas, Veiculo.id).items()}
+
+def _importar_pneus(lote):
+    erros, linhas = [], {}
+    for n, r in lote:
+        serie = r.get("numero_serie", "")
+        if not serie or len(serie) > 40:
+            erros.append({"linha": n, "erro": "numero_serie obrigatório (até 40 caracteres)"}); continue
+        d = {k: r[k][:40] for k in ("numero_fogo", "marca", "modelo", "medida") if r.get(k)}
+        if r.get("codigo_barras"):
+            d["codigo_barras"] = r["codigo_barras"][:64]
+        if r.get("status"):
+            if r["status"].lower() not in STATUS_PNEU:
+                erros.append({"linha": n, "erro": f"status inválido: {r['status']!r}"}); continue
+            d["status"] = r["status"].lower()
+        try:
+            for k in ("pressao", "sulco"):
+                v = _campo_num(r, k, faixa=MEDICAO_LIMITES[k])
+                if v is not None:
+                    d[k] = v
+        except ValueError as e:
+            erros.append({"linha": n, "erro": str(e)}); continue
+        linhas.setdefault(serie, {"numero_serie": serie, "_linha": n}).update(d, _linha=n)  # última linha vence
+
+    existentes = _por_chave(Pneu.numero_serie, linhas, Pneu.id, Pneu.pressao, Pneu.sulco)
+    codigos = _por_chave(Pneu.codigo_barras, {d["codigo_barras"] for d in linhas.values() if "codigo_barras" in d},
+                         Pneu.numero_serie)
+    usados = set()
+    for serie, d in list(linhas.items()):
+        cb = d.get("codigo_barras")
+        dono = codigos.get(cb, [(serie,)])[0][0] if cb else serie
+        if len(existentes.get(serie, ())) > 1:
+            erro = "numero_serie repetido no cadastro"
+        elif cb and (dono != serie or cb in usados):
+            erro = f"codigo_barras {cb} já pertence a outro pneu"
+        else:
+            usados.add(cb)
+            continue
+        erros.append({"linha": d["_linha"], "erro": erro})
+        del linhas[serie]
+
+    agora = datetime.utcnow()
+    novos, alterados, medidas = [], [], []
+    for serie, d in linhas.items():
+        d.pop("_linha")
+        if serie in existentes:
+            pid, pressao, sulco = existentes[serie][0]
+            if (d.get("pressao", pressao), d.get("sulco", sulco)) != (pressao, sulco):
+                medidas.append({"pneu_id": pid, "created_at": agora, "pressao": d.get("pressao", pressao),
+                                "sulco": d.get("sulco", sulco)})
+            alterados.append({"id": pid, **d})
+        else:
+            novos.append({"numero_fogo": None, "codigo_barras": None, "marca": None, "modelo": None, "medida": None,
+                          "status": "estoque", "pressao": 0, "sulco": 0, **d})
+    if novos:
+        ids = dict(db.session.execute(insert(Pneu).returning(Pneu.numero_serie, Pneu.id), novos).all())
+        medidas += [{"pneu_id": ids[d["numero_serie"]], "created_at": agora, "pressao": d["pressao"], "sulco": d["sulco"]}
+                    for d in novos if d["pressao"] or d["sulco"]]
+    if alterados:
+        db.session.execute(update(Pneu), alterados)
+    record_measurements(medidas)
+    return len(novos), len(alterados), erros
+
+def _importar_veiculos(lote):
+    erros, linhas = [], {}
+    for n, r in lote:
+        placa = r.get("placa", "").upper()
+        if not placa or len(placa) > 10:
+            erros.append({"linha": n, "erro": "placa obrigatória (até 10 caracteres)"}); continue
+        d = {"placa": placa, "_linha": n}
+        if r.get("motorista"):
+            d["motorista"] = r["motorista"][:80]
+        try:
+            km = _campo_num(r, "alerta_km_max", int, (1, 10 ** 7))
+        except ValueError as e:
+            erros.append({"linha": n, "erro": str(e)}); continue
+        if km is not None:
+            d["alerta_km_max"] = km
+        try:
+            hodometro = _campo_num(r, "hodometro", int, (0, 10 ** 8))
+        except ValueError as e:
+            erros.append({"linha": n, "erro": str(e)}); continue
+        if hodometro is not None:
+            d["hodometro"] = hodometro
+        linhas.setdefault(placa, {}).update(d)
+
+    existentes = _veiculos_por_placa(linhas)
+    novos, alterados = [], []
+    for placa, d in linhas.items():
+        n = d.pop("_linha")
+        if placa in existentes:
+            alterados.append({"id": existentes[placa], **d})
+        elif "motorista" not in d:
+            erros.append({"linha": n, "erro": "motorista obrigatório para veículo novo"})
+        else:
+            novos.append({"alerta_km_max": 50000, "hodometro": 0, **d})
+    if novos:
+        db.session.execute(insert(Veiculo), novos)  # placa é única: corrida com outro cadastro aborta o lote
+    if alterados:
+        db.session.execute(update(Veiculo), alterados)
+    return len(novos), len(alterados), erros
+
+def _importar_eixos(lote):
+    erros, linhas = [], {}
+    vids = _veiculos_por_placa({r.get("placa", "").upper() for _n, r in lote})
+    for n, r in lote:
+        vid, nome = vids.get(r.get("placa", "").upper()), r.get("nome", "")[:60]
+        if not vid or not nome:
+            erros.append({"linha": n, "erro": "placa inexistente" if nome else "nome obrigatório"}); continue
+        try:
+            ordem = _campo_num(r, "ordem", int)
+        except ValueError as e:
+            erros.append({"linha": n, "erro": str(e)}); continue
+        d = linhas.setdefault((vid, nome), {"veiculo_id": vid, "nome": nome})
+        if ordem is not None:
+            d["ordem"] = ordem
+
+    existentes = {(vid, nome): eid for vid, nome, eid in db.session.execute(
+        select(Eixo.veiculo_id, Eixo.nome, Eixo.id).where(Eixo.veiculo_id.in_({k[0] for k in linhas})))}
+    novos = [{"ordem": 0, **d} for k, d in linhas.items() if k not in existentes]
+    alterados = [{"id": existentes[k], "ordem": d["ordem"]} for k, d in linhas.items() if k in existentes and "ordem" in d]
+    if novos:
+        db.session.execute(insert(Eixo), novos)
+    if alterados:
+        db.session.execute(update(Eixo), alterados)
+    return len(novos), len(alterados), erros
+
+def _importar_posicoes(lote):
+    # Posição = (placa, pos_label). Um pneu informado é instalado (status ativo) e o que ocupava
+    # a posição volta ao estoque; pneu montado em outra posição ou fora de estoque/rodízio
+    # (vendido, sucateado, em conserto...) é recusado.
+    erros, linhas, situacao = [], {}, {}
+    vids = _veiculos_por_placa({r.get("placa", "").upper() for _n, r in lote})
+    eixos = {(vid, nome): eid for vid, nome, eid in db.session.execute(
+        select(Eixo.veiculo_id, Eixo.nome, Eixo.id).where(Eixo.veiculo_id.in_(set(vids.values()))))}
+    pneus = _por_chave(Pneu.numero_serie, {r["numero_serie"] for _n, r in lote if r.get("numero_serie")},
+                       Pneu.id, Pneu.status)
+    for n, r in lote:
+        vid, label = vids.get(r.get("placa", "").upper()), r.get("pos_label", "")[:60]
+        if not vid or not label:
+            erros.append({"linha": n, "erro": "placa inexistente" if label else "pos_label obrigatório"}); continue
+        d = {"veiculo_id": vid, "pos_label": label, "_linha": n}
+        if r.get("eixo"):
+            if (vid, r["eixo"]) not in eixos:
+                erros.append({"linha": n, "erro": f"eixo {r['eixo']!r} não existe no veículo"}); continue
+            d["eixo_id"] = eixos[(vid, r["eixo"])]
+        if r.get("numero_serie"):
+            ids = pneus.get(r["numero_serie"], [])
+            if len(ids) != 1:
+                erros.append({"linha": n, "erro": "pneu inexistente" if not ids else "numero_serie repetido no cadastro"}); continue
+            d["pneu_id"], situacao[ids[0][0]] = ids[0]
+        linhas.setdefault((vid, label), {}).update(d)
+
+    posicoes = {}
+    for parte in chunks({k[0] for k in linhas}):
+        for pos_id, vid, label, pneu_id in db.session.execute(
+                select(PosicaoPneu.id, PosicaoPneu.veiculo_id, PosicaoPneu.pos_label, PosicaoPneu.pneu_id)
+                .where(PosicaoPneu.veiculo_id.in_(parte))):
+            posicoes[(vid, label)] = (pos_id, pneu_id)
+    montado = {}
+    for parte in chunks({d["pneu_id"] for d in linhas.values() if "pneu_id" in d}):
+        montado.update({pneu_id: (vid, label) for pneu_id, vid, label in db.session.execute(
+            select(PosicaoPneu.pneu_id, PosicaoPneu.veiculo_id, PosicaoPneu.pos_label).where(PosicaoPneu.pneu_id.in_(parte)))})
+
+    novos, alterados, status, usados, eventos = [], [], {}, set(), []
+    for chave, d in linhas.items():
+        n = d.pop("_linha")
+        pneu_id = d.get("pneu_id")
+        if pneu_id and (pneu_id in usados or montado.get(pneu_id, chave) != chave):
+            erros.append({"linha": n, "erro": "pneu já instalado em outra posição"}); continue
+        if pneu_id and montado.get(pneu_id) != chave and situacao[pneu_id] not in ("estoque", "rodizio"):
+            erros.append({"linha": n, "erro": f"pneu não disponível para instalar ({situacao[pneu_id]})"}); continue
+        if pneu_id:
+            usados.add(pneu_id)
+            status[pneu_id] = "ativo"
+        atual = posicoes.get(chave, (None, None))[1]
+        if atual and pneu_id and atual != pneu_id:
+            status.setdefault(atual, "estoque")
+            eventos.append({"pneu_id": atual, "veiculo_id": chave[0], "pos_label": chave[1], "tipo": "retirar", "destino": "estoque"})
+        if pneu_id and atual != pneu_id:
+            eventos.append({"pneu_id": pneu_id, "veiculo_id": chave[0], "pos_label": chave[1], "tipo": "instalar"})
+        if chave in posicoes:
+            alterados.append({"id": posicoes[chave][0], **d})
+        else:
+            novos.append({"eixo_id": None, "pneu_id": None, **d})
+    if novos:
+        db.session.execute(insert(PosicaoPneu), novos)
+    if alterados:
+        db.session.execute(update(PosicaoPneu), alterados)
+    record_lifecycle(eventos)  # antes do UPDATE de status: grava o sulco do momento
+    if status:
+        db.session.execute(update(Pneu), [{"id": pid, "status": s} for pid, s in status.items()])
+    return len(novos), len(alterados), erros
+
+IMPORTADORES = {  # tipo: (função, entidade da auditoria, colunas obrigatórias)
+    "pneus": (_importar_pneus, "Pneu", ["numero_serie"]),
+    "veiculos": (_importar_veiculos, "Veiculo", ["placa"]),
+    "eixos": (_importar_eixos, "Eixo", ["placa", "nome"]),
+    "posicoes": (_importar_posicoes, "PosicaoPneu", ["placa", "pos_label"]),
+}
+
+def import_lote(tipo, lote):
+    # Uma transação por lote; banco ocupado repete só o lote, não o arquivo.
+    fn, entidade, _cols = IMPORTADORES[tipo]
+    tentativas = app.config["DB_WRITE_RETRIES"]
+    for n in range(tentativas + 1):
+        try:
+            inseridos, atualizados, erros = fn(lote)
+            if inseridos or atualizados:
+                audit("importar", entidade, None,
+                      f"linhas {lote[0][0]}-{lote[-1][0]} inseridos={inseridos} atualizados={atualizados}")
+            db.session.commit()
+            return inseridos, atualizados, erros
+        except OperationalError as e:
+            db.session.rollback()
+            if not _is_busy(e) or n == tentativas:
+                raise
+            time.sleep(0.05 * 2 ** n)
+
+@app.route("/importar")
+@login_required(role="gestor")
+def importar():
+    return render_template("importar.html", layouts=IMPORT_LAYOUTS, obrigatorias={t: c for t, (_f, _e, c) in IMPORTADORES.items()},
+                           xlsx=openpyxl is not None)
+
+def run_import(tipo, linhas):
+    # Aplica o arquivo lote a lote; gera o progresso após cada lote e, por último, o resumo.
+    total = {"linhas": 0, "inseridos": 0, "atualizados": 0, "com_erro": 0}
+    erros, falha, lote_n = [], None, 0
+    try:
+        for lote_n, lote in enumerate(_lotes(linhas, IMPORT_CHUNK), start=1):
+            inseridos, atualizados, erros_lote = import_lote(tipo, lote)
+            total["linhas"] += len(lote); total["inseridos"] += inseridos
+            total["atualizados"] += atualizados; total["com_erro"] += len(erros_lote)
+            erros += erros_lote[:IMPORT_MAX_ERROS - len(erros)]
+            yield {"lote": lote_n, **total}
+    except (SQLAlchemyError, UnicodeDecodeError, csv.Error) as e:
+        db.session.rollback()
+        falha = f"lote {lote_n + 1} não gravado: {e.__class__.__name__}: {str(e).splitlines()[0][:200]}"
+        app.logger.exception("Importação de %s interrompida", tipo)
+    yield {"fim": True, "falha": falha, **total, "erros": erros}
+
+def _import_header_erro(tipo, cab):
+    faltando = [c for c in IMPORTADORES[tipo][2] if c not in cab]
+    if faltando:
+        return {"erro": f"colunas obrigatórias ausentes: {', '.join(faltando)}", "layout": IMPORT_LAYOUTS[tipo]}
+
+ARQUIVO_INVALIDO = (ValueError, UnicodeDecodeError, csv.Error, zipfile.BadZipFile, OSError)
+
+@app.route("/importar/<tipo>", methods=["POST"])
+@login_required(role="gestor")
+def importar_arquivo(tipo):
+    # Síncrono: responde em NDJSON enquanto grava. Com segundo_plano=1 o arquivo vai para
+    # IMPORT_DIR, vira uma tarefa "importar" e a resposta (202) aponta para o status dela.
+    if tipo not in IMPORTADORES:
+        abort(404)
+    f = request.files.get("arquivo")
+    if not f:
+        return jsonify({"erro": "envie o arquivo no campo 'arquivo' (CSV ou XLSX)"}), 400
+    if request.values.get("segundo_plano"):
+        os.makedirs(app.config["IMPORT_DIR"], exist_ok=True)
+        nome = secure_filename(f.filename or "") or "arquivo.csv"
+        caminho = os.path.join(app.config["IMPORT_DIR"], f"{uuid.uuid4().hex}_{nome}")
+        f.save(caminho)
+        try:
+            with open(caminho, "rb") as fh:
+                erro = _import_header_erro(tipo, _import_rows(fh, nome)[0])
+        except ARQUIVO_INVALIDO as e:
+            erro = {"erro": f"arquivo inválido: {e}"}
+        if erro:
+            os.remove(caminho)
+            return jsonify(erro), 400
+        t = enqueue("importar", {"tipo": tipo, "caminho": caminho, "nome": nome})
+        db.session.commit()
+        return jsonify({"tarefa": t.id, "status": url_for("tarefa_status", tid=t.id)}), 202
+    try:
+        cab, linhas = _import_rows(f.stream, f.filename)
+    except ARQUIVO_INVALIDO as e:
+        return jsonify({"erro": f"arquivo inválido: {e}"}), 400
+    erro = _import_header_erro(tipo, cab)
+    if erro:
+        return jsonify(erro), 400
+    gerar = (json.dumps(d, ensure_ascii=False) + "\n" for d in run_import(tipo, linhas))
+    return Response(stream_with_context(gerar), mimetype="application/x-ndjson")
+
+def _export_stmt(tipo):
+    if tipo == "pneus":
+        return select(*[getattr(Pneu, c) for c in IMPORT_LAYOUTS["pneus"]]).order_by(Pneu.id)
+    if tipo == "veiculos":
+        return select(Veiculo.placa, Veiculo.motorista, Veiculo.alerta_km_max, Veiculo.hodometro).order_by(Veiculo.placa)
+    if tipo == "eixos":
+        return (select(Veiculo.placa, Eixo.nome, Eixo.ordem).join(Veiculo, Eixo.veiculo_id == Veiculo.id)
+                .order_by(Veiculo.placa, Eixo.ordem, Eixo.id))
+    return (select(Veiculo.placa, PosicaoPneu.pos_label, Eixo.nome, Pneu.numero_serie)
+            .join(Veiculo, PosicaoPneu.veiculo_id == Veiculo.id)
+            .outerjoin(Eixo, PosicaoPneu.eixo_id == Eixo.id)
+            .outerjoin(Pneu, PosicaoPneu.pneu_id == Pneu.id)
+            .order_by(Veiculo.placa, PosicaoPneu.id))
+
+@app.route("/exportar/<tipo>")
+@login_required(role="gestor")
+def exportar(tipo):
+    # CSV no layout da importação, em blocos de AUDIT_EXPORT_CHUNK linhas (yield_per): o arquivo
+    # exportado pode ser editado e reimportado.
+    if tipo not in IMPORT_LAYOUTS:
+        abort(404)
+    stmt = _export_stmt(tipo).execution_options(yield_per=AUDIT_EXPORT_CHUNK)
+
+    def gerar():
+        buf = io.StringIO()
+        csv.writer(buf).writerow(IMPORT_LAYOUTS[tipo])
+        yield buf.getvalue()
+        for bloco in db.session.execute(stmt).partitions():
+            buf = io.StringIO()
+            csv.writer(buf).writerows(["" if v is None else v for v in r] for r in bloco)
+            yield buf.getvalue()
+
+    nome = f"{tipo}_{datetime.utcnow():%Y%m%d_%H%M%S}.csv"
+    return Response(stream_with_context(gerar()), mimetype="text/csv",
+                    headers={"Content-Disposition": f"attachment; filename={nome}"})
+
 # ---- OS ----
 @app.route("/os")
 @login_required()
 def os_list():
-    os_list = OrdemServico.query.order_by(OrdemServico.created_at.desc()).all()
-    veiculos = Veiculo.query.order_by(Veiculo.placa).all()
-    return render_template("os_list.html", os_list=os_list, veiculos=veiculos)
+    status = request.args.get("status","").strip()
+    base = OrdemServico.query
+    if status:
+        base = base.filter_by(status=status)
+    vid = request.args.get("veiculo_id", type=int)
+    if vid:
+        base = base.filter_by(veiculo_id=vid)
+    os_list = keyset_page(base, [(OrdemServico.created_at, True), (OrdemServico.id, True)])
+    veiculos = db.session.query(Veiculo.id, Veiculo.placa, Veiculo.motorista).order_by(Veiculo.placa).all()
+    return render_template("os_list.html", os_list=os_list, veiculos=veiculos, status=status, veiculo_id=vid)
 
 @app.route("/os/nova", methods=["POST"])
-@login_required(role="gestor")
+@login_required(role="gestor", retry=True)
 def os_nova():
     veiculo_id = int(request.form["veiculo_id"])
     descricao = request.form["descricao"]
     osr = OrdemServico(veiculo_id=veiculo_id, descricao=descricao, status="aberta", custo_total=0)
-    db.session.add(osr); db.session.commit()
+    db.session.add(osr); db.session.flush()
     audit("criar","OS", osr.id)
     notify("gestor", f"OS criada para veículo ID {veiculo_id}", url_for("os_detalhe", os_id=osr.id))
+    db.session.commit()
     flash("OS criada.", "ok")
     return redirect(url_for("os_detalhe", os_id=osr.id))
 
@@ -499,10 +2887,68 @@ def os_nova():
 def os_detalhe(os_id):
     osr = OrdemServico.query.get_or_404(os_id)
     veiculos = Veiculo.query.order_by(Veiculo.placa).all()
-    return render_template("os_detail.html", os=osr, veiculos=veiculos)
+    # pneus montados no veículo (para atribuir o custo do item) e rótulos dos já atribuídos
+    montados = db.session.execute(select(Pneu.id, PosicaoPneu.pos_label, Pneu.numero_serie)
+                                  .join(PosicaoPneu, PosicaoPneu.pneu_id == Pneu.id)
+                                  .where(PosicaoPneu.veiculo_id == osr.veiculo_id).order_by(PosicaoPneu.id)).all()
+    rotulos = {pid: serie for pid, _pos, serie in montados}
+    faltam = {i.pneu_id for i in osr.itens if i.pneu_id} - set(rotulos)
+    if faltam:
+        rotulos.update(db.session.execute(select(Pneu.id, Pneu.numero_serie).where(Pneu.id.in_(faltam))).all())
+    return render_template("os_detail.html", os=osr, veiculos=veiculos, montados=montados, rotulos=rotulos)
+
+def add_os_cost(os_id, delta):
+    # Total da OS por delta (UPDATE ... SET custo_total = custo_total + delta), na transação da rota
+    db.session.execute(
+        update(OrdemServico).where(OrdemServico.id == os_id)
+        .values(custo_total=func.round(func.coalesce(OrdemServico.custo_total, 0) + delta, 2))
+    )
+
+def _item_os_rows(linhas):
+    itens, erros = [], []
+    for n, ln in enumerate(linhas, start=1):
+        if not isinstance(ln, dict):
+            erros.append({"linha": n, "erro": "linha deve ser um objeto"}); continue
+        descricao = str(ln.get("descricao") or "").strip()[:120]
+        if not descricao:
+            erros.append({"linha": n, "erro": "descricao obrigatória"}); continue
+        try:
+            qtd = float(str(ln.get("quantidade") or 1).replace(",", "."))
+            valor = float(str(ln.get("valor_unit") or 0).replace(",", "."))
+        except ValueError:
+            erros.append({"linha": n, "erro": "quantidade/valor_unit inválidos"}); continue
+        if qtd <= 0 or valor < 0:
+            erros.append({"linha": n, "erro": "quantidade deve ser > 0 e valor_unit >= 0"}); continue
+        itens.append({"descricao": descricao, "quantidade": qtd, "valor_unit": valor})
+    return itens, erros
+
+@app.route("/os/<int:os_id>/itens/importar", methods=["POST"])
+@login_required(role="gestor", retry=True)
+def os_importar_itens(os_id):
+    # Importa a cotação do fornecedor (JSON/CSV: descricao, quantidade, valor_unit) de uma vez:
+    # um INSERT em lote, um delta no total e uma auditoria.
+    osr = OrdemServico.query.get_or_404(os_id)
+    via_form = "arquivo" in request.files
+    try:
+        linhas, _topo = read_payload_rows("itens")
+    except (ValueError, UnicodeDecodeError) as e:
+        if via_form:
+            flash(f"Arquivo inválido: {e}", "error")
+            return redirect(url_for("os_detalhe", os_id=osr.id))
+        return jsonify({"erro": str(e)}), 400
+    itens, erros = _item_os_rows(linhas)
+    if itens:
+        db.session.execute(insert(ItemOS), [{"os_id": osr.id, **i} for i in itens])
+        add_os_cost(osr.id, round(sum(round(i["quantidade"] * i["valor_unit"], 2) for i in itens), 2))
+        audit("importar","ItemOS", None, f"os={osr.id} itens={len(itens)}")
+        db.session.commit()
+    if via_form:
+        flash(f"{len(itens)} itens importados." + (f" {len(erros)} linhas com erro." if erros else ""), "ok" if itens else "error")
+        return redirect(url_for("os_detalhe", os_id=osr.id))
+    return jsonify({"recebidas": len(linhas), "gravadas": len(itens), "erros": erros})
 
 @app.route("/os/<int:os_id>/item", methods=["POST"])
-@login_required(role="gestor")
+@login_required(role="gestor", retry=True)
 def os_add_item(os_id):
     osr = OrdemServico.query.get_or_404(os_id)
     it = ItemOS(
@@ -510,38 +2956,148 @@ def os_add_item(os_id):
         descricao=request.form["descricao"],
         quantidade=float(request.form.get("quantidade") or 1),
         valor_unit=float(request.form.get("valor_unit") or 0),
+        pneu_id=int(request.form["pneu_id"]) if request.form.get("pneu_id") else None,
     )
     db.session.add(it); db.session.flush()
-    osr.custo_total = sum(i.subtotal for i in osr.itens)
-    db.session.commit()
+    add_os_cost(osr.id, it.subtotal)
     audit("criar","ItemOS", it.id, f"os={osr.id}")
+    db.session.commit()
     flash("Item adicionado.", "ok")
     return redirect(url_for("os_detalhe", os_id=osr.id))
 
 @app.route("/os/item/<int:item_id>/excluir", methods=["POST"])
-@login_required(role="gestor")
+@login_required(role="gestor", retry=True)
 def os_del_item(item_id):
     it = ItemOS.query.get_or_404(item_id)
     os_id = it.os_id
-    db.session.delete(it); db.session.commit()
-    osr = OrdemServico.query.get(os_id)
-    osr.custo_total = sum(i.subtotal for i in osr.itens)
-    db.session.commit()
+    db.session.delete(it)
+    add_os_cost(os_id, -it.subtotal)
     audit("excluir","ItemOS", it.id, f"os={os_id}")
+    db.session.commit()
     flash("Item removido.", "ok")
     return redirect(url_for("os_detalhe", os_id=os_id))
 
 @app.route("/os/<int:os_id>/status", methods=["POST"])
-@login_required(role="gestor")
+@login_required(role="gestor", retry=True)
 def os_status(os_id):
     osr = OrdemServico.query.get_or_404(os_id)
     osr.status = request.form["status"]
-    db.session.commit()
     audit("alterar_status","OS", osr.id, f"novo={osr.status}")
     notify("borracheiro", f"Status da OS #{osr.id} atualizado para {osr.status}", url_for("os_detalhe", os_id=osr.id))
+    db.session.commit()
     flash("Status da OS atualizado.", "ok")
     return redirect(url_for("os_detalhe", os_id=os_id))
 
+# ---- Relatórios ----
+@app.route("/relatorios")
+@login_required(role="gestor")
+def relatorios():
+    custos, por_status, avg_sulco = fleet_report()
+    return render_template("relatorios.html", custos=custos, por_status=por_status, avg_sulco=avg_sulco)
+
+@app.route("/relatorios/vida")
+@login_required(role="gestor")
+def relatorio_vida():
+    por = request.args.get("por", "modelo")
+    if por not in VIDA_GRUPOS:
+        por = "modelo"
+    calculado, grupos = tire_life_report(por)
+    return render_template("relatorio_vida.html", grupos=grupos, por=por, colunas=VIDA_GRUPOS[por],
+                           opcoes=list(VIDA_GRUPOS), calculado=calculado)
+
+@app.route("/api/analise/vida")
+@login_required(role="gestor")
+def api_analise_vida():
+    por = request.args.get("por", "modelo")
+    if por not in VIDA_GRUPOS:
+        return jsonify({"erro": f"por deve ser um de: {', '.join(VIDA_GRUPOS)}"}), 400
+    calculado, grupos = tire_life_report(por)
+    return jsonify({"calculado_em": calculado.isoformat() if calculado else None, "por": por, "grupos": grupos})
+
+@app.route("/api/pneus/<int:pid>/vida")
+@login_required()
+def api_vida_pneu(pid):
+    Pneu.query.get_or_404(pid)
+    r = db.session.get(RelVidaPneu, pid)
+    eventos = db.session.execute(select(EventoPneu.created_at, EventoPneu.tipo, EventoPneu.veiculo_id, EventoPneu.pos_label,
+                                        EventoPneu.destino, EventoPneu.km, EventoPneu.sulco)
+                                 .where(EventoPneu.pneu_id == pid).order_by(EventoPneu.created_at, EventoPneu.id)).all()
+    vida = None
+    if r:
+        vida = {c: getattr(r, c) for c in ("instalacoes", "km", "dias", "sulco_gasto", "custo")}
+        vida["custo_km"] = round(r.custo / r.km, 4) if r.km else None
+        vida["calculado_em"] = r.calculado_em.isoformat() if r.calculado_em else None
+    return jsonify({"pneu_id": pid, "vida": vida,
+                    "eventos": [dict(e._mapping, created_at=e.created_at.isoformat()) for e in eventos]})
+
+# ---- Auditoria ----
+AUDIT_EXPORT_CHUNK = 1000
+AUDIT_COLUMNS = ["id", "created_at", "user_email", "action", "entity", "entity_id", "details"]
+
+def _audit_filters(args):
+    # Filtros servidos pelos índices compostos (user_email|entity, entity_id, created_at)
+    conds = []
+    if args.get("usuario"):
+        conds.append(AuditLog.user_email == args["usuario"].strip().lower())
+    if args.get("entidade"):
+        conds.append(AuditLog.entity == args["entidade"].strip())
+    if args.get("entidade_id", "").strip().isdigit():
+        conds.append(AuditLog.entity_id == int(args["entidade_id"]))
+    try:
+        if args.get("de"):
+            conds.append(AuditLog.created_at >= datetime.fromisoformat(args["de"]))
+        if args.get("ate"):
+            conds.append(AuditLog.created_at < datetime.fromisoformat(args["ate"]) + timedelta(days=1))
+    except ValueError:
+        flash("Data inválida (use AAAA-MM-DD).", "error")
+    return conds
+
+@app.route("/auditoria")
+@login_required(role="gestor")
+def auditoria():
+    logs = keyset_page(AuditLog.query.filter(*_audit_filters(request.args)),
+                       [(AuditLog.created_at, True), (AuditLog.id, True)])
+    entidades = [e for (e,) in db.session.query(AuditLog.entity).distinct().order_by(AuditLog.entity)]
+    return render_template("auditoria.html", logs=logs, entidades=entidades, f=request.args)
+
+@app.route("/auditoria/exportar")
+@login_required(role="gestor")
+def auditoria_exportar():
+    # Exporta em streaming: lê do cursor em blocos de AUDIT_EXPORT_CHUNK linhas (yield_per)
+    # e envia cada bloco assim que fica pronto, sem carregar o log inteiro na memória.
+    formato = request.args.get("formato", "csv")
+    if formato not in ("csv", "ndjson"):
+        return jsonify({"erro": "formato deve ser csv ou ndjson"}), 400
+    stmt = (select(*[getattr(AuditLog, c) for c in AUDIT_COLUMNS])
+            .where(*_audit_filters(request.args))
+            .order_by(AuditLog.created_at, AuditLog.id)
+            .execution_options(yield_per=AUDIT_EXPORT_CHUNK))
+
+    def gerar():
+        result = db.session.execute(stmt)
+        if formato == "csv":
+            buf = io.StringIO()
+            w = csv.writer(buf)
+            w.writerow(AUDIT_COLUMNS)
+            yield buf.getvalue()
+        for bloco in result.partitions():
+            buf = io.StringIO()
+            if formato == "csv":
+                w = csv.writer(buf)
+                for r in bloco:
+                    w.writerow([r.created_at.isoformat() if c == "created_at" and r.created_at else getattr(r, c) for c in AUDIT_COLUMNS])
+            else:
+                for r in bloco:
+                    d = dict(r._mapping)
+                    d["created_at"] = d["created_at"].isoformat() if d["created_at"] else None
+                    buf.write(json.dumps(d, ensure_ascii=False) + "\n")
+            yield buf.getvalue()
+
+    nome = f"auditoria_{datetime.utcnow():%Y%m%d_%H%M%S}.{formato}"
+    mimetype = "text/csv" if formato == "csv" else "application/x-ndjson"
+    return Response(stream_with_context(gerar()), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename={nome}"})
+
 # ---- Borracheiro ----
 @app.route("/borracheiro")
 @login_required(role="borracheiro")
@@ -551,25 +3107,107 @@ def borracheiro_dashboard():
 @app.route("/fila")
 @login_required(role="borracheiro")
 def fila():
-    veiculos = Veiculo.query.order_by(Veiculo.placa).all()
-    return render_template("fila.html", veiculos=veiculos)
+    def gerar():
+        veiculos = keyset_page(Veiculo.query, [(Veiculo.placa, False), (Veiculo.id, False)])
+        return render_template("_fila_tabela.html", veiculos=veiculos), {"Veiculo"}
+    return render_template("fila.html", tabela=cached_fragment("fila", gerar), modelos=checklist_modelos())
+
+# ---- Alertas ----
+@app.route("/alertas", methods=["GET", "POST"])
+@login_required(retry=True)
+def alertas():
+    if request.method == "POST":
+        if current_user().role != "gestor":
+            abort(403)
+        t = enqueue("varrer-alertas", {"completa": request.form.get("completa") == "1"})
+        audit("enfileirar", "Tarefa", None, "varrer-alertas")
+        db.session.commit()
+        flash(f"Varredura de alertas #{t.id} enfileirada.", "ok")
+        return redirect(url_for("alertas"))
+    regra = request.args.get("regra", "")
+    base = AlertaPneu.query
+    if regra in ALERTA_REGRAS:
+        base = base.filter_by(regra=regra)
+    lista = keyset_page(base, [(AlertaPneu.id, True)])
+    contagem = dict(db.session.execute(select(AlertaPneu.regra, func.count(AlertaPneu.id))
+                                       .group_by(AlertaPneu.regra)).all())
+    ultima = VarreduraAlerta.query.order_by(VarreduraAlerta.id.desc()).first()
+    return render_template("alertas.html", alertas=lista, regra=regra, regras=ALERTA_REGRAS,
+                           contagem=contagem, ultima=ultima, limites=_alerta_limites(),
+                           gestor=current_user().role == "gestor")
+
+@app.route("/api/alertas")
+@login_required()
+def alertas_api():
+    base = AlertaPneu.query
+    if request.args.get("regra"):
+        base = base.filter_by(regra=request.args["regra"])
+    if request.args.get("veiculo_id", type=int):
+        base = base.filter_by(veiculo_id=request.args.get("veiculo_id", type=int))
+    pagina = keyset_page(base, [(AlertaPneu.id, True)])
+    return jsonify({"alertas": [{"id": x.id, "pneu_id": x.pneu_id, "veiculo_id": x.veiculo_id, "regra": x.regra,
+                                 "mensagem": x.mensagem, "desde": x.desde.isoformat()} for x in pagina],
+                    "cursor": pagina.next_cursor})
 
 # ---- Notificações ----
 @app.route("/notificacoes")
 @login_required()
 def notificacoes():
     u = current_user()
-    notes = Notificacao.query.filter_by(destino_role=u.role).order_by(Notificacao.created_at.desc()).all()
-    return render_template("notificacoes.html", notes=notes)
+    base = Notificacao.query.filter_by(destino_role=u.role)
+    nao_lidas = request.args.get("nao_lidas") == "1"
+    if nao_lidas:
+        base = base.filter_by(lida=False)
+    notes = keyset_page(base, [(Notificacao.created_at, True), (Notificacao.id, True)])
+    return render_template("notificacoes.html", notes=notes, nao_lidas=nao_lidas)
 
 @app.route("/notificacoes/<int:nid>/lida", methods=["POST"])
-@login_required()
+@login_required(retry=True)
 def notificacao_lida(nid):
     n = Notificacao.query.get_or_404(nid)
-    n.lida = True
+    if not n.lida:
+        n.lida = True
+        notify_read(n.destino_role, 1)
     db.session.commit()
     return redirect(url_for("notificacoes"))
 
+@app.route("/notificacoes/lidas", methods=["POST"])
+@login_required(retry=True)
+def notificacoes_todas_lidas():
+    # Marca todas as não lidas do perfil com um único UPDATE
+    u = current_user()
+    n = Notificacao.query.filter_by(destino_role=u.role, lida=False).update({"lida": True}, synchronize_session=False)
+    notify_read(u.role, n)
+    db.session.commit()
+    flash(f"{n} notificações marcadas como lidas.", "ok")
+    return redirect(url_for("notificacoes"))
+
+@app.route("/notificacoes/stream")
+@login_required()
+def notificacoes_stream():
+    # Server-sent events: "notificacao" a cada nova notificação do perfil, "contador" quando
+    # o nº de não lidas muda; comentário de keepalive a cada 15 s.
+    role = current_user().role
+    inicial = notification_hub.unread(role)
+    db.session.close()  # devolve a conexão ao pool enquanto o stream fica aberto
+    q = notification_hub.subscribe(role)
+
+    def gerar():
+        try:
+            yield f"retry: 5000\nevent: contador\ndata: {json.dumps({'nao_lidas': inicial})}\n\n"
+            while True:
+                try:
+                    evento, dados = q.get(timeout=15)
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                yield f"event: {evento}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+        finally:
+            notification_hub.unsubscribe(role, q)
+
+    return Response(gerar(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # ---- Inspeção / Checklist ----
 CHECKLIST_DEFAULT = [
     "Calibragem verificada",
@@ -579,103 +3217,1380 @@ CHECKLIST_DEFAULT = [
     "Torque porca de roda verificado",
 ]
 
+# Modelos de checklist ficam em memória (uma leitura da tabela); alterações invalidam no commit
+# e o TTL cobre edições feitas em outros processos. Sem modelos cadastrados vale CHECKLIST_DEFAULT.
+CHECKLIST_CACHE_TTL = 300
+_checklists = {"expira": 0, "modelos": None}
+_checklists_lock = threading.Lock()
+
+def checklist_modelos():
+    # [(id, nome, titulos, padrao)] ordenados por nome
+    with _checklists_lock:
+        if _checklists["modelos"] is not None and _checklists["expira"] > time.monotonic():
+            return _checklists["modelos"]
+    modelos = [(m.id, m.nome, m.titulos, m.padrao) for m in ChecklistModelo.query.order_by(ChecklistModelo.nome)]
+    with _checklists_lock:
+        _checklists.update(modelos=modelos, expira=time.monotonic() + CHECKLIST_CACHE_TTL)
+    return modelos
+
+def checklist_titulos(modelo_id=None):
+    modelos = checklist_modelos()
+    for mid, _nome, titulos, padrao in modelos:
+        if mid == modelo_id or (not modelo_id and padrao):
+            return titulos
+    return CHECKLIST_DEFAULT
+
+@event.listens_for(db.session, "after_flush")
+def _collect_checklist_changes(sess, flush_context):
+    if any(isinstance(o, ChecklistModelo) for o in (*sess.new, *sess.dirty, *sess.deleted)):
+        sess.info["checklists_mudaram"] = True
+
+@event.listens_for(db.session, "after_commit")
+def _reset_checklist_cache(sess):
+    if sess.info.pop("checklists_mudaram", False):
+        with _checklists_lock:
+            _checklists["modelos"] = None
+
+@event.listens_for(db.session, "after_rollback")
+def _discard_checklist_changes(sess):
+    sess.info.pop("checklists_mudaram", None)
+
+def create_inspections(vids, titulos):
+    # Abre uma inspeção por veículo com os itens do checklist: um INSERT em lote para as
+    # inspeções (RETURNING), outro para os itens e outro para a auditoria. Retorna os ids.
+    if not vids:
+        return []
+    # RETURNING sem ordem garantida sai em lote (com ordem o SQLite insere linha a linha);
+    # cada veículo aparece uma vez, então o veiculo_id devolvido identifica a inspeção.
+    por_veiculo = {}
+    for lote in chunks(vids, 2000):
+        por_veiculo.update(db.session.execute(insert(Inspecao).returning(Inspecao.veiculo_id, Inspecao.id),
+                                              [{"veiculo_id": vid, "status": "aberta"} for vid in lote]).all())
+    ids = [por_veiculo[vid] for vid in vids]
+    _inserir(InspecaoItem, [{"inspecao_id": iid, "titulo": t, "ok": False} for iid in ids for t in titulos])
+    u = current_user()
+    agora = datetime.utcnow()
+    _inserir(AuditLog, [{"user_email": u.email if u else None, "action": "criar", "entity": "Inspecao",
+                         "entity_id": iid, "details": f"vid={vid}", "created_at": agora} for iid, vid in zip(ids, vids)])
+    return ids
+
 @app.route("/veiculo/<int:vid>/inspecao/nova", methods=["POST"])
-@login_required(role="borracheiro")
+@login_required(role="borracheiro", retry=True)
 def inspecao_nova(vid):
     v = Veiculo.query.get_or_404(vid)
-    ins = Inspecao(veiculo_id=v.id, status="aberta")
-    db.session.add(ins); db.session.flush()
-    for t in CHECKLIST_DEFAULT:
-        db.session.add(InspecaoItem(inspecao_id=ins.id, titulo=t, ok=False))
+    iid, = create_inspections([v.id], checklist_titulos(request.form.get("modelo_id", type=int)))
+    db.session.commit()
+    return redirect(url_for("inspecao_editar", iid=iid))
+
+@app.route("/fila/inspecoes", methods=["POST"])
+@login_required(role="borracheiro", retry=True)
+def inspecoes_lote():
+    # Inicia o checklist de vários veículos da fila (marcados ou todos) numa transação;
+    # veículos que já têm inspeção aberta são pulados.
+    if request.form.get("todos") == "1":
+        vids = db.session.scalars(select(Veiculo.id).order_by(Veiculo.placa, Veiculo.id)).all()
+    else:
+        vids = list(dict.fromkeys(request.form.getlist("vid", type=int)))
+    existentes, abertas = set(), set()
+    for lote in chunks(vids):
+        existentes.update(db.session.scalars(select(Veiculo.id).where(Veiculo.id.in_(lote))))
+        abertas.update(db.session.scalars(select(Inspecao.veiculo_id).where(
+            Inspecao.veiculo_id.in_(lote), Inspecao.status == "aberta")))
+    novos = [vid for vid in vids if vid in existentes and vid not in abertas]
+    create_inspections(novos, checklist_titulos(request.form.get("modelo_id", type=int)))
     db.session.commit()
-    audit("criar","Inspecao", ins.id)
-    return redirect(url_for("inspecao_editar", iid=ins.id))
+    msg = f"{len(novos)} inspeções abertas."
+    if abertas:
+        msg += f" {len(abertas)} veículos já tinham inspeção aberta."
+    flash(msg, "ok" if novos else "error")
+    return redirect(url_for("fila"))
 
 @app.route("/inspecao/<int:iid>", methods=["GET","POST"])
-@login_required()
+@login_required(retry=True)
 def inspecao_editar(iid):
     ins = Inspecao.query.get_or_404(iid)
-    itens = InspecaoItem.query.filter_by(inspecao_id=ins.id).all()
     if request.method == "POST":
-        for it in itens:
-            it.ok = True if request.form.get(f"ok_{it.id}") == "on" else False
-            it.obs = request.form.get(f"obs_{it.id}")
-        ins.observacoes = request.form.get("observacoes")
+        # Grava só os itens cujo ok/obs mudou em relação ao banco (UPDATE em lote por id)
+        sujos = []
+        for item_id, ok, obs in db.session.execute(select(InspecaoItem.id, InspecaoItem.ok, InspecaoItem.obs)
+                                                   .where(InspecaoItem.inspecao_id == ins.id)):
+            if f"obs_{item_id}" not in request.form:
+                continue  # item fora do formulário enviado
+            novo_ok = request.form.get(f"ok_{item_id}") == "on"
+            novo_obs = request.form.get(f"obs_{item_id}") or None
+            if novo_ok != bool(ok) or novo_obs != (obs or None):
+                sujos.append({"id": item_id, "ok": novo_ok, "obs": novo_obs})
+        observacoes = request.form.get("observacoes")
+        if sujos:
+            db.session.execute(update(InspecaoItem), sujos)
+        if (observacoes or None) != (ins.observacoes or None):
+            ins.observacoes = observacoes
+        elif not sujos:
+            flash("Nada foi alterado.", "ok")
+            return redirect(url_for("inspecao_editar", iid=ins.id))
+        audit("editar","Inspecao", ins.id, f"itens={len(sujos)}")
         db.session.commit()
-        audit("editar","Inspecao", ins.id)
         flash("Checklist salvo.", "ok")
         return redirect(url_for("inspecao_editar", iid=ins.id))
+    itens = InspecaoItem.query.filter_by(inspecao_id=ins.id).order_by(InspecaoItem.id).all()
     v = Veiculo.query.get(ins.veiculo_id)
     return render_template("inspecao.html", ins=ins, itens=itens, v=v)
 
 @app.route("/inspecao/<int:iid>/enviar", methods=["POST"])
-@login_required(role="borracheiro")
+@login_required(role="borracheiro", retry=True)
 def inspecao_enviar(iid):
     ins = Inspecao.query.get_or_404(iid)
     ins.status = "enviada"
-    db.session.commit()
     v = Veiculo.query.get(ins.veiculo_id)
     notify("gestor", f"Checklist enviado para o veículo {v.placa}", url_for("inspecao_editar", iid=ins.id))
     audit("enviar","Inspecao", ins.id)
+    db.session.commit()
     flash("Inspeção enviada para aprovação do gestor.", "ok")
     return redirect(url_for("borracheiro_dashboard"))
 
 @app.route("/inspecao/<int:iid>/status", methods=["POST"])
-@login_required(role="gestor")
+@login_required(role="gestor", retry=True)
 def inspecao_status(iid):
     ins = Inspecao.query.get_or_404(iid)
     ins.status = request.form["status"]
-    db.session.commit()
     v = Veiculo.query.get(ins.veiculo_id)
     notify("borracheiro", f"Inspeção do veículo {v.placa} foi {ins.status}", url_for("inspecao_editar", iid=ins.id))
     audit("alterar_status","Inspecao", ins.id, f"novo={ins.status}")
+    db.session.commit()
     flash("Status da inspeção atualizado.", "ok")
     return redirect(url_for("gestor_dashboard"))
 
+@app.route("/checklists", methods=["GET", "POST"])
+@login_required(role="gestor", retry=True)
+def checklists():
+    if request.method == "POST":
+        nome = request.form.get("nome", "").strip()
+        titulos = [t.strip() for t in request.form.get("itens", "").splitlines() if t.strip()]
+        if not nome or not titulos:
+            flash("Informe o nome e ao menos um item.", "error")
+            return redirect(url_for("checklists"))
+        mid = request.form.get("id", type=int)
+        m = ChecklistModelo.query.get_or_404(mid) if mid else ChecklistModelo()
+        if ChecklistModelo.query.filter(ChecklistModelo.nome == nome, ChecklistModelo.id != (mid or 0)).first():
+            flash("Já existe um modelo com esse nome.", "error")
+            return redirect(url_for("checklists"))
+        m.nome, m.itens, m.padrao = nome, json.dumps(titulos, ensure_ascii=False), request.form.get("padrao") == "on"
+        if m.padrao:
+            db.session.execute(update(ChecklistModelo).where(ChecklistModelo.id != (mid or 0)).values(padrao=False))
+        db.session.add(m); db.session.flush()
+        audit("editar" if mid else "criar", "ChecklistModelo", m.id, f"itens={len(titulos)}")
+        db.session.commit()
+        flash("Modelo de checklist salvo.", "ok")
+        return redirect(url_for("checklists"))
+    editar = ChecklistModelo.query.get(request.args.get("editar", type=int) or 0)
+    return render_template("checklists.html", modelos=checklist_modelos(), editar=editar, padrao=CHECKLIST_DEFAULT)
+
+@app.route("/checklists/<int:mid>/excluir", methods=["POST"])
+@login_required(role="gestor", retry=True)
+def checklist_excluir(mid):
+    m = ChecklistModelo.query.get_or_404(mid)
+    db.session.delete(m)
+    audit("excluir", "ChecklistModelo", mid)
+    db.session.commit()
+    flash("Modelo removido.", "ok")
+    return redirect(url_for("checklists"))
+
 # ---- Uploads ----
-@app.route("/upload/os/<int:os_id>", methods=["POST"])
-@login_required()
-def upload_os(os_id):
+# Armazenamento endereçado por conteúdo: o arquivo é gravado em blocos num temporário
+# enquanto o sha256 é calculado e depois movido para UPLOAD_FOLDER/<sha[:2]>/<sha>.<ext>;
+# conteúdo repetido reaproveita o mesmo arquivo.
+UPLOAD_CHUNK = 64 * 1024
+
+class AnexoGrandeDemais(Exception):
+    pass
+
+def _copy_chunks(src, dst, limite, hasher=None, lidos=0):
+    while True:
+        bloco = src.read(UPLOAD_CHUNK)
+        if not bloco:
+            return lidos
+        lidos += len(bloco)
+        if lidos > limite:
+            raise AnexoGrandeDemais(f"Arquivo maior que {limite // (1024 * 1024)} MB.")
+        if hasher:
+            hasher.update(bloco)
+        dst.write(bloco)
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for bloco in iter(lambda: f.read(UPLOAD_CHUNK), b""):
+            h.update(bloco)
+    return h.hexdigest()
+
+def _blob_rel(sha, nome):
+    return f"{sha[:2]}/{sha}.{nome.rsplit('.', 1)[1].lower()}"
+
+def _commit_blob(tmp, sha, nome):
+    rel = _blob_rel(sha, nome)
+    final = os.path.join(app.config["UPLOAD_FOLDER"], rel)
+    if os.path.exists(final):
+        os.remove(tmp)  # já armazenado
+    else:
+        os.makedirs(os.path.dirname(final), exist_ok=True)
+        os.replace(tmp, final)
+    return rel
+
+def store_blob(stream, nome):
+    # Grava o stream em blocos calculando o sha256; retorna (caminho_relativo, sha256, tamanho).
+    fd, tmp = tempfile.mkstemp(dir=app.config["UPLOAD_PARTIAL_DIR"], suffix=".tmp")
+    h = hashlib.sha256()
+    try:
+        with os.fdopen(fd, "wb") as out:
+            tamanho = _copy_chunks(stream, out, app.config["ANEXO_MAX_BYTES"], h)
+        sha = h.hexdigest()
+        return _commit_blob(tmp, sha, nome), sha, tamanho
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def attach_blob(rel, sha, tamanho, nome, os_id=None, veiculo_id=None):
+    # Um Anexo por (conteúdo, OS/veículo): reenviar a mesma foto não duplica o registro.
+    existente = Anexo.query.filter_by(sha256=sha, os_id=os_id, veiculo_id=veiculo_id).first()
+    if existente:
+        return existente, False
+    a = Anexo(os_id=os_id, veiculo_id=veiculo_id, filename=rel, original=nome, sha256=sha, tamanho=tamanho)
+    db.session.add(a)
+    return a, True
+
+def _upload_form(destino, os_id=None, veiculo_id=None):
     f = request.files.get("arquivo")
     if not f or not allowed_file(f.filename):
         flash("Arquivo inválido (png, jpg, jpeg, pdf).", "error")
-        return redirect(url_for("os_detalhe", os_id=os_id))
+        return redirect(destino)
     name = secure_filename(f.filename)
-    save_as = f"{int(datetime.utcnow().timestamp())}_{name}"
-    f.save(os.path.join(app.config["UPLOAD_FOLDER"], save_as))
-    db.session.add(Anexo(os_id=os_id, filename=save_as, original=name))
-    db.session.commit()
-    flash("Anexo enviado.", "ok")
-    return redirect(url_for("os_detalhe", os_id=os_id))
+    try:
+        rel, sha, tamanho = store_blob(f.stream, name)
+    except AnexoGrandeDemais as e:
+        flash(str(e), "error")
+        return redirect(destino)
+    # o blob já está gravado: em banco ocupado só a linha do Anexo é repetida (o upload não é relido)
+    _a, novo = write_with_retry(lambda: attach_blob(rel, sha, tamanho, name, os_id=os_id, veiculo_id=veiculo_id))
+    schedule_thumbnail(rel)
+    flash("Anexo enviado." if novo else "Este arquivo já estava anexado.", "ok")
+    return redirect(destino)
+
+@app.route("/upload/os/<int:os_id>", methods=["POST"])
+@login_required()
+def upload_os(os_id):
+    return _upload_form(url_for("os_detalhe", os_id=os_id), os_id=os_id)
 
 @app.route("/upload/veiculo/<int:vid>", methods=["POST"])
 @login_required()
 def upload_veiculo(vid):
-    f = request.files.get("arquivo")
-    if not f or not allowed_file(f.filename):
-        flash("Arquivo inválido (png, jpg, jpeg, pdf).", "error")
-        return redirect(url_for("veiculo_detail", vid=vid))
-    name = secure_filename(f.filename)
-    save_as = f"{int(datetime.utcnow().timestamp())}_{name}"
-    f.save(os.path.join(app.config["UPLOAD_FOLDER"], save_as))
-    db.session.add(Anexo(veiculo_id=vid, filename=save_as, original=name))
-    db.session.commit()
-    flash("Anexo enviado.", "ok")
-    return redirect(url_for("veiculo_detail", vid=vid))
+    return _upload_form(url_for("veiculo_detail", vid=vid), veiculo_id=vid)
+
+# Upload retomável (celular em conexão ruim):
+#   POST  /api/uploads               {"nome", "tamanho", "os_id"|"veiculo_id"} -> {"id", "recebido": 0}
+#   PATCH /api/uploads/<id>          corpo = próximo bloco, header Upload-Offset = bytes já recebidos
+#   GET   /api/uploads/<id>          -> {"recebido"} para retomar de onde parou
+# Ao receber o último byte o arquivo é armazenado e vira Anexo.
+def _partial_path(up):
+    return os.path.join(app.config["UPLOAD_PARTIAL_DIR"], f"{up.id}.part")
+
+def _upload_do_usuario(uid):
+    # upload de outro usuário responde como inexistente
+    up = db.session.get(UploadParcial, uid)
+    if up is None or up.user_email != current_user().email:
+        abort(404)
+    return up
+
+@app.route("/api/uploads", methods=["POST"])
+@login_required()
+def upload_iniciar():
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"erro": "Envie um objeto JSON com nome, tamanho e os_id ou veiculo_id."}), 400
+    nome = secure_filename(str(data.get("nome") or ""))
+    try:
+        tamanho = int(data.get("tamanho") or 0)
+        os_id = int(data["os_id"]) if data.get("os_id") else None
+        veiculo_id = int(data["veiculo_id"]) if data.get("veiculo_id") else None
+    except (TypeError, ValueError):
+        return jsonify({"erro": "tamanho/os_id/veiculo_id inválidos"}), 400
+    if not nome or not allowed_file(nome):
+        return jsonify({"erro": "Arquivo inválido (png, jpg, jpeg, pdf)."}), 400
+    if not 0 < tamanho <= app.config["ANEXO_MAX_BYTES"]:
+        return jsonify({"erro": f"tamanho deve estar entre 1 e {app.config['ANEXO_MAX_BYTES']} bytes"}), 400
+    if bool(os_id) == bool(veiculo_id):
+        return jsonify({"erro": "informe os_id ou veiculo_id"}), 400
+    if os_id:
+        OrdemServico.query.get_or_404(os_id)
+    else:
+        Veiculo.query.get_or_404(veiculo_id)
+    uid, email = uuid.uuid4().hex, current_user().email
+
+    def gravar():
+        up = UploadParcial(id=uid, nome=nome, tamanho=tamanho, recebido=0, os_id=os_id, veiculo_id=veiculo_id,
+                           user_email=email)
+        db.session.add(up)
+        return up
+    open(_partial_path(write_with_retry(gravar)), "wb").close()
+    return jsonify({"id": uid, "recebido": 0, "tamanho": tamanho}), 201
+
+@app.route("/api/uploads/<uid>", methods=["GET"])
+@login_required()
+def upload_status(uid):
+    up = _upload_do_usuario(uid)
+    return jsonify({"id": up.id, "recebido": up.recebido, "tamanho": up.tamanho})
+
+@app.route("/api/uploads/<uid>", methods=["PATCH"])
+@login_required()
+def upload_bloco(uid):
+    # O corpo é lido uma única vez; em banco ocupado só as gravações no banco são repetidas.
+    up = _upload_do_usuario(uid)
+    nome, tamanho, os_id, veiculo_id = up.nome, up.tamanho, up.os_id, up.veiculo_id
+    offset = request.headers.get("Upload-Offset", type=int)
+    if offset != up.recebido:
+        return jsonify({"erro": "Upload-Offset não confere", "recebido": up.recebido}), 409
+    path = _partial_path(up)
+    with open(path, "r+b") as out:
+        out.seek(offset)
+        out.truncate()  # descarta restos de um bloco interrompido
+        try:
+            recebido = _copy_chunks(request.stream, out, tamanho, lidos=offset)
+        except AnexoGrandeDemais:
+            return jsonify({"erro": "bloco ultrapassa o tamanho declarado", "recebido": offset}), 413
+    if recebido < tamanho:
+        write_with_retry(lambda: db.session.execute(
+            update(UploadParcial).where(UploadParcial.id == uid).values(recebido=recebido)))
+        return jsonify({"id": uid, "recebido": recebido, "tamanho": tamanho})
+    sha = _file_sha256(path)
+    rel = _blob_rel(sha, nome)
+    final = os.path.join(app.config["UPLOAD_FOLDER"], rel)
+
+    def gravar():
+        a, _novo = attach_blob(rel, sha, tamanho, nome, os_id=os_id, veiculo_id=veiculo_id)
+        db.session.execute(delete(UploadParcial).where(UploadParcial.id == uid)); db.session.flush()
+        audit("upload", "Anexo", a.id, f"os={os_id} vid={veiculo_id} bytes={tamanho}")
+        return a.id
+
+    # o blob vai para o lugar antes do commit (um Anexo nunca aponta para arquivo ausente); se o
+    # banco falhar de vez, o parcial é restaurado e o cliente pode reenviar o último bloco
+    _commit_blob(path, sha, nome)
+    try:
+        anexo_id = write_with_retry(gravar)
+    except Exception:
+        shutil.copyfile(final, path)
+        raise
+    schedule_thumbnail(rel)
+    return jsonify({"id": uid, "recebido": recebido, "tamanho": tamanho, "anexo_id": anexo_id}), 201
+
+# ---- Entrega de anexos ----
+# Arquivos endereçados por conteúdo nunca mudam: o sha256 do nome é o ETag forte e o cache é
+# longo e imutável; send_file responde If-None-Match (304) e Range (206) para vídeos/PDFs grandes.
+ANEXO_MAX_AGE = 365 * 24 * 3600
+_BLOB_RE = re.compile(r"^[0-9a-f]{2}/([0-9a-f]{64})\.(\w+)$")
+
+def _send_cached(path, etag):
+    mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    if app.config["ANEXO_OFFLOAD"] == "x-accel":
+        rel = os.path.relpath(path, app.config["UPLOAD_FOLDER"]).replace(os.sep, "/")
+        resp = Response(mimetype=mimetype)
+        resp.headers["X-Accel-Redirect"] = f"{app.config['ANEXO_ACCEL_PREFIX']}/{rel}"
+        if etag:
+            resp.set_etag(etag)
+        resp.make_conditional(request)
+    else:
+        resp = send_file(path, mimetype=mimetype, conditional=True,
+                         etag=etag or True, max_age=ANEXO_MAX_AGE if etag else 0)
+    # Atrás de login: só o navegador guarda, nunca caches compartilhados.
+    resp.cache_control.public = False
+    resp.cache_control.private = True
+    if etag:
+        resp.cache_control.max_age = ANEXO_MAX_AGE
+        resp.cache_control.immutable = True
+    else:
+        resp.cache_control.no_cache = True  # anexo antigo (sem hash no nome): revalida sempre
+    return resp
+
+def _anexo_path(filename):
+    if any(p.startswith(".") for p in filename.split("/")):
+        abort(404)  # .parciais/.miniaturas não são servidos direto
+    path = os.path.join(app.config["UPLOAD_FOLDER"], *filename.split("/"))
+    if not os.path.isfile(path):
+        abort(404)
+    return path
 
 @app.route("/anexos/<path:filename>")
 @login_required()
 def serve_anexo(filename):
-    return send_from_directory(app.config["UPLOAD_FOLDER"], filename, as_attachment=False)
+    m = _BLOB_RE.match(filename)
+    return _send_cached(_anexo_path(filename), m.group(1) if m else None)
+
+# Miniaturas: um worker em segundo plano reduz a imagem logo após o upload;
+# enquanto não fica pronta (ou sem Pillow) a rota redireciona para o original.
+_thumb_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="miniaturas")
+_thumb_pendentes = set()
+_thumb_lock = threading.Lock()
+
+def _thumb_path(sha):
+    return os.path.join(app.config["THUMB_DIR"], sha[:2], f"{sha}_{app.config['THUMB_SIZE']}.jpg")
+
+def make_thumbnail(src, dst):
+    lado = app.config["THUMB_SIZE"]
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp = f"{dst}.{os.getpid()}.tmp"
+    with Image.open(src) as im:
+        im.draft("RGB", (lado, lado))  # JPEG: decodifica já reduzido
+        im = ImageOps.exif_transpose(im)
+        im.thumbnail((lado, lado))
+        if im.mode not in ("RGB", "L"):
+            im = im.convert("RGB")
+        im.save(tmp, "JPEG", quality=80, optimize=True)
+    os.replace(tmp, dst)
+
+def _gerar_miniatura(src, dst, sha):
+    try:
+        make_thumbnail(src, dst)
+    except Exception as e:
+        app.logger.warning("miniatura %s falhou: %s", sha, e)
+    finally:
+        with _thumb_lock:
+            _thumb_pendentes.discard(sha)
+
+def schedule_thumbnail(filename):
+    # Agenda a miniatura de um anexo de imagem; True se já existe ou foi agendada.
+    m = _BLOB_RE.match(filename or "")
+    if Image is None or not m or m.group(2).lower() not in IMAGE_EXT:
+        return False
+    sha = m.group(1)
+    dst = _thumb_path(sha)
+    if os.path.exists(dst):
+        return True
+    with _thumb_lock:
+        if sha in _thumb_pendentes:
+            return True
+        _thumb_pendentes.add(sha)
+    src = os.path.join(app.config["UPLOAD_FOLDER"], *filename.split("/"))
+    _thumb_pool.submit(_gerar_miniatura, src, dst, sha)
+    return True
+
+@app.route("/miniaturas/<path:filename>")
+@login_required()
+def anexo_miniatura(filename):
+    _anexo_path(filename)
+    m = _BLOB_RE.match(filename)
+    if m and os.path.exists(_thumb_path(m.group(1))):
+        return _send_cached(_thumb_path(m.group(1)), f"{m.group(1)}-{app.config['THUMB_SIZE']}")
+    schedule_thumbnail(filename)
+    resp = redirect(url_for("serve_anexo", filename=filename))
+    resp.cache_control.no_store = True  # a próxima visita já pega a miniatura
+    return resp
+
+@app.route("/api/cache")
+@login_required(role="gestor")
+def cache_stats():
+    with page_cache._lock:
+        stats = {nome: dict(d) for nome, d in page_cache.stats.items()}
+    for d in stats.values():
+        total = d["hits"] + d["misses"]
+        d["taxa_acerto"] = round(d["hits"] / total, 3) if total else None
+    return jsonify({"backend": app.config["PAGE_CACHE"], "ttl": app.config["PAGE_CACHE_TTL"],
+                    "fragmentos": stats, "invalidacoes": page_cache.invalidacoes})
+
+# ---- Tarefas em segundo plano ----
+# Operações pesadas (reconstruções, importação, arquivamento) viram linhas na tabela "tarefa" e a
+# rota responde na hora. Em cada processo um thread de despacho pega as pendentes (UPDATE ... WHERE
+# status='pendente' garante que só um processo executa cada uma) e roda no pool de JOB_WORKERS
+# threads, respeitando o limite de execuções simultâneas por tipo.
+JOB_TIPOS = {}  # tipo: (função, limite simultâneo, tentativas)
+JOB_MANUTENCAO = ["rebuild-relatorios", "rebuild-busca", "rebuild-medicoes", "rebuild-vida", "varrer-alertas",
+                  "arquivar-auditoria"]
+JOB_AGENDADAS = {"varrer-alertas": "ALERTA_INTERVALO_S"}  # tipo: chave do intervalo (s) em app.config
+
+def job(tipo, limite=1, tentativas=3):
+    def decorator(fn):
+        JOB_TIPOS[tipo] = (fn, limite, tentativas)
+        return fn
+    return decorator
+
+def enqueue(tipo, params=None, tentativas=None):
+    # Só adiciona à sessão: a tarefa entra no commit da rota e o runner é acordado depois dele.
+    _fn, _limite, padrao = JOB_TIPOS[tipo]
+    u = current_user() if has_request_context() else None
+    t = Tarefa(tipo=tipo, params=json.dumps(params or {}), max_tentativas=tentativas or padrao,
+               criado_por=(u.email if u else g.get("usuario_tarefa")), executar_apos=datetime.utcnow())
+    db.session.add(t)
+    return t
+
+class JobContext:
+    # Passado à função da tarefa. progresso() fica em memória (status ao vivo neste processo) e
+    # vai para o banco junto com o próximo commit da própria tarefa.
+    def __init__(self, tid):
+        self.id = tid
+        self.feito, self.total, self.mensagem = 0, None, None
+
+    def progresso(self, feito, total=None, mensagem=None):
+        self.feito = feito
+        self.total = total if total is not None else self.total
+        self.mensagem = mensagem or self.mensagem
+        db.session.execute(update(Tarefa).where(Tarefa.id == self.id).values(
+            feito=self.feito, total=self.total, mensagem=(self.mensagem or "")[:200], heartbeat_at=datetime.utcnow()))
+
+class JobRunner:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.acordar_evento = threading.Event()
+        self.ativos = {}  # id: JobContext
+        self.workers = 0
+        self.pool = None
+        self.thread = None
+        self.ultimo_pulso = 0
+        self.agendado = {}  # tipo: monotonic da última consulta (a cada 1/4 do intervalo)
+
+    def iniciar(self, workers):
+        with self.lock:
+            if self.thread or workers <= 0:
+                return
+            self.workers = workers
+            self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tarefas")
+            self.thread = threading.Thread(target=self._loop, name="tarefas-despacho", daemon=True)
+            self.thread.start()
+        self.acordar()
+
+    def acordar(self):
+        self.acordar_evento.set()
+
+    def ao_vivo(self, tid):
+        with self.lock:
+            return self.ativos.get(tid)
+
+    def _loop(self):
+        while True:
+            self.acordar_evento.wait(app.config["JOB_POLL_S"])
+            self.acordar_evento.clear()
+            try:
+                with app.app_context():
+                    self._pulso()
+                    self._agendar()
+                    self._despachar()
+            except Exception:
+                app.logger.exception("Despacho de tarefas falhou")
+
+    def _pulso(self):
+        # Marca as tarefas em execução aqui como vivas e devolve à fila as abandonadas.
+        agora = datetime.utcnow()
+        if time.monotonic() - self.ultimo_pulso < app.config["JOB_STALE_S"] / 4:
+            return
+        self.ultimo_pulso = time.monotonic()
+        with self.lock:
+            ids = list(self.ativos)
+        if ids:
+            db.session.execute(update(Tarefa).where(Tarefa.id.in_(ids)).values(heartbeat_at=agora))
+        corte = agora - timedelta(seconds=app.config["JOB_STALE_S"])
+        n = db.session.execute(update(Tarefa).where(Tarefa.status == "executando", Tarefa.heartbeat_at < corte,
+                                                    Tarefa.id.notin_(ids))
+                               .values(status="pendente", executar_apos=agora)).rowcount
+        db.session.commit()
+        if n:
+            app.logger.warning("%d tarefa(s) abandonada(s) voltaram à fila", n)
+
+    def _agendar(self):
+        # Tarefas periódicas: enfileira quando não há uma na fila e a última foi criada há mais que o
+        # intervalo (vale entre processos). As concluídas há mais de um dia são apagadas.
+        agora = datetime.utcnow()
+        for tipo, chave in JOB_AGENDADAS.items():
+            intervalo = app.config[chave]
+            if intervalo <= 0 or time.monotonic() - self.agendado.get(tipo, -intervalo) < intervalo / 4:
+                continue
+            self.agendado[tipo] = time.monotonic()
+            ultima = db.session.execute(select(Tarefa.status, Tarefa.created_at).where(Tarefa.tipo == tipo)
+                                        .order_by(Tarefa.id.desc()).limit(1)).first()
+            if ultima and (ultima.status in ("pendente", "executando")
+                           or ultima.created_at > agora - timedelta(seconds=intervalo)):
+                continue
+            db.session.execute(delete(Tarefa).where(Tarefa.tipo == tipo, Tarefa.status == "concluida",
+                                                    Tarefa.finished_at < agora - timedelta(days=1)))
+            enqueue(tipo)
+            db.session.commit()
+
+    def _despachar(self):
+        with self.lock:
+            livres = self.workers - len(self.ativos)
+        if livres <= 0:
+            return
+        agora = datetime.utcnow()
+        rodando = dict(db.session.execute(select(Tarefa.tipo, func.count(Tarefa.id))
+                                          .where(Tarefa.status == "executando").group_by(Tarefa.tipo)).all())
+        pendentes = db.session.execute(select(Tarefa.id, Tarefa.tipo)
+                                       .where(Tarefa.status == "pendente", Tarefa.executar_apos <= agora,
+                                              Tarefa.tipo.in_(list(JOB_TIPOS)))
+                                       .order_by(Tarefa.executar_apos, Tarefa.id).limit(livres * 4)).all()
+        for tid, tipo in pendentes:
+            if livres == 0:
+                break
+            if rodando.get(tipo, 0) >= JOB_TIPOS[tipo][1]:
+                continue
+            pegou = db.session.execute(update(Tarefa).where(Tarefa.id == tid, Tarefa.status == "pendente").values(
+                status="executando", tentativas=Tarefa.tentativas + 1, started_at=agora, heartbeat_at=agora)).rowcount
+            db.session.commit()
+            if not pegou:
+                continue  # outro processo chegou antes
+            rodando[tipo] = rodando.get(tipo, 0) + 1
+            livres -= 1
+            with self.lock:
+                self.ativos[tid] = JobContext(tid)
+            self.pool.submit(self._executar, tid)
+
+    def _executar(self, tid):
+        ctx = self.ativos[tid]
+        try:
+            with app.app_context():
+                t = db.session.get(Tarefa, tid)
+                fn = JOB_TIPOS[t.tipo][0]
+                g.usuario_tarefa = t.criado_por
+                try:
+                    resultado = fn(ctx, **json.loads(t.params or "{}"))
+                    db.session.commit()
+                    self._finalizar(tid, status="concluida", resultado=json.dumps(resultado, ensure_ascii=False, default=str),
+                                    erro=None, feito=ctx.feito, total=ctx.total, mensagem=ctx.mensagem)
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.exception("Tarefa %s (%s) falhou", tid, t.tipo)
+                    t = db.session.get(Tarefa, tid)
+                    erro = traceback.format_exc()[-4000:]
+                    if t.tentativas < t.max_tentativas:
+                        espera = app.config["JOB_RETRY_S"] * 2 ** (t.tentativas - 1)
+                        self._finalizar(tid, status="pendente", erro=erro, finished_at=None,
+                                        executar_apos=datetime.utcnow() + timedelta(seconds=espera))
+                    else:
+                        self._finalizar(tid, status="falhou", erro=erro)
+                        notify("gestor", f"Tarefa {t.tipo} #{tid} falhou: {str(e)[:120]}", "/tarefas")
+                        db.session.commit()
+        finally:
+            with self.lock:
+                self.ativos.pop(tid, None)
+            self.acordar()
+
+    def _finalizar(self, tid, **valores):
+        valores.setdefault("finished_at", datetime.utcnow())
+        for n in range(app.config["DB_WRITE_RETRIES"] + 1):
+            try:
+                db.session.execute(update(Tarefa).where(Tarefa.id == tid).values(**valores))
+                db.session.commit()
+                return
+            except OperationalError as e:
+                db.session.rollback()
+                if not _is_busy(e) or n == app.config["DB_WRITE_RETRIES"]:
+                    raise
+                time.sleep(0.05 * 2 ** n)
+
+job_runner = JobRunner()
+
+@event.listens_for(db.session, "after_flush")
+def _collect_new_jobs(sess, flush_context):
+    if any(isinstance(o, Tarefa) for o in sess.new):
+        sess.info["tarefas_novas"] = True
+
+@event.listens_for(db.session, "after_commit")
+def _wake_job_runner(sess):
+    if sess.info.pop("tarefas_novas", False):
+        job_runner.acordar()
+
+@event.listens_for(db.session, "after_rollback")
+def _discard_new_jobs(sess):
+    sess.info.pop("tarefas_novas", None)
+
+@app.before_request
+def _iniciar_tarefas():
+    if job_runner.thread is None:
+        job_runner.iniciar(app.config["JOB_WORKERS"])
+
+@job("rebuild-relatorios")
+def _job_rebuild_relatorios(ctx):
+    return {"materializado": ensure_report_tables(rebuild=True)}
+
+@job("rebuild-busca")
+def _job_rebuild_busca(ctx):
+    return {"fts5": ensure_search_index(rebuild=True)}
+
+@job("rebuild-medicoes")
+def _job_rebuild_medicoes(ctx):
+    return rebuild_medicoes()
+
+@job("rebuild-vida")
+def _job_rebuild_vida(ctx):
+    return rebuild_tire_life()
+
+@job("varrer-alertas", tentativas=1)
+def _job_varrer_alertas(ctx, completa=False):
+    # tentativas=1: a próxima execução agendada já recomeça da mesma marca d'água
+    return scan_alerts(completa=bool(completa))
+
+@job("arquivar-auditoria", tentativas=1)
+def _job_arquivar_auditoria(ctx, dias=365):
+    return {"arquivados": archive_audit(int(dias))}
+
+@job("importar", tentativas=1)
+def _job_importar(ctx, tipo, caminho, nome):
+    # tentativas=1: os lotes já gravados não devem ser reaplicados (medições duplicariam)
+    try:
+        with open(caminho, "rb") as fh:
+            _cab, linhas = _import_rows(fh, nome)
+            for d in run_import(tipo, linhas):
+                ctx.progresso(d["linhas"], mensagem=d.get("falha") or (f"{tipo}: lote {d['lote']}" if "lote" in d else f"{tipo}: fim"))
+        return d
+    finally:
+        if os.path.exists(caminho):
+            os.remove(caminho)
+
+def _tarefa_json(t):
+    d = {c: getattr(t, c) for c in ("id", "tipo", "status", "tentativas", "max_tentativas", "feito", "total",
+                                     "mensagem", "criado_por", "erro")}
+    for c in ("created_at", "started_at", "finished_at", "executar_apos"):
+        d[c] = getattr(t, c).isoformat() if getattr(t, c) else None
+    d["params"] = json.loads(t.params or "{}")
+    d["resultado"] = json.loads(t.resultado) if t.resultado else None
+    vivo = job_runner.ao_vivo(t.id)
+    if vivo and t.status == "executando":
+        d.update(feito=vivo.feito, total=vivo.total, mensagem=vivo.mensagem)
+    return d
+
+@app.route("/tarefas", methods=["GET", "POST"])
+@login_required(role="gestor", retry=True)
+def tarefas():
+    if request.method == "POST":
+        tipo = request.form.get("tipo")
+        if tipo not in JOB_MANUTENCAO:
+            abort(400)
+        params = {}
+        if tipo == "arquivar-auditoria":
+            dias = request.form.get("dias", type=int) if request.form.get("dias") else 365
+            if not dias or dias <= 0:
+                flash("Informe o nº de dias como inteiro positivo.", "error")
+                return redirect(url_for("tarefas"))
+            params = {"dias": dias}
+        t = enqueue(tipo, params)
+        audit("enfileirar", "Tarefa", None, tipo)
+        db.session.commit()
+        flash(f"Tarefa {tipo} #{t.id} enfileirada.", "ok")
+        return redirect(url_for("tarefas"))
+    lista = keyset_page(Tarefa.query, [(Tarefa.id, True)])
+    return render_template("tarefas.html", tarefas=lista, manutencao=JOB_MANUTENCAO,
+                           workers=app.config["JOB_WORKERS"])
+
+@app.route("/api/tarefas")
+@login_required(role="gestor")
+def tarefas_api():
+    q = Tarefa.query
+    if request.args.get("status"):
+        q = q.filter(Tarefa.status == request.args["status"])
+    return jsonify([_tarefa_json(t) for t in q.order_by(Tarefa.id.desc()).limit(PAGE_SIZE)])
+
+@app.route("/api/tarefas/<int:tid>")
+@login_required(role="gestor")
+def tarefa_status(tid):
+    return jsonify(_tarefa_json(Tarefa.query.get_or_404(tid)))
+
+@app.route("/api/tarefas/<int:tid>/cancelar", methods=["POST"])
+@login_required(role="gestor", retry=True)
+def tarefa_cancelar(tid):
+    # só pendentes: uma tarefa em execução não é interrompida no meio
+    n = db.session.execute(update(Tarefa).where(Tarefa.id == tid, Tarefa.status == "pendente")
+                           .values(status="cancelada", finished_at=datetime.utcnow())).rowcount
+    if n:
+        audit("cancelar", "Tarefa", tid)
+    db.session.commit()
+    if not n:
+        return jsonify({"erro": "tarefa não está pendente"}), 409
+    return jsonify(_tarefa_json(Tarefa.query.get_or_404(tid)))
 
 # ---- CLI ----
 @app.cli.command("init-db")
 def init_db_cli():
     db.drop_all()
     db.create_all()
+    ensure_search_index(rebuild=True)
+    ensure_report_tables(rebuild=True)
     seed_demo()
     print("Banco inicializado com dados de exemplo.")
 
+def _missing_columns(conn, table):
+    existentes = {c["name"] for c in db.inspect(conn).get_columns(table.name)}
+    return [c for c in table.columns if c.name not in existentes]
+
+@app.cli.command("migrate-db")
+def migrate_db_cli():
+    # Atualiza um banco existente sem apagar dados: cria tabelas novas, adiciona colunas
+    # que faltam e cria os índices declarados nos modelos.
+    dup = (db.session.query(Pneu.codigo_barras, func.count(Pneu.id))
+           .filter(Pneu.codigo_barras.isnot(None), Pneu.codigo_barras != "")
+           .group_by(Pneu.codigo_barras).having(func.count(Pneu.id) > 1).all())
+    if dup:
+        for codigo, n in dup:
+            print(f"Código de barras duplicado: {codigo} ({n} pneus)")
+        print("Corrija os duplicados antes de migrar (índice único em pneu.codigo_barras).")
+        sys.exit(1)
+    db.session.execute(text("UPDATE pneu SET codigo_barras = NULL WHERE codigo_barras = ''"))
+    db.session.commit()
+    db.create_all()
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            for col in _missing_columns(conn, table):
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(db.engine.dialect)}"
+                default = col.default.arg if col.default is not None and col.default.is_scalar else None
+                if default is not None:
+                    ddl += f" DEFAULT {int(default) if isinstance(default, bool) else repr(default)}"
+                conn.execute(text(ddl))
+                print(f"+ coluna {table.name}.{col.name}")
+            for index in table.indexes:
+                existentes = {i["name"] for i in db.inspect(conn).get_indexes(table.name)}
+                if index.name not in existentes:
+                    index.create(bind=conn)
+                    print(f"+ índice {index.name}")
+        conn.execute(text("ANALYZE"))
+    ensure_search_index()
+    ensure_report_tables()
+    print("Migração concluída.")
+
+# expressões de "início do período" por dialeto, usadas na reconstrução em SQL
+BUCKETS_SQL = {
+    "sqlite": {"dia": "date(created_at)", "semana": "date(created_at, 'weekday 0', '-6 days')",
+               "mes": "date(created_at, 'start of month')"},
+    "postgresql": {"dia": "date_trunc('day', created_at)::date", "semana": "date_trunc('week', created_at)::date",
+                   "mes": "date_trunc('month', created_at)::date"},
+}
+
+def rebuild_medicoes():
+    # Recalcula todos os resumos a partir da série bruta (GROUP BY no banco).
+    buckets = BUCKETS_SQL[db.engine.dialect.name]
+    somas = "count(sulco), coalesce(sum(sulco), 0), count(pressao), coalesce(sum(pressao), 0)"
+    MedicaoResumo.query.delete()
+    for periodo, expr in buckets.items():
+        for alvo, grupo in (("pneu_id", f"{expr}, pneu_id"), (str(FROTA), expr)):
+            db.session.execute(text(
+                f"INSERT INTO medicao_resumo (periodo, inicio, pneu_id, {', '.join(RESUMO_SOMAS)}) "
+                f"SELECT :p, {expr}, {alvo}, {somas} FROM medicao GROUP BY {grupo}"), {"p": periodo})
+    db.session.commit()
+    return {"resumos": MedicaoResumo.query.count(), "medicoes": Medicao.query.count()}
+
+@app.cli.command("rebuild-medicoes")
+def rebuild_medicoes_cli():
+    r = rebuild_medicoes()
+    print(f"Resumos reconstruídos: {r['resumos']} linhas de {r['medicoes']} medições.")
+
+@app.cli.command("rebuild-relatorios")
+def rebuild_relatorios_cli():
+    if ensure_report_tables(rebuild=True):
+        print("Relatórios materializados reconstruídos.")
+    else:
+        print("Banco sem suporte aos relatórios materializados; /relatorios agrega na hora.")
+
+def archive_audit(dias, log=app.logger.info):
+    # Move AuditLog antigos para audit_archive/audit_AAAA.db (um arquivo por ano), via ATTACH:
+    # cópia e remoção do banco principal acontecem na mesma transação.
+    if db.engine.dialect.name != "sqlite":
+        raise RuntimeError("Arquivamento em arquivos SQLite só está disponível com SQLite.")
+    corte = datetime.utcnow() - timedelta(days=dias)
+    anos = [int(a) for (a,) in db.session.execute(
+        text("SELECT DISTINCT strftime('%Y', created_at) FROM audit_log WHERE created_at < :c"), {"c": corte}) if a]
+    db.session.remove()
+    os.makedirs(app.config["AUDIT_ARCHIVE_DIR"], exist_ok=True)
+    cols = ", ".join(c.name for c in AuditLog.__table__.columns)
+    total = 0
+    with db.engine.connect() as conn:
+        for ano in sorted(anos):
+            path = os.path.join(app.config["AUDIT_ARCHIVE_DIR"], f"audit_{ano}.db")
+            ini, fim = datetime(ano, 1, 1), min(datetime(ano + 1, 1, 1), corte)
+            conn.exec_driver_sql("ATTACH DATABASE ? AS arq", (path,)); conn.commit()
+            try:
+                with conn.begin():
+                    conn.execute(text("CREATE TABLE IF NOT EXISTS arq.audit_log AS SELECT * FROM main.audit_log WHERE 0"))
+                    conn.execute(text("CREATE INDEX IF NOT EXISTS arq.ix_audit_log_created ON audit_log (created_at)"))
+                    filtro = "created_at >= :ini AND created_at < :fim"
+                    n = conn.execute(text(f"INSERT INTO arq.audit_log ({cols}) SELECT {cols} FROM main.audit_log WHERE {filtro}"),
+                                     {"ini": ini, "fim": fim}).rowcount
+                    conn.execute(text(f"DELETE FROM main.audit_log WHERE {filtro}"), {"ini": ini, "fim": fim})
+            finally:
+                conn.exec_driver_sql("DETACH DATABASE arq"); conn.commit()
+            total += n
+            log(f"{ano}: {n} registros -> {path}")
+    log(f"{total} registros arquivados (anteriores a {corte:%Y-%m-%d}).")
+    return total
+
+@app.cli.command("archive-audit")
+@click.option("--dias", default=365, help="Arquiva registros mais antigos que N dias.")
+def archive_audit_cli(dias):
+    try:
+        archive_audit(dias, log=print)
+    except RuntimeError as e:
+        print(e)
+        sys.exit(1)
+
+@app.cli.command("check-os-totals")
+@click.option("--fix", is_flag=True, help="Corrige os totais divergentes.")
+def check_os_totals_cli(fix):
+    # Recalcula os totais das OS em SQL a partir dos itens e lista as divergências.
+    sql = text("""
+        SELECT o.id, coalesce(o.custo_total, 0) AS gravado,
+               coalesce(round(sum(round(coalesce(i.quantidade, 0) * coalesce(i.valor_unit, 0), 2)), 2), 0) AS calculado
+        FROM ordem_servico o LEFT JOIN item_os i ON i.os_id = o.id
+        GROUP BY o.id, o.custo_total
+        HAVING abs(coalesce(o.custo_total, 0) - coalesce(round(sum(round(coalesce(i.quantidade, 0) * coalesce(i.valor_unit, 0), 2)), 2), 0)) > 0.005
+    """)
+    divergentes = db.session.execute(sql).all()
+    for os_id, gravado, calculado in divergentes:
+        print(f"OS #{os_id}: gravado {gravado:.2f} / itens {calculado:.2f} (diferença {gravado - calculado:+.2f})")
+    if fix and divergentes:
+        db.session.execute(update(OrdemServico), [{"id": o, "custo_total": c} for o, _g, c in divergentes])
+        db.session.commit()
+        print(f"{len(divergentes)} OS corrigidas.")
+    elif not divergentes:
+        print("Todos os totais conferem.")
+    else:
+        sys.exit(1)
+
+@app.cli.command("build-thumbnails")
+def build_thumbnails_cli():
+    if Image is None:
+        print("Pillow não instalado (pip install Pillow); miniaturas desativadas.")
+        return
+    feitas = 0
+    for (filename,) in db.session.execute(select(Anexo.filename).where(Anexo.sha256.is_not(None))):
+        m = _BLOB_RE.match(filename or "")
+        if not m or m.group(2).lower() not in IMAGE_EXT or os.path.exists(_thumb_path(m.group(1))):
+            continue
+        try:
+            make_thumbnail(os.path.join(app.config["UPLOAD_FOLDER"], *filename.split("/")), _thumb_path(m.group(1)))
+            feitas += 1
+        except Exception as e:
+            print(f"{filename}: {e}")
+    print(f"{feitas} miniaturas geradas.")
+
+@app.cli.command("purge-uploads")
+@click.option("--horas", default=48, help="Remove uploads retomáveis parados há mais de N horas.")
+def purge_uploads_cli(horas):
+    corte = datetime.utcnow() - timedelta(hours=horas)
+    velhos = UploadParcial.query.filter(UploadParcial.created_at < corte).all()
+    for up in velhos:
+        if os.path.exists(_partial_path(up)):
+            os.remove(_partial_path(up))
+        db.session.delete(up)
+    db.session.commit()
+    print(f"{len(velhos)} uploads parciais removidos.")
+
+@app.cli.command("rebuild-vida")
+def rebuild_vida_cli():
+    r = rebuild_tire_life()
+    print(f"Vida útil recalculada: {r['pneus']} pneus a partir de {r['eventos']} eventos em {r['segundos']}s"
+          + ("" if r["numpy"] else " (sem NumPy: pip install numpy acelera o cálculo)") + ".")
+
+@app.cli.command("scan-alerts")
+@click.option("--completa", is_flag=True, help="Reavalia todos os pneus montados, ignorando a marca d'água.")
+def scan_alerts_cli(completa):
+    r = scan_alerts(completa=completa)
+    print(f"Varredura {'completa' if r['completa'] else 'incremental'}: {r['avaliados']} pneus avaliados, "
+          f"{r['abertos']} alertas novos, {r['encerrados']} encerrados, {r['ativos']} ativos em {r['segundos']}s.")
+
+@app.cli.command("backfill-eventos")
+def backfill_eventos_cli():
+    # Converte as instalações/retiradas antigas da auditoria ("vid=.. pos=..") em EventoPneu, sem
+    # hodômetro nem sulco. Só roda com a tabela de eventos vazia.
+    if db.session.execute(select(EventoPneu.id).limit(1)).first():
+        print("evento_pneu já tem dados; nada feito.")
+        sys.exit(1)
+    existentes = set(db.session.execute(select(Pneu.id)).scalars())
+    padrao = re.compile(r"vid=(\d+)(?: pos=(.*))?")
+    stmt = (select(AuditLog.action, AuditLog.entity_id, AuditLog.details, AuditLog.created_at)
+            .where(AuditLog.entity == "Pneu", AuditLog.action.in_(("instalar", "desinstalar")))
+            .order_by(AuditLog.id).execution_options(yield_per=AUDIT_EXPORT_CHUNK))
+    total = 0
+    for bloco in db.session.execute(stmt).partitions():
+        linhas = []
+        for acao, pneu_id, detalhes, quando in bloco:
+            m = padrao.match(detalhes or "")
+            if m and pneu_id in existentes:
+                linhas.append({"pneu_id": pneu_id, "veiculo_id": int(m.group(1)), "pos_label": (m.group(2) or "")[:60] or None,
+                               "tipo": "instalar" if acao == "instalar" else "retirar", "created_at": quando})
+        _inserir(EventoPneu, linhas)
+        total += len(linhas)
+    db.session.commit()
+    print(f"{total} eventos criados a partir da auditoria.")
+
+@app.cli.command("rebuild-search")
+def rebuild_search_cli():
+    if ensure_search_index(rebuild=True):
+        print(f"Índice de busca reconstruído ({Pneu.query.count()} pneus).")
+    else:
+        print("FTS5 indisponível neste banco; a busca usa LIKE.")
+
+@app.cli.command("run-jobs")
+@click.option("--workers", default=2, help="Tarefas executadas ao mesmo tempo.")
+def run_jobs_cli(workers):
+    # Executor dedicado: use com PNEUTRACK_JOB_WORKERS=0 nos processos web.
+    job_runner.iniciar(workers)
+    print(f"Executando tarefas com {workers} workers (Ctrl+C para sair).")
+    try:
+        while job_runner.thread.is_alive():
+            job_runner.thread.join(1)
+    except KeyboardInterrupt:
+        pass
+
+# Rotas checadas pelo check-queries: (perfil, endpoint, kwargs)
+QUERY_CHECK_ROUTES = [
+    ("gestor", "gestor_dashboard", {}),
+    ("gestor", "relatorios", {}),
+    ("gestor", "auditoria", {}),
+    ("gestor", "servicos_autorizados", {}),
+    ("gestor", "os_list", {}),
+    ("gestor", "pneus_list", {}),
+    ("gestor", "veiculos_list", {}),
+    ("gestor", "veiculo_detail", {"vid": None}),
+    ("gestor", "notificacoes", {}),
+    ("borracheiro", "fila", {}),
+]
+
+def _qc_add_rows(v, eixo, n):
+    for i in range(n):
+        p = Pneu(numero_serie=f"QC-{v.id}-{i}", marca="QC", modelo="QC", medida="QC", status="ativo")
+        db.session.add(p)
+        db.session.add(PosicaoPneu(veiculo_id=v.id, eixo_id=eixo.id, pos_label=f"QC {i}", pneu=p))
+        db.session.add(OrdemServico(veiculo_id=v.id, descricao=f"QC {i}", status="aberta", custo_total=0))
+        db.session.add(ServicoAutorizado(veiculo_id=v.id, descricao=f"QC {i}"))
+        db.session.add(Notificacao(destino_role="gestor", mensagem=f"QC {i}", link="#"))
+    db.session.commit()
+
+def _qc_measure(vid):
+    client = app.test_client()
+    emails = {u.role: u.email for u in User.query.all()}
+    counts = {}
+    for role, endpoint, kwargs in QUERY_CHECK_ROUTES:
+        with client.session_transaction() as s:
+            s["email"] = emails[role]
+        with app.test_request_context():
+            url = url_for(endpoint, **{k: (vid if v is None else v) for k, v in kwargs.items()})
+        page_cache.clear()  # mede a renderização, não o cache
+        with count_queries() as stmts:
+            r = client.get(url)
+        counts[endpoint] = (r.status_code, len(stmts))
+    return counts
+
+def _rodar_em_copia(args):
+    # Reexecuta o comando da CLI num subprocesso com PNEUTRACK_DB numa cópia temporária do banco
+    # (backup online do SQLite) e cache de fragmentos em memória: o banco real não é tocado.
+    if DATABASE_URL:
+        print("Com DATABASE_URL não há cópia automática: use --no-copia apontando para um banco descartável.")
+        return 1
+    with tempfile.TemporaryDirectory(prefix="pneutrack-copia-") as pasta:
+        copia = os.path.join(pasta, "pneutrack.db")
+        db.session.remove()
+        origem, destino = sqlite3.connect(DB_PATH), sqlite3.connect(copia)
+        try:
+            origem.backup(destino)
+        finally:
+            origem.close(); destino.close()
+        env = dict(os.environ, PNEUTRACK_DB=copia, PNEUTRACK_PAGE_CACHE="memory")
+        return subprocess.run([sys.executable, "-m", "flask", "--app", os.path.abspath(__file__), *args],
+                              env=env).returncode
+
+@app.cli.command("check-queries")
+@click.option("--rows", default=50, help="Linhas extras criadas entre as duas medições.")
+@click.option("--no-copia", "direto", is_flag=True, help="Roda no banco configurado em vez de uma cópia temporária.")
+def check_queries_cli(rows, direto):
+    # Mede o nº de SQL por rota com 1 linha e com 1+rows linhas; falha se crescer (N+1).
+    # Por padrão roda numa cópia do banco: os dados "QC" (e o que os triggers derivam deles) somem com ela.
+    if not direto:
+        sys.exit(_rodar_em_copia(["check-queries", "--rows", str(rows), "--no-copia"]))
+    app.config["JOB_WORKERS"] = 0  # o despacho de tarefas entraria na contagem de SQL
+    seed_demo()
+    v = Veiculo(placa="QC0000", motorista="Query Check")
+    db.session.add(v); db.session.flush()
+    eixo = Eixo(veiculo_id=v.id, nome="QC", ordem=1)
+    db.session.add(eixo); db.session.commit()
+    failed = False
+    try:
+        _qc_add_rows(v, eixo, 1)
+        antes = _qc_measure(v.id)
+        _qc_add_rows(v, eixo, rows)
+        depois = _qc_measure(v.id)
+        for endpoint, (status, n1) in antes.items():
+            status2, n2 = depois[endpoint]
+            ok = status == status2 == 200 and n2 <= n1
+            failed = failed or not ok
+            print(f"{'OK ' if ok else 'ERR'} {endpoint:24} {n1:4d} -> {n2:4d} queries (HTTP {status2})")
+    finally:
+        db.session.rollback()
+        OrdemServico.query.filter_by(veiculo_id=v.id).delete()
+        Notificacao.query.filter(Notificacao.mensagem.like("QC %")).delete(synchronize_session=False)
+        pneu_ids = [p.pneu_id for p in PosicaoPneu.query.filter_by(veiculo_id=v.id)]
+        db.session.delete(Veiculo.query.get(v.id)); db.session.flush()
+        Pneu.query.filter(Pneu.id.in_(pneu_ids)).delete(synchronize_session=False)
+        db.session.commit()
+    if failed:
+        print("Número de queries cresce com o número de linhas (N+1).")
+        sys.exit(1)
+
+# ---- Frota sintética e benchmark ----
+# seed-fleet gera uma frota em escala de produção (distribuições fixas, semente reprodutível);
+# bench mede as rotas principais pelo test client. Rode numa cópia: PNEUTRACK_DB=/tmp/bench.db.
+SINT_MARCAS = [("Michelin", ["X Multi Z", "X Multi D"], 30), ("Pirelli", ["FG:01", "TR:01"], 20),
+               ("Bridgestone", ["R268", "M729"], 20), ("Goodyear", ["KMAX S", "KMAX D"], 15),
+               ("Continental", ["HSR2", "HDR2"], 15)]
+SINT_MEDIDAS = [("295/80 R22.5", 55), ("275/80 R22.5", 35), ("215/75 R17.5", 10)]
+# Configurações de eixo: (eixos [(nome, rodas)], peso) — toco, truck e bitruck
+SINT_EIXOS = [
+    ([("Dianteiro", 2), ("Traseiro 1º Eixo", 4)], 35),
+    ([("Dianteiro", 2), ("Traseiro 1º Eixo", 4), ("Traseiro 2º Eixo", 4)], 40),
+    ([("Dianteiro 1º Eixo", 2), ("Dianteiro 2º Eixo", 2), ("Traseiro 1º Eixo", 4), ("Traseiro 2º Eixo", 4)], 25),
+]
+SINT_LADOS = {2: ["Esquerdo", "Direito"], 4: ["Externo Esquerdo", "Interno Esquerdo", "Interno Direito", "Externo Direito"]}
+SINT_FORA = [("estoque", 60), ("recapagem", 15), ("conserto", 10), ("sucateado", 10), ("vendido", 5)]
+SINT_OS_STATUS = [("concluida", 60), ("aberta", 20), ("aprovada", 15), ("cancelada", 5)]
+# (descrição, quantidade mín/máx, valor mín/máx)
+SINT_ITENS = [("Recapagem", 1, 2, 450, 700), ("Conserto de pneu", 1, 2, 80, 150), ("Alinhamento", 1, 1, 120, 200),
+              ("Balanceamento", 2, 6, 25, 40), ("Válvula", 1, 4, 15, 30), ("Pneu novo", 1, 2, 1800, 2600)]
+SINT_ITENS_PNEU = {"Recapagem", "Conserto de pneu", "Pneu novo", "Válvula"}  # custo atribuído a um pneu montado
+SINT_NOMES = ["João", "Maria", "José", "Ana", "Carlos", "Paulo", "Lucas", "Marcos", "Fernanda", "Rafael", "Juliana", "Pedro"]
+SINT_SOBRENOMES = ["Silva", "Souza", "Oliveira", "Santos", "Pereira", "Lima", "Costa", "Ferreira", "Almeida", "Gomes"]
+
+def _sorteia(rng, opcoes):
+    return rng.choices([o[:-1] if len(o) > 2 else o[0] for o in opcoes], weights=[o[-1] for o in opcoes])[0]
+
+def _placa_sint(i):
+    # Permutação de i no espaço AAA9A99 (7919 é primo com 26^4*1000): placas únicas e espalhadas
+    n = (i * 7919 + 104729) % (26 ** 4 * 1000)
+    n, d2 = divmod(n, 100)
+    n, l4 = divmod(n, 26)
+    n, d1 = divmod(n, 10)
+    letras = ""
+    for _ in range(3):
+        n, r = divmod(n, 26)
+        letras += chr(65 + r)
+    return f"{letras}{d1}{chr(65 + l4)}{d2:02d}"
+
+def _ean13(n):
+    base = f"789{n:09d}"
+    soma = sum(int(c) * (3 if i % 2 else 1) for i, c in enumerate(base))
+    return base + str((10 - soma % 10) % 10)
+
+@app.cli.command("seed-fleet")
+@click.option("--veiculos", default=5000, help="Veículos a criar.")
+@click.option("--pneus", default=60000, help="Pneus a criar (os que sobram após ocupar as posições vão para estoque/recapagem/...).")
+@click.option("--ocupacao", default=0.95, help="Fração das posições com pneu instalado.")
+@click.option("--os-por-veiculo", default=3.0, help="Média de OS por veículo.")
+@click.option("--auditorias", default=100000, help="Registros de auditoria.")
+@click.option("--notificacoes", default=5000, help="Notificações.")
+@click.option("--dias", default=730, help="Janela de datas (dias para trás).")
+@click.option("--seed", default=42, help="Semente do gerador (mesma semente, mesma frota).")
+def seed_fleet_cli(veiculos, pneus, ocupacao, os_por_veiculo, auditorias, notificacoes, dias, seed):
+    import random
+    rng = random.Random(seed)
+    seed_demo()
+    agora = datetime.utcnow()
+    def quando():
+        return agora - timedelta(seconds=rng.randint(0, dias * 86400))
+    inicio = time.perf_counter()
+
+    existentes = {p for (p,) in db.session.execute(select(Veiculo.placa))}
+    placas, i = [], 0
+    while len(placas) < veiculos:
+        placa = _placa_sint(i); i += 1
+        if placa not in existentes:
+            placas.append(placa)
+    configs = [_sorteia(rng, SINT_EIXOS) for _ in placas]
+    rv = random.Random(seed + 1)  # sorteios do ciclo de vida em separado: a frota da mesma semente não muda
+    hodometros = [rv.randint(20000, 600000) for _ in placas]
+    vids = _inserir(Veiculo, [{"placa": p, "motorista": f"{rng.choice(SINT_NOMES)} {rng.choice(SINT_SOBRENOMES)}",
+                               "alerta_km_max": rng.choice([40000, 45000, 50000, 60000]), "hodometro": h}
+                              for p, h in zip(placas, hodometros)], ids=True)
+    hodometro = dict(zip(vids, hodometros))
+    eixos = [(vid, ordem, nome, rodas) for vid, cfg in zip(vids, configs) for ordem, (nome, rodas) in enumerate(cfg, 1)]
+    eids = _inserir(Eixo, [{"veiculo_id": vid, "nome": nome, "ordem": ordem} for vid, ordem, nome, _r in eixos], ids=True)
+    posicoes = [{"veiculo_id": vid, "eixo_id": eid, "pos_label": f"{nome.split()[0] if rodas == 2 else nome} {lado}", "pneu_id": None}
+                for eid, (vid, _o, nome, rodas) in zip(eids, eixos) for lado in SINT_LADOS[rodas]]
+    print(f"{len(vids)} veículos, {len(eids)} eixos, {len(posicoes)} posições")
+
+    base = (db.session.execute(select(func.max(Pneu.id))).scalar() or 0) + 1
+    instalados = [p for p in posicoes if rng.random() < ocupacao][:pneus]
+    linhas = []
+    for n in range(pneus):
+        marca, modelos = _sorteia(rng, SINT_MARCAS)
+        ativo = n < len(instalados)
+        sulco = round(rng.uniform(3, 18), 1) if ativo else round(rng.uniform(0, 18), 1)
+        linhas.append({"codigo_barras": _ean13(base + n), "numero_fogo": f"F{base + n}",
+                       "numero_serie": f"{marca[:3].upper()}-{rng.randint(2018, agora.year)}-{base + n:07d}",
+                       "marca": marca, "modelo": rng.choice(modelos), "medida": _sorteia(rng, SINT_MEDIDAS),
+                       "status": "ativo" if ativo else _sorteia(rng, SINT_FORA),
+                       "pressao": round(rng.gauss(100, 6), 1) if ativo else 0, "sulco": sulco})
+    pids = _inserir(Pneu, linhas, ids=True)
+    for pos, pid in zip(instalados, pids):
+        pos["pneu_id"] = pid
+    _inserir(PosicaoPneu, posicoes)
+    _inserir(Historico, [{"veiculo_id": pos["veiculo_id"], "pneu_id": pos["pneu_id"], "acao": "instalar",
+                          "created_at": quando(), "detalhes": pos["pos_label"]} for pos in instalados])
+    for lote in chunks([(pid, l) for pid, l in zip(pids, linhas) if l["status"] == "ativo"], 5000):
+        record_measurements([{"pneu_id": pid, "created_at": quando(), "pressao": l["pressao"], "sulco": l["sulco"]}
+                             for pid, l in lote])
+    # ciclo de vida: instalação dos montados (km e sulco coerentes com o rodado até hoje) e períodos
+    # anteriores dos pneus fora de uso, com a última retirada levando ao status atual
+    eventos = []
+    def evento(pid, vid, label, tipo, km, sulco, quando_ev, destino=None):
+        eventos.append({"pneu_id": pid, "veiculo_id": vid, "pos_label": label, "tipo": tipo, "destino": destino,
+                        "km": km, "sulco": round(min(sulco, 18.0), 1), "created_at": quando_ev})
+    for pos, pid, l in zip(instalados, pids, linhas):
+        rodado = rv.randint(0, min(hodometro[pos["veiculo_id"]], 120000))
+        evento(pid, pos["veiculo_id"], pos["pos_label"], "instalar", hodometro[pos["veiculo_id"]] - rodado,
+               l["sulco"] + rodado / rv.uniform(4000, 9000), agora - timedelta(days=rodado / rv.uniform(200, 600)))
+    for pid, l in zip(pids[len(instalados):], linhas[len(instalados):]):
+        if l["status"] == "estoque" and rv.random() < 0.7:
+            continue  # pneu novo, nunca montado
+        fim, sulco, destino = agora - timedelta(days=rv.uniform(1, dias / 4)), l["sulco"], l["status"]
+        for _ in range(rv.randint(1, 3)):
+            vid = rv.choice(vids)
+            rodado, taxa = rv.randint(10000, 80000), rv.uniform(4000, 9000)
+            km_fim = rv.randint(rodado, max(rodado, hodometro[vid]))
+            ini = fim - timedelta(days=rodado / rv.uniform(200, 600))
+            evento(pid, vid, None, "retirar", km_fim, sulco, fim, destino)
+            evento(pid, vid, None, "instalar", km_fim - rodado, sulco + rodado / taxa, ini)
+            fim, sulco, destino = ini - timedelta(days=rv.uniform(1, 30)), sulco + rodado / taxa, "estoque"
+            if sulco >= 18:
+                break
+    _inserir(EventoPneu, eventos)
+    db.session.commit()
+    print(f"{len(pids)} pneus ({len(instalados)} instalados), {len(eventos)} eventos de ciclo de vida")
+
+    ordens, itens_por_os = [], []
+    montados = {}
+    for pos in instalados:
+        montados.setdefault(pos["veiculo_id"], []).append(pos["pneu_id"])
+    for vid in vids:
+        for _ in range(rng.randint(0, round(2 * os_por_veiculo))):
+            itens = []
+            for _ in range(rng.randint(1, 5)):
+                desc, qmin, qmax, vmin, vmax = rng.choice(SINT_ITENS)
+                no_veiculo = montados.get(vid) if desc in SINT_ITENS_PNEU else None
+                itens.append({"descricao": desc, "quantidade": rng.randint(qmin, qmax), "valor_unit": round(rng.uniform(vmin, vmax), 2),
+                              "pneu_id": rv.choice(no_veiculo) if no_veiculo else None})
+            ordens.append({"veiculo_id": vid, "descricao": f"Manutenção de pneus — {itens[0]['descricao'].lower()}",
+                           "status": _sorteia(rng, SINT_OS_STATUS), "created_at": quando(),
+                           "custo_total": round(sum(round(it["quantidade"] * it["valor_unit"], 2) for it in itens), 2)})
+            itens_por_os.append(itens)
+    oids = _inserir(OrdemServico, ordens, ids=True)
+    _inserir(ItemOS, [dict(it, os_id=oid) for oid, itens in zip(oids, itens_por_os) for it in itens])
+    db.session.commit()
+    print(f"{len(oids)} OS com {sum(map(len, itens_por_os))} itens")
+
+    emails = [e for (e,) in db.session.execute(select(User.email))]
+    acoes = [("criar", "OS", oids), ("editar", "Pneu", pids), ("instalar", "Pneu", pids), ("medir", "Pneu", pids),
+             ("editar", "Veiculo", vids), ("item_add", "OS", oids)]
+    audits = []
+    for _ in range(auditorias):
+        acao, entidade, ids = rng.choice(acoes)
+        audits.append({"user_email": rng.choice(emails), "action": acao, "entity": entidade,
+                       "entity_id": rng.choice(ids) if ids else None, "details": "", "created_at": quando()})
+    _inserir(AuditLog, audits)
+    _inserir(Notificacao, [{"destino_role": rng.choice(["gestor", "gestor", "borracheiro"]),
+                            "mensagem": f"OS criada para veículo ID {rng.choice(vids)}", "link": "#",
+                            "lida": rng.random() < 0.7, "created_at": quando()} for _ in range(notificacoes)])
+    db.session.commit()
+    db.session.execute(text("ANALYZE"))
+    db.session.commit()
+    print(f"{auditorias} auditorias, {notificacoes} notificações — {time.perf_counter() - inicio:.1f}s")
+
+def _percentil(valores, p):
+    v = sorted(valores)
+    return v[max(0, -(-len(v) * p // 100) - 1)] if v else 0
+
+def _bench_cenarios(rng, total):
+    # [(nome, [(método, url, dados, url_desfazer)])]: amostras e URLs sorteadas antes da medição
+    amostra = lambda stmt: [tuple(r) if len(r) > 1 else r[0] for r in db.session.execute(stmt.order_by(func.random()).limit(500))]
+    vids = amostra(select(Veiculo.id))
+    codigos = amostra(select(Pneu.codigo_barras).where(Pneu.codigo_barras.is_not(None)))
+    vazias = amostra(select(PosicaoPneu.veiculo_id, PosicaoPneu.id).where(PosicaoPneu.pneu_id.is_(None)))
+    estoque = amostra(select(Pneu.id).where(Pneu.status == "estoque"))
+    buscas = [m for m, _mod, _p in SINT_MARCAS] + [c[:7] for c in codigos[:20]]
+    def get(endpoint, **kw):
+        return ("GET", url_for(endpoint, **kw), None, None)
+    def instalar():
+        vid, pid = rng.choice(vazias)
+        return ("POST", url_for("instalar_pneu", vid=vid, pid=pid), {"pneu_id": rng.choice(estoque)},
+                url_for("desinstalar_pneu", vid=vid, pid=pid))
+    cenarios = {
+        "pneus_list": lambda: get("pneus_list"),
+        "pneus_list?status": lambda: get("pneus_list", status=rng.choice(["estoque", "ativo", "recapagem"])),
+        "pneus_list?q": lambda: get("pneus_list", q=rng.choice(buscas)),
+        "veiculo_detail": lambda: get("veiculo_detail", vid=rng.choice(vids)),
+        "os_list": lambda: get("os_list"),
+        "os_list?status": lambda: get("os_list", status=rng.choice(["aberta", "concluida"])),
+    }
+    if codigos:
+        cenarios["barcode_tool"] = lambda: ("POST", url_for("barcode_tool"), {"codigo_barras": rng.choice(codigos)}, None)
+    if vazias and estoque:
+        cenarios["instalar_pneu (form)"] = lambda: get("instalar_pneu", vid=(p := rng.choice(vazias))[0], pid=p[1])
+        cenarios["instalar_pneu"] = instalar
+    if not vids:
+        raise click.ClickException("Banco sem veículos; gere dados com seed-fleet.")
+    with app.test_request_context():
+        return [(nome, [gerar() for _ in range(total)]) for nome, gerar in cenarios.items()]
+
+@app.cli.command("bench")
+@click.option("--n", default=200, help="Requisições medidas por cenário.")
+@click.option("--aquecimento", default=10, help="Requisições descartadas antes de medir.")
+@click.option("--seed", default=42, help="Semente do sorteio de URLs.")
+@click.option("--sem-cache", is_flag=True, help="Desliga o cache de fragmentos durante a medição.")
+@click.option("--json", "saida", type=click.Path(), help="Grava o resultado em JSON.")
+@click.option("--comparar", type=click.Path(exists=True), help="Resultado anterior (JSON); falha se houver regressão.")
+@click.option("--tolerancia", default=0.25, help="Piora aceita no p50 ao comparar (0.25 = 25%).")
+def bench_cli(n, aquecimento, seed, sem_cache, saida, comparar, tolerancia):
+    import random
+    rng = random.Random(seed)
+    app.config["JOB_WORKERS"] = 0  # o despacho de tarefas entraria na contagem de SQL
+    if sem_cache:
+        page_cache.backend = None
+    client = app.test_client()
+    gestor = User.query.filter_by(role="gestor").first()
+    with client.session_transaction() as s:
+        s["email"] = gestor.email
+    resultado = {"_meta": {"veiculos": Veiculo.query.count(), "pneus": Pneu.query.count(),
+                           "cache": "off" if sem_cache else app.config["PAGE_CACHE"], "n": n}}
+    print(f"{resultado['_meta']['veiculos']} veículos, {resultado['_meta']['pneus']} pneus, cache {resultado['_meta']['cache']}")
+    print(f"{'cenário':24} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'máx ms':>8} {'queries':>8}")
+    for nome, reqs in _bench_cenarios(rng, aquecimento + n):
+        tempos, queries = [], []
+        for i, (metodo, url, dados, desfazer) in enumerate(reqs):
+            with count_queries() as stmts:
+                t0 = time.perf_counter()
+                r = client.open(url, method=metodo, data=dados)
+                dt = time.perf_counter() - t0
+            if r.status_code not in (200, 302):
+                raise click.ClickException(f"{nome}: HTTP {r.status_code} em {metodo} {url}")
+            if desfazer:
+                client.post(desfazer)  # fora da medição: devolve o estado para a próxima iteração
+            if i >= aquecimento:
+                tempos.append(dt * 1000)
+                queries.append(len(stmts))
+        linha = {"p50": _percentil(tempos, 50), "p90": _percentil(tempos, 90), "p99": _percentil(tempos, 99),
+                 "max": max(tempos), "queries": sum(queries) / len(queries)}
+        resultado[nome] = linha
+        print(f"{nome:24} {linha['p50']:8.1f} {linha['p90']:8.1f} {linha['p99']:8.1f} {linha['max']:8.1f} {linha['queries']:8.1f}")
+    if saida:
+        with open(saida, "w") as f:
+            json.dump(resultado, f, indent=2)
+    if comparar:
+        with open(comparar) as f:
+            anterior = json.load(f)
+        regressoes = []
+        for nome, linha in resultado.items():
+            antes = anterior.get(nome)
+            if nome == "_meta" or not antes:
+                continue
+            if linha["p50"] > antes["p50"] * (1 + tolerancia):
+                regressoes.append(f"{nome}: p50 {antes['p50']:.1f} -> {linha['p50']:.1f} ms")
+            if linha["queries"] > antes["queries"] + 0.5:
+                regressoes.append(f"{nome}: queries {antes['queries']:.1f} -> {linha['queries']:.1f}")
+        for r in regressoes:
+            print("REGRESSÃO", r)
+        if regressoes:
+            sys.exit(1)
+        print("Sem regressões em relação a", comparar)
+
 # ---- MAIN ----
 if __name__ == "__main__":
     with app.app_context():